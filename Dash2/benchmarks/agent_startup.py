@@ -0,0 +1,41 @@
+"""
+Reports how many agents are constructed per second when every agent parses its definition, when parsed
+programs are cached in the process, and when they are read back from the disk cache.
+
+Usage: python agent_startup.py [number of agents]
+"""
+import sys; sys.path.extend(['../../'])
+import shutil
+import tempfile
+import time
+import Dash2.core.system2 as system2
+from Dash2.benchmarks.system2_memory import make_password_agent, make_mail_reader
+
+
+def agents_per_second(make_agent, n, mode):
+    system2.clear_program_cache()
+    start = time.time()
+    for i in range(n):
+        if mode != 'memory':
+            system2.clear_program_cache()  # 'disk' then loads the pickled program
+        make_agent(i)
+    return n / (time.time() - start)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    benchmarks = [('PasswordAgent', make_password_agent)]
+    try:
+        import Dash2.phish.mailReader
+        benchmarks.append(('MailReader', make_mail_reader))
+    except ImportError as e:
+        print('Skipping MailReader:', e)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for (name, make_agent) in benchmarks:
+            for mode in ['parse', 'memory', 'disk']:
+                system2.program_cache_dir = cache_dir if mode == 'disk' else None
+                print(name, mode, '%.0f agents/sec' % agents_per_second(make_agent, n, mode))
+    finally:
+        system2.program_cache_dir = None
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,53 @@
+"""
+Compares writing the event log of a DES run one event at a time (json.dump and a write for each event, as the agents'
+log_event did) with EventLogWriter (see event_log.py), buffered, with and without the background thread. Logs events
+shaped like NaiveAgent's to a file in the temp directory and reports microseconds per event.
+
+Usage: python event_log.py [number of events]
+"""
+import sys; sys.path.extend(['../../'])
+import json
+import os
+import tempfile
+import time
+from Dash2.core.event_log import EventLogWriter
+
+START_TIME = 1514764800  # 2018-01-01
+
+
+def events(n):
+    return [{'nodeUserID': 'user_' + str(i % 1000), 'nodeTime': START_TIME + i, 'platform': 'github',
+             'concept:name': 'PushEvent', 'nodeID': 'repo_' + str(i % 5000)} for i in range(n)]
+
+
+def write_each(path, log):
+    with open(path, 'w') as log_file:
+        for event in log:
+            json.dump(event, log_file)
+            log_file.write("\n")
+
+
+def write_buffered(path, log, **kwargs):
+    with open(path, 'w') as log_file:
+        writer = EventLogWriter(log_file, **kwargs)
+        for event in log:
+            writer.write(event)
+        writer.close()
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+    log = events(n)
+    path = os.path.join(tempfile.gettempdir(), 'event_log_benchmark.json')
+    runs = [('json.dump per event', write_each, {}),
+            ('EventLogWriter', write_buffered, {}),
+            ('EventLogWriter, background', write_buffered, {'background': True})]
+    expected = None
+    for (name, write, kwargs) in runs:
+        start = time.time()
+        write(path, log, **kwargs)
+        elapsed = time.time() - start
+        output = open(path).read()
+        expected = output if expected is None else expected
+        print('%-28s %6.2f us/event%s' % (name, elapsed / n * 1e6, '' if output == expected else '  (different output)'))
+    os.remove(path)
@@ -0,0 +1,49 @@
+"""
+Compares the event queues in event_schedulers on the event loop of the discrete event simulation work processors:
+pop the earliest event and push the agent's next one, with the gaps of the fixed (one day) and flat_rate (one day
+divided by a rate per agent) next_event_time models. Runs with 10^5, 10^6 and 10^7 events, with a tenth as many
+agents, and reports microseconds per event.
+
+Usage: python event_schedulers.py [largest power of ten of events]
+"""
+import sys; sys.path.extend(['../../'])
+import random
+import time
+from Dash2.core.event_schedulers import schedulers, SECONDS_IN_DAY
+
+START_TIME = 1514764800  # 2018-01-01
+
+
+def gaps(model, agents):
+    random.seed(0)
+    if model == 'fixed':
+        return [SECONDS_IN_DAY] * agents
+    return [float(SECONDS_IN_DAY) / random.choice([0.1, 0.2, 0.5, 1, 2, 5]) for i in range(agents)]
+
+
+# Microseconds per event for n events on the queue, and the order the events were popped in
+def run(queue, agent_gaps, n, record=False):
+    random.seed(1)
+    for agent_id in range(len(agent_gaps)):
+        queue.push(START_TIME + int(random.random() * agent_gaps[agent_id]), agent_id)
+    order = []
+    start = time.time()
+    for i in range(n):
+        (event_time, agent_id) = queue.pop()
+        queue.push(int(event_time + agent_gaps[agent_id]), agent_id)
+        if record:
+            order.append((event_time, agent_id))
+    return 1e6 * (time.time() - start) / n, order
+
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    for model in ['fixed', 'flat_rate']:
+        agent_gaps = gaps(model, 1000)
+        orders = [run(scheduler(), agent_gaps, 20000, record=True)[1] for scheduler in schedulers.values()]
+        assert all(order == orders[0] for order in orders), 'the schedulers popped events in different orders'
+        for power in range(5, largest + 1):
+            agent_gaps = gaps(model, 10 ** (power - 1))
+            for (name, scheduler) in sorted(schedulers.items()):
+                print('%-9s 10^%d events %-8s %6.3f us/event' % (model, power, name,
+                                                                 run(scheduler(), agent_gaps, 10 ** power)[0]))
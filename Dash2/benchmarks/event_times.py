@@ -0,0 +1,60 @@
+"""
+Compares NaiveAgent's next_event_times, which computes the next event times of a batch of agents with numpy (see
+event_times.py), with calling next_event_time for each agent, for the replay, flat_rate and fixed models. The agents
+have a mix of whole-second and fractional time intervals and rates, and start before, in and after the simulated
+interval. Reports the agents whose times or burst indices differ, and the time per agent of both ways. Agents with
+whole-second intervals should never differ. An agent that starts behind and catches up over fractional intervals
+can be a second off, since the batch adds whole cycles at once rather than one interval at a time.
+
+Usage: python event_times.py [number of agents]
+"""
+import sys; sys.path.extend(['../../'])
+import copy
+import random
+import time
+from Dash2.posam.naive_agent import NaiveAgent
+
+SECONDS_IN_DAY = 24 * 3600
+START_TIME = 1514764800  # 2018-01-01
+MAX_TIME = START_TIME + 60 * SECONDS_IN_DAY
+
+
+def intervals():
+    size = random.randint(1, 6)
+    if random.random() < 0.5:
+        return [random.randint(0, 5 * SECONDS_IN_DAY) for i in range(size)]
+    return [round(random.uniform(0, 5 * SECONDS_IN_DAY), 3) for i in range(size)]
+
+
+def agents_data(n):
+    return [{'event_rate': random.choice([None, 0, 0.2, 1, 3, 3.5, 7]),
+             'time_intervals': random.choice([None, intervals()]),
+             'burst_index': 0} for i in range(n)]
+
+
+def curr_times(n):
+    return [START_TIME + random.choice([random.randint(-200, 10), random.uniform(-200, 10)]) * SECONDS_IN_DAY
+            for i in range(n)]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(0)
+    for model in ['replay', 'flat_rate', 'fixed']:
+        (scalar_agent, vector_agent) = (NaiveAgent(next_event_time_model=model), NaiveAgent(next_event_time_model=model))
+        scalar_data = agents_data(n)
+        vector_data = copy.deepcopy(scalar_data)
+        differ = 0
+        (scalar_time, vector_time) = (0, 0)
+        for step in range(3):
+            times = curr_times(n)
+            start = time.time()
+            expected = [scalar_agent.next_event_time(data, t, START_TIME, MAX_TIME) for (data, t) in zip(scalar_data, times)]
+            scalar_time += time.time() - start
+            start = time.time()
+            found = vector_agent.next_event_times(vector_data, times, START_TIME, MAX_TIME)
+            vector_time += time.time() - start
+            differ += sum(1 for (a, b) in zip(expected, found) if a != b)
+            differ += sum(1 for (a, b) in zip(scalar_data, vector_data) if a['burst_index'] != b['burst_index'])
+        print('%-9s %d agents differ, %.2f us/agent one at a time, %.2f us/agent in a batch'
+              % (model, differ, scalar_time / (3 * n) * 1e6, vector_time / (3 * n) * 1e6))
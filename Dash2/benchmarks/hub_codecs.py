@@ -0,0 +1,46 @@
+"""
+Times encoding and decoding hub message payloads with each codec in message_codecs, for send_action and
+get_updates requests and responses like those of the password simulation hub (pass_sim_hub) and the mail hub
+(exp_mail_hub). Reports microseconds per round trip and encoded size in bytes.
+
+Usage: python hub_codecs.py [number of round trips per payload]
+"""
+import sys; sys.path.extend(['../../'])
+import time
+from Dash2.core.message_codecs import codecs
+
+
+def mail(i):
+    return {'to': 'user%d@amail.com' % (i % 50), 'from': 'user%d@amail.com' % i, 'subject': 'Meeting %d' % i,
+            'body': 'Please see the attached agenda for the meeting on Tuesday.', 'attachment': i % 3 == 0}
+
+
+payloads = [
+    ('pass_sim signIn request', [17, 'signIn', ['mail_2', 'user_17', 'p4ssw0rd!'], 'asap']),
+    ('pass_sim signIn response', ('failed:incorrect_password', [])),
+    ('pass_sim resetPassword request', [17, 'resetPassword', ['bank_5', 'user_17', 'p4ssw0rd!', 'n3wp4ss'], 'asap']),
+    ('get_updates request', [17, []]),
+    ('get_updates response', [[]]),
+    ('mail sendMail request', [4, 'sendMail', [mail(4)], 'asap']),
+    ('mail getMail response', ['success', {'user%d@amail.com' % s: [mail(s * 10 + k) for k in range(3)]
+                                           for s in range(5)}]),
+]
+
+
+def round_trip_time(codec, payload, n):
+    start = time.time()
+    for i in range(n):
+        codec.decode(codec.encode(payload))
+    return 1e6 * (time.time() - start) / n
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if 'msgpack' not in codecs:
+        print('msgpack is not installed, so its codec is skipped')
+    for (name, payload) in payloads:
+        for (codec_name, codec) in sorted(codecs.items()):
+            decoded = codec.decode(codec.encode(payload))
+            note = '' if decoded == payload else ' (tuples decoded as lists)'
+            print('%-32s %-8s %7.2f us %5d bytes%s' % (name, codec_name, round_trip_time(codec, payload, n),
+                                                       len(codec.encode(payload)), note))
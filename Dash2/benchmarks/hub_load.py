@@ -0,0 +1,112 @@
+"""
+Load test for the world hub. Starts a hub in another process, in thread-per-client or asyncio mode, opens many
+client connections that each register and then send actions as fast as the hub answers, and reports the
+requests per second and the median and 99th percentile latency of the send_action requests.
+
+Usage: python hub_load.py [--mode threads|asyncio|both] [--connections N] [--requests N] [--port P]
+Each connection needs a file descriptor in both processes, so raise ulimit -n for large numbers of connections.
+"""
+import sys; sys.path.extend(['../../'])
+import argparse
+import asyncio
+import os
+import pickle
+import struct
+import subprocess
+import time
+from Dash2.core.communication_aux import message_types
+from Dash2.core.world_hub import WorldHub
+
+
+# A hub whose only action answers straight away, so the benchmark measures the serving of requests
+class LoadHub(WorldHub):
+
+    def ping(self, agent_id, data):
+        return ['success', data]
+
+    def processDisconnectRequest(self, id, aux_data):
+        return "this is ignored"
+
+
+def serve(port, mode):
+    hub = LoadHub(port)
+    hub.trace_handler = False
+    hub.backlog = 4096  # so that the thread-per-client hub accepts connections as fast as they arrive
+    hub.use_asyncio = mode == 'asyncio'
+    hub.run()
+
+
+async def request(reader, writer, message_type, contents):
+    payload = pickle.dumps(contents)
+    writer.write(struct.pack("!II", message_type, len(payload)) + payload)
+    (length,) = struct.unpack("!I", await reader.readexactly(4))
+    return pickle.loads(await reader.readexactly(length))
+
+
+# One agent: register, then send actions, recording the latency of each
+async def agent(port, requests, latencies, ready, start):
+    for attempt in range(50):
+        try:
+            (reader, writer) = await asyncio.open_connection('localhost', port)
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    else:
+        raise ConnectionError('could not connect to the hub on port ' + str(port))
+    agent_id = (await request(reader, writer, message_types['register'], [[]]))[1]
+    ready.append(agent_id)
+    await start.wait()
+    for i in range(requests):
+        sent = time.perf_counter()
+        await request(reader, writer, message_types['send_action'], [agent_id, 'ping', [i], 'asap'])
+        latencies.append(time.perf_counter() - sent)
+    payload = pickle.dumps([agent_id, []])
+    writer.write(struct.pack("!II", message_types['disconnect'], len(payload)) + payload)
+    await writer.drain()
+    writer.close()
+
+
+async def load(port, connections, requests):
+    latencies = []
+    ready = []
+    start = asyncio.Event()
+    tasks = [asyncio.ensure_future(agent(port, requests, latencies, ready, start)) for i in range(connections)]
+    while len(ready) < connections:
+        await asyncio.sleep(0.05)
+        for task in tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - began
+
+
+def run_benchmark(mode, connections, requests, port):
+    hub = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port)],
+                           stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        time.sleep(1)
+        (latencies, elapsed) = asyncio.run(load(port, connections, requests))
+    finally:
+        hub.communicate(b'q\n', timeout=60)
+    latencies.sort()
+    print('%-8s %6d connections: %8.0f requests/sec, median %.2f ms, p99 %.2f ms'
+          % (mode, connections, len(latencies) / elapsed, 1000 * latencies[len(latencies) // 2],
+             1000 * latencies[int(0.99 * (len(latencies) - 1))]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='both', choices=['threads', 'asyncio', 'both'])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20, help='send_action requests per connection')
+    parser.add_argument('--port', type=int, default=5699)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)  # used to start the hub process
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.serve)
+    else:
+        modes = ['threads', 'asyncio'] if args.mode == 'both' else [args.mode]
+        for i in range(len(modes)):
+            run_benchmark(modes[i], args.connections, args.requests, args.port + i)  # the old port may be in TIME_WAIT
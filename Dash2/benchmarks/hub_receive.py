@@ -0,0 +1,64 @@
+"""
+Compares reading hub messages by adding up the pieces returned by recv, as the client and hub used to, with
+reading them into a reused buffer with recv_into (communication_aux.ReceiveBuffer), for 1 KB, 100 KB and 10 MB
+payloads sent over a local socket pair by another thread. Reports milliseconds per message, including
+unpickling the payload.
+
+Usage: python hub_receive.py [total megabytes to send per size]
+"""
+import sys; sys.path.extend(['../../'])
+import pickle
+import socket
+import struct
+import threading
+import time
+from Dash2.core.communication_aux import ReceiveBuffer
+
+
+# How the client and hub read a message before ReceiveBuffer
+def receive_by_concatenation(sock, n):
+    bytes_read = 0
+    message = b''
+    while bytes_read < n:
+        data = sock.recv(n - bytes_read)
+        if not data:
+            raise ConnectionError("connection closed")
+        message += data
+        bytes_read += len(data)
+    return message
+
+
+def receive_into_buffer(buffer):
+    return lambda sock, n: buffer.receive(sock, n)
+
+
+def send_messages(sock, message, count):
+    for i in range(count):
+        sock.sendall(message)
+
+
+# Milliseconds per message to receive count messages of the given payload size with receive(sock, n)
+def receive_time(receive, size, count):
+    payload = pickle.dumps(b'x' * size)
+    (sender, receiver) = socket.socketpair()
+    thread = threading.Thread(target=send_messages,
+                              args=(sender, struct.pack("!I", len(payload)) + payload, count))
+    start = time.time()
+    thread.start()
+    for i in range(count):
+        (length,) = struct.unpack_from("!I", receive(receiver, 4))
+        pickle.loads(receive(receiver, length))
+    elapsed = time.time() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return 1000 * elapsed / count
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for (name, size) in [('1 KB', 1 << 10), ('100 KB', 100 << 10), ('10 MB', 10 << 20)]:
+        count = max(5, min(20000, (megabytes << 20) // size))
+        for (method, receive) in [('recv and +=', receive_by_concatenation),
+                                  ('recv_into buffer', receive_into_buffer(ReceiveBuffer()))]:
+            print('%-7s %-17s %9.4f ms/message' % (name, method, receive_time(receive, size, count)))
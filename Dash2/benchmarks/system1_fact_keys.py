@@ -0,0 +1,53 @@
+"""
+Compares finding System 1 nodes by fact_table ids with the string keys built by fact_to_key, for the kind of
+facts update_beliefs passes to add_activation.
+
+Usage: python system1_fact_keys.py [number of calls]
+"""
+import sys; sys.path.extend(['../../'])
+import random
+import time
+from Dash2.core.system1 import System1Agent, Node, fact_table
+
+
+# System1Agent with nodes found by string keys, as before facts were interned
+class StringKeySystem1Agent(System1Agent):
+
+    def fact_to_node(self, fact):
+        key = self.fact_to_key(fact)
+        if key not in self.fact_node_dict:
+            node = Node(len(self.nodes) + 1, fact)
+            self.fact_node_dict[key] = node
+            self.nodes.add(node)
+            self.create_and_link_neighbors(node)
+            if fact[0] == 'action':
+                self.action_nodes.add(node)
+        return self.fact_node_dict[key]
+
+
+def make_facts(n, distinct=1000):
+    random.seed(0)
+    facts = [('login', 'service_' + str(i % 50), 'user_' + str(i), 'password_' + str(i % 20)) for i in range(distinct)]
+    facts += [('performed', ('setPassword', 'service_' + str(i % 50), 'password_' + str(i % 20)))
+              for i in range(distinct)]
+    facts += [['mail', {'to': 'user_' + str(i % 100), 'subject': 'subject_' + str(i % 7)}] for i in range(distinct // 10)]
+    return [random.choice(facts) for i in range(n)]
+
+
+# Microseconds per call of f on each fact
+def time_calls(f, facts):
+    start = time.time()
+    for fact in facts:
+        f(fact)
+    return 1e6 * (time.time() - start) / len(facts)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    facts = make_facts(n)
+    string_agent = StringKeySystem1Agent()
+    print('fact_to_key            %.3f us/call' % time_calls(string_agent.fact_to_key, facts))
+    print('fact_table.fact_id     %.3f us/call' % time_calls(fact_table.fact_id, facts))
+    for agent in [string_agent, System1Agent()]:
+        time_calls(agent.fact_to_node, facts)  # create the nodes first
+        print('%-22s %.3f us/add_activation' % (type(agent).__name__, time_calls(agent.add_activation, facts)))
@@ -0,0 +1,81 @@
+"""
+Measures the memory used per agent by large populations of System2 agents, with the System2Program read
+from each definition shared between its agents (the default) and with every agent parsing its own copy of the rules.
+Also reports the bytes per agent of the agents' own fact stores (knownDict and knownFalseDict, not counting the
+facts in them), next to what the same facts take as plain dicts of lists.
+
+Usage: python system2_memory.py [population sizes]  e.g. python system2_memory.py 10000 100000 1000000
+The MailReader agent needs imapclient to be installed.
+"""
+import sys; sys.path.extend(['../../'])
+import argparse
+import gc
+import time
+import tracemalloc
+from Dash2.core.system2 import clear_program_cache
+from Dash2.pass_attacker.pass_sim import PasswordAgent
+
+
+# The password agent registers in its constructor, so this version skips the hub
+class UnregisteredPasswordAgent(PasswordAgent):
+
+    def register(self, aux_data=[]):
+        return ["success", self.id, None]
+
+
+def make_password_agent(i):
+    return UnregisteredPasswordAgent()
+
+
+def make_mail_reader(i):
+    from Dash2.phish.mailReader import MailReader
+    return MailReader(i, argparse.Namespace(mailserver='amail.com'), register=False)
+
+
+# Returns the number of bytes allocated per agent and the time taken per agent in ms
+def measure(make_agent, n, shared=True):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    agents = []
+    for i in range(n):
+        if not shared:
+            clear_program_cache()  # forces each agent to parse and own its rules
+        agents.append(make_agent(i))
+    elapsed = time.time() - start
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stores = fact_store_bytes(agents)
+    del agents
+    clear_program_cache()
+    return current / float(n), 1000 * elapsed / n, stores
+
+
+# Bytes per agent of copies of the agents' fact stores, as FactIndexes and as dicts of lists
+def fact_store_bytes(agents):
+    sizes = []
+    for copy in [lambda d: d.copy(), lambda d: dict((key, list(facts)) for (key, facts) in d.items())]:
+        gc.collect()
+        tracemalloc.start()
+        copies = [(copy(agent.knownDict), copy(agent.knownFalseDict)) for agent in agents]
+        sizes.append(tracemalloc.get_traced_memory()[0] / float(len(agents)))
+        tracemalloc.stop()
+        del copies
+    return sizes
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    benchmarks = [('PasswordAgent', make_password_agent)]
+    try:
+        import Dash2.phish.mailReader
+        benchmarks.append(('MailReader', make_mail_reader))
+    except ImportError as e:
+        print('Skipping MailReader:', e)
+    for (name, make_agent) in benchmarks:
+        for n in sizes:
+            for shared in [True, False]:
+                (bytes_per_agent, ms_per_agent, stores) = measure(make_agent, n, shared)
+                print(name, n, 'agents,', 'shared program' if shared else 'private rules',
+                      '%.0f bytes/agent, %.3f ms/agent,' % (bytes_per_agent, ms_per_agent),
+                      'fact stores %.0f bytes/agent (%.0f as dicts of lists)' % tuple(stores))
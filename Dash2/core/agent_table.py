@@ -0,0 +1,369 @@
+# A columnar store for the agent_data of DES agents (see LocalWorkProcessor), so that large populations don't pay
+# for a dict per agent. The table maps agent ids to AgentViews, which act like the agent's dict: agent_data['key'],
+# agent_data['key'] = value, 'key' in agent_data, get, keys and so on all read and write the table.
+#
+# Each key is a column with an entry per agent:
+#   numbers   ints or floats (with None allowed) in a numpy array, with a byte per agent for missing or None
+#   ragged    lists of numbers for the keys named in ragged, e.g. time_intervals, in one numpy array with the start
+#             and length of each agent's list. An agent's list reads as a RaggedList, which is a sequence (and a
+#             numpy array with numpy.asarray) backed by the array.
+#   objects   anything else, e.g. dicts of probabilities, in a list
+# A number column that is given a value that isn't a number becomes an objects column.
+from collections.abc import Mapping, MutableMapping, Sequence
+import numpy
+
+MISSING, VALUE, NONE = 0, 1, 2  # states of an agent's entry in a numbers or ragged column
+missing = object()  # an agent's entry in an objects column when the agent doesn't have the key
+
+
+class NumberColumn(object):
+
+    def __init__(self, values, dtype):
+        self.state = numpy.array([MISSING if value is missing else NONE if value is None else VALUE
+                                  for value in values], dtype=numpy.uint8)
+        self.values = numpy.array([0 if value is missing or value is None else value for value in values], dtype=dtype)
+
+    def get(self, row):
+        state = self.state.item(row)
+        if state == VALUE:
+            return self.values.item(row)
+        elif state == NONE:
+            return None
+        raise KeyError(row)
+
+    # Returns False if the value can't be kept in the column
+    def set(self, row, value):
+        if value is None:
+            self.state[row] = NONE
+            return True
+        if not is_number(value):
+            return False
+        if self.values.dtype.kind == 'i' and not is_int64(value):
+            self.values = self.values.astype(float)
+        self.values[row] = value
+        self.state[row] = VALUE
+        return True
+
+    def delete(self, row):
+        self.state[row] = MISSING
+
+    def has(self, row):
+        return self.state.item(row) != MISSING
+
+    def resize(self, size):
+        self.state = resized(self.state, size)
+        self.values = resized(self.values, size)
+
+
+class RaggedColumn(object):
+
+    def __init__(self, values):
+        self.state = numpy.array([MISSING if value is missing else NONE if value is None else VALUE
+                                  for value in values], dtype=numpy.uint8)
+        lists = [value if is_number_list(value) else [] for value in values]
+        self.lengths = numpy.array([len(value) for value in lists], dtype=numpy.int64)
+        self.starts = numpy.concatenate([[0], numpy.cumsum(self.lengths)[:-1]]).astype(numpy.int64)
+        flat = [element for value in lists for element in value]
+        self.data = numpy.array(flat) if flat else numpy.zeros(0)
+        self.used = len(self.data)
+
+    def get(self, row):
+        state = self.state.item(row)
+        if state == VALUE:
+            return RaggedList(self, row)
+        elif state == NONE:
+            return None
+        raise KeyError(row)
+
+    # A new list goes after the used part of data. When there isn't room, the lists still in use are copied to a new
+    # array twice their size.
+    def set(self, row, value):
+        if value is None:
+            self.state[row] = NONE
+            return True
+        if not is_number_list(value):
+            return False
+        value = numpy.asarray(value)
+        if self.data.dtype.kind == 'i' and value.dtype.kind == 'f':
+            self.data = self.data.astype(float)
+        if self.used + len(value) > len(self.data):
+            self.compact(len(value))
+        self.data[self.used:self.used + len(value)] = value
+        self.starts[row] = self.used
+        self.lengths[row] = len(value)
+        self.used += len(value)
+        self.state[row] = VALUE
+        return True
+
+    def compact(self, extra):
+        live = numpy.flatnonzero(self.state == VALUE)
+        kept = [self.data[self.starts[row]:self.starts[row] + self.lengths[row]] for row in live]
+        size = sum(len(values) for values in kept) + extra
+        data = numpy.zeros(max(2 * size, 16), dtype=self.data.dtype)
+        position = 0
+        for (row, values) in zip(live, kept):
+            data[position:position + len(values)] = values
+            self.starts[row] = position
+            position += len(values)
+        self.data = data
+        self.used = position
+
+    def delete(self, row):
+        self.state[row] = MISSING
+
+    def has(self, row):
+        return self.state.item(row) != MISSING
+
+    def resize(self, size):
+        self.state = resized(self.state, size)
+        self.starts = resized(self.starts, size)
+        self.lengths = resized(self.lengths, size)
+
+
+class ObjectColumn(object):
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def get(self, row):
+        value = self.values[row]
+        if value is missing:
+            raise KeyError(row)
+        return value
+
+    def set(self, row, value):
+        self.values[row] = value
+        return True
+
+    def delete(self, row):
+        self.values[row] = missing
+
+    def has(self, row):
+        return self.values[row] is not missing
+
+    def resize(self, size):
+        self.values.extend([missing] * (size - len(self.values)))
+
+
+# One agent's list in a RaggedColumn
+class RaggedList(Sequence):
+    __slots__ = ['column', 'row']
+
+    def __init__(self, column, row):
+        self.column = column
+        self.row = row
+
+    def array(self):
+        start = self.column.starts[self.row]
+        return self.column.data[start:start + self.column.lengths[self.row]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.array()[index].tolist()
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('list index out of range')
+        return self.column.data.item(self.column.starts.item(self.row) + index)
+
+    def __len__(self):
+        return self.column.lengths.item(self.row)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array() if dtype is None else self.array().astype(dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, (list, tuple, RaggedList)) and list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self.array().tolist())
+
+
+class AgentView(MutableMapping):
+    __slots__ = ['table', 'row']
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, key):
+        column = self.table.columns.get(key)
+        if column is None:
+            raise KeyError(key)
+        try:
+            return column.get(self.row)
+        except KeyError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.table.set(self.row, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.table.columns[key].delete(self.row)
+
+    def __contains__(self, key):
+        column = self.table.columns.get(key)
+        return column is not None and column.has(self.row)
+
+    def __iter__(self):
+        return (key for (key, column) in self.table.columns.items() if column.has(self.row))
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class AgentTable(Mapping):
+
+    def __init__(self, ragged=()):
+        # Agent ids and agent id -> row. While the ids are 0, 1, 2, ..., ids is a range and rows is None, which saves
+        # a dict entry per agent.
+        self.ids = range(0)
+        self.rows = None
+        self.columns = dict()  # key -> column
+        self.ragged = set(ragged)
+
+    # A table of the agents in a dict of agent id -> agent_data dict. Each dict is dropped from agents_data once it
+    # has been read, so that the dicts and the table are not both in memory at the end.
+    @classmethod
+    def from_dicts(cls, agents_data, ragged=()):
+        table = cls(ragged)
+        ids = list(agents_data.keys())
+        if ids == list(range(len(ids))):
+            table.ids = range(len(ids))
+        else:
+            table.ids = ids
+            table.rows = {agent_id: row for (row, agent_id) in enumerate(ids)}
+        dicts = [agents_data[agent_id] for agent_id in ids]
+        del ids
+        agents_data.clear()
+        keys = []
+        for data in dicts:
+            keys.extend(key for key in data if key not in table.columns and key not in keys)
+        for key in keys:
+            table.columns[key] = table.make_column(key, [data.get(key, missing) for data in dicts])
+        return table
+
+    def make_column(self, key, values):
+        present = [value for value in values if value is not missing and value is not None]
+        if key in self.ragged and all(is_number_list(value) for value in present):
+            return RaggedColumn(values)
+        if all(is_number(value) for value in present):
+            return NumberColumn(values, numpy.int64 if all(is_int64(value) for value in present) else float)
+        return ObjectColumn(values)
+
+    # Adds an agent with the given agent_data dict, or with no data
+    def add(self, agent_id, agent_data=None):
+        if agent_id in self:
+            raise KeyError('agent ' + repr(agent_id) + ' is already in the table')
+        row = len(self.ids)
+        if self.rows is None and agent_id == row and is_int64(agent_id):
+            self.ids = range(row + 1)
+        else:
+            if self.rows is None:
+                self.ids = list(self.ids)
+                self.rows = {agent_id: row for (row, agent_id) in enumerate(self.ids)}
+            self.ids.append(agent_id)
+            self.rows[agent_id] = row
+        for column in self.columns.values():
+            if not isinstance(column, ObjectColumn) and len(column.state) <= row:
+                column.resize(max(16, 2 * len(column.state)))
+            elif isinstance(column, ObjectColumn):
+                column.resize(row + 1)
+        for (key, value) in (agent_data or {}).items():
+            self.set(row, key, value)
+        return AgentView(self, row)
+
+    def set(self, row, key, value):
+        column = self.columns.get(key)
+        if column is None:
+            column = self.make_column(key, [missing] * self.capacity(row))
+            self.columns[key] = column
+        if not column.set(row, value):
+            values = [column.get(i) if column.has(i) else missing for i in range(len(self.ids))]
+            column = self.columns[key] = ObjectColumn(values)
+            column.resize(self.capacity(row))
+            column.set(row, value)
+
+    def capacity(self, row):
+        return max(len(self.ids), row + 1)
+
+    # The numpy array of a numbers column, with an entry per agent in the table's order (see ids), and a boolean
+    # array of the agents that have a number for the key
+    def column(self, key):
+        column = self.columns[key]
+        return column.values[:len(self.ids)], column.state[:len(self.ids)] == VALUE
+
+    def row(self, agent_id):
+        if self.rows is not None:
+            return self.rows[agent_id]
+        if type(agent_id) is int and 0 <= agent_id < len(self.ids):
+            return agent_id
+        if is_int64(agent_id) and 0 <= agent_id < len(self.ids):
+            return int(agent_id)
+        raise KeyError(agent_id)
+
+    def __getitem__(self, agent_id):
+        return AgentView(self, self.row(agent_id))
+
+    def __contains__(self, agent_id):
+        try:
+            self.row(agent_id)
+            return True
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# The (agent, agent_data) pairs that work processors pass to agents as agents=, for the agents in a table. The
+# pairs are made as they are read, so a population doesn't cost a tuple and an AgentView per agent up front.
+class AgentPairs(Sequence):
+    __slots__ = ['agent', 'table']
+
+    def __init__(self, agent, table):
+        self.agent = agent
+        self.table = table
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('agent index out of range')
+        return self.agent, AgentView(self.table, index)
+
+    def __iter__(self):
+        for row in range(len(self.table.ids)):
+            yield self.agent, AgentView(self.table, row)
+
+    def __len__(self):
+        return len(self.table.ids)
+
+
+def is_number(value):
+    return isinstance(value, (int, float, numpy.integer, numpy.floating)) and not isinstance(value, bool)
+
+
+def is_int64(value):
+    return isinstance(value, (int, numpy.integer)) and not isinstance(value, bool) and -2**63 <= value < 2**63
+
+
+# Whether the value is a list or tuple of numbers that a RaggedColumn can keep
+def is_number_list(value):
+    return isinstance(value, (list, tuple, RaggedList)) and all(is_number(element) for element in value)
+
+
+def resized(array, size):
+    new = numpy.zeros(size, dtype=array.dtype)
+    new[:min(size, len(array))] = array[:size]
+    return new
@@ -1,7 +1,10 @@
+import itertools
 import socket
 import struct
-import pickle
-from Dash2.core.communication_aux import message_types
+from Dash2.core.communication_aux import message_types, ReceiveBuffer
+from Dash2.core.message_codecs import codecs, pickle_codec
+
+request_ids = itertools.count()  # ids of batch requests, unique in the process
 
 
 class Client(object):
@@ -9,6 +12,8 @@ class Client(object):
     Template class for the client agent
     """
     shared_socket = None
+    shared_codec = pickle_codec  # the codec agreed for the shared socket
+    shared_buffer = ReceiveBuffer()  # responses on the shared socket are read into this
 
     def __init__(self, host=None, port=None):
         """ Initialization of the client.
@@ -41,6 +46,12 @@ class Client(object):
         self.isSharedSocketEnabled = False  # The first agent to use the socket, gets to set up the connection.
         # All other agents with isSharedSocketEnabled = True will reuse it.
 
+        # Names of codecs for message payloads to offer the hub at register, in order of preference, e.g.
+        # ['struct', 'pickle'] (see message_codecs.py). If None, messages are pickled without asking the hub.
+        self.codecs = None
+        self.codec = pickle_codec
+        self.receive_buffer = ReceiveBuffer()
+
     def test(self):
         """
         Registration of the client
@@ -126,7 +137,14 @@ class Client(object):
             if self.trace_client:
                 print("registering...")
 
-            response = self.sendAndReceive(message_types['register'], [aux_data])
+            if self.codecs is None:
+                response = self.sendAndReceive(message_types['register'], [aux_data])
+            else:
+                response = self.sendAndReceive(message_types['register'], [aux_data, self.codecs])
+                if len(response) > 3:
+                    self.codec = codecs[response[3]]
+                    if self.isSharedSocketEnabled:
+                        Client.shared_codec = self.codec
 
         result = response[0]
         self.id = response[1]
@@ -159,6 +177,9 @@ class Client(object):
         else:
             response = self.sendAndReceive(message_types['send_action'], [self.id, action, data, time])
 
+        return self.handleActionResponse(action, data, time, response)
+
+    def handleActionResponse(self, action, data, time, response):
         # Allow for the result to be a list, e.g. ['success', [data]], or just an object, e.g. 'fail'.
         # However if the return object is a list it must have the first form.
         if isinstance(response, (list, tuple)):
@@ -241,47 +262,58 @@ class Client(object):
     def processUpdates(self, aux_data):
         return
 
+    def connectionCodec(self):
+        return Client.shared_codec if self.isSharedSocketEnabled else self.codec
+
     def sendAndReceive(self, message_type, message_contents):
         self.sendMessage(message_type, message_contents)
         return self.receiveResponse()
 
     def sendMessage(self, message_type, message_contents):
         # send message header followed by serialized contents
-        serialized_message_contents = pickle.dumps(message_contents)
+        serialized_message_contents = self.connectionCodec().encode(message_contents)
         message_len = len(serialized_message_contents)
         message_header = struct.pack("!II", message_type, message_len)
         message = message_header + serialized_message_contents
         return self.sock.sendall(message)
 
     def receiveResponse(self):
-        # read header (i.e., find length of response)
-        bytes_read = 0
-        bytes_to_read = 4
-        response_header = "".encode()
-        while bytes_read < bytes_to_read:
-            data = self.sock.recv(bytes_to_read - bytes_read)
-            if data:
-                response_header += data
-                bytes_read += len(data)
-            else:
-                print("trouble receiving message...")
-                self.sock.close()
-        response_len, = struct.unpack("!I", response_header)
-
-        # read message
-        bytes_read = 0
-        bytes_to_read = response_len
-        serialized_response = "".encode()
-        while bytes_read < bytes_to_read:
-            data = self.sock.recv(bytes_to_read - bytes_read)
-            if data:
-                serialized_response += data
-                bytes_read += len(data)
-            else:
-                self.sock.close()
-        response = pickle.loads(serialized_response)
+        buffer = Client.shared_buffer if self.isSharedSocketEnabled else self.receive_buffer
+        try:
+            # read header (i.e., find length of response), then decode the message straight from the buffer
+            response_len, = struct.unpack_from("!I", buffer.receive(self.sock, 4))
+            return self.connectionCodec().decode(buffer.receive(self.sock, response_len))
+        except ConnectionError:
+            print("trouble receiving message...")
+            self.sock.close()
+            raise
+
+
+# Send actions for several clients, given a list of tuples (client, action[, data[, time]]), and return the
+# list of responses, as if each client had called sendAction. Clients that share a socket (isSharedSocketEnabled)
+# send their actions in one batch message and get one reply, so there is one round trip per socket rather than
+# one per action. Clients with an internal hub or no connection call sendAction.
+def send_action_batch(requests):
+    responses = [None] * len(requests)
+    requests = [list(request) + [None, None, [], "asap"][len(request):] for request in requests]
+    socket_batches = dict()
+    for i in range(len(requests)):
+        (client, action, data, time) = requests[i]
+        if (client.useInternalHub and client.hub) or client.sock is None or not client.connected:
+            responses[i] = client.sendAction(action, data, time)
+        else:
+            socket_batches.setdefault(id(client.sock), []).append(i)
+    for indices in socket_batches.values():
+        request_id = next(request_ids)
+        items = [[message_types['send_action'], [requests[i][0].id] + requests[i][1:]] for i in indices]
+        batch_response = requests[indices[0]][0].sendAndReceive(message_types['batch'], [request_id, items])
+        if batch_response[0] != request_id:
+            raise ValueError('response to batch request %s has id %s' % (request_id, batch_response[0]))
+        for (i, response) in zip(indices, batch_response[1]):
+            (client, action, data, time) = requests[i]
+            responses[i] = client.handleActionResponse(action, data, time, response)
+    return responses
 
-        return response
 
 if __name__ == "__main__":
     """ Simplistic command line driver
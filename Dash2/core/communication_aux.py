@@ -25,6 +25,12 @@
 # update_state:
 # "2, length, [client_id, aux_information]" (sent from client to server)
 # "length, [updates/aux_informatiion]" (sent from server to client)
+#
+# batch:
+# "4, length, [request_id, [[message_type, message_contents], ...]]" (sent from client to server)
+# "length, [request_id, [response, ...]]" (sent from server to client)
+# where each item is a perform_action or update_state message, e.g. from several agents that share a socket,
+# and the responses are in the same order. The hub handles all the items before it handles another request.
 import struct
 import socket
 import pickle
@@ -33,5 +39,34 @@ message_types = {
     'register':    0,
     'send_action': 1,
     'get_updates': 2,
-    'disconnect': 3
+    'disconnect': 3,
+    'batch': 4
     }
+
+
+# A buffer that is reused to read messages from a socket with recv_into, so a message arrives in one place
+# rather than being built up from the pieces that recv returns, which copies quadratically for large messages.
+class ReceiveBuffer(object):
+    keep_size = 1 << 20  # larger messages are read into a buffer that isn't kept
+
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+
+    # Returns a memoryview of the next n bytes from the socket, which is only valid until the next call.
+    # Raises ConnectionError if the connection closes first.
+    def receive(self, sock, n):
+        if n <= len(self.buffer):
+            buffer = self.buffer
+        elif n <= self.keep_size:
+            # a new buffer rather than a resize, since views of the old one may still be held
+            buffer = self.buffer = bytearray(min(max(n, 2 * len(self.buffer)), self.keep_size))
+        else:
+            buffer = bytearray(n)
+        view = memoryview(buffer)[:n]
+        bytes_read = sock.recv_into(view, n)
+        while bytes_read < n:
+            count = sock.recv_into(view[bytes_read:], n - bytes_read)
+            if count == 0:
+                raise ConnectionError("connection closed after %d of %d bytes" % (bytes_read, n))
+            bytes_read += count
+        return view
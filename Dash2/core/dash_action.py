@@ -1,6 +1,8 @@
 from Dash2.core.string_aux import convert_camel
 from Dash2.core.system2 import System2Agent, substitute
+from Dash2.core.system2_batch import choose_actions_by_reasoning
 from Dash2.core.system1 import System1Agent
+from Dash2.core.system1_population import system1_updates, system1_steps
 from Dash2.core.client import Client
 import abc
 
@@ -20,9 +22,12 @@ class DASHAction(Client, System1Agent, System2Agent):
     parameters = []  # Input parameters, each an instance of Parameter giving a name and info about the possible values
     measures = []  # Possible measures on the performance of the agent used for validation or as an outcome
 
-    def __init__(self, system1_class=System1Agent, system2_class=System2Agent):
+    def __init__(self, system1_class=None, system2_class=System2Agent):
         Client.__init__(self)
         system2_class.__init__(self)
+        if system1_class is None:  # the first System1Agent class in the agent's bases, e.g. VectorSystem1Agent
+            system1_class = [c for c in type(self).__mro__
+                             if issubclass(c, System1Agent) and not issubclass(c, DASHAction)][0]
         system1_class.__init__(self)
 
         self.traceUpdate = False
@@ -119,6 +124,7 @@ class DASHAction(Client, System1Agent, System2Agent):
                 self.primitiveActionDict[item] = item # store the name and look for the function at planning time
             else:
                 self.primitiveActionDict[item[0]] = item[1]
+        self.clearPlanCache()  # cached decompositions may have treated these as subgoals
 
     # This format is now inefficient since we have different ways that a predicate can be a primitive action
     def perform_action(self, action):
@@ -175,3 +181,96 @@ class DASHAction(Client, System1Agent, System2Agent):
         print("Primitive action", action, "trivially succeeds")
         return [{'performed': action}]
 
+
+# Batched versions of the decision cycle for a population of agents, used by Trial and WorkProcessor when
+# batch_reasoning is set. Each step is taken by all the agents before the next, and System2 reasoning is
+# done for all of them at once with choose_actions_by_reasoning. Since every agent has performed its action
+# before any agent chooses the next, agents that interact through a hub may see each other's actions in a
+# different order than when they run one at a time.
+# System 1 is updated with system1_updates and system1_steps, which advance the agents that share a
+# PopulationSystem1 with one operation.
+# Agents whose class overrides the decision cycle run it on their own.
+
+# As agent_loop for each agent, without disconnecting. Returns the list of the agents' next actions.
+def agent_loops(agents, max_iterations=-1):
+    next_actions = [None] * len(agents)
+    batch = []
+    for i in range(len(agents)):
+        if batchable(agents[i], ['agent_loop', 'agent_decision_cycle']):
+            batch.append(i)
+        else:
+            next_actions[i] = agents[i].agent_loop(max_iterations=max_iterations, disconnect_at_end=False)
+    system1_updates([agents[i] for i in batch])
+    for (i, action) in zip(batch, choose_actions([agents[i] for i in batch])):
+        next_actions[i] = action
+    iteration = 0
+    running = [i for i in batch if next_actions[i] is not None]
+    while running and (max_iterations < 0 or iteration < max_iterations):
+        perform_actions([agents[i] for i in running], [next_actions[i] for i in running])
+        for (i, action) in zip(running, choose_actions([agents[i] for i in running])):
+            next_actions[i] = action
+        system1_steps([agents[i] for i in running])
+        running = [i for i in running if next_actions[i] is not None]
+        iteration += 1
+    for i in batch:
+        if agents[i].traceLoop and next_actions[i] is None:
+            print("Exiting simulation: no action chosen")
+        elif agents[i].traceLoop and 0 <= max_iterations <= iteration:
+            print("Exiting simulation: finished finite agent cycles:", iteration, "of max", max_iterations)
+    return next_actions
+
+
+# As agent_decision_cycle with no next action for each agent, as the work processor calls it
+def agent_decision_cycles(agents):
+    next_actions = [None] * len(agents)
+    batch = []
+    for i in range(len(agents)):
+        if batchable(agents[i], ['agent_decision_cycle']):
+            batch.append(i)
+        else:
+            next_actions[i] = agents[i].agent_decision_cycle(max_iterations=1, disconnect_at_end=False)
+    batch_agents = [agents[i] for i in batch]
+    system1_updates(batch_agents)
+    perform_actions(batch_agents, choose_actions(batch_agents))
+    for (i, action) in zip(batch, choose_actions(batch_agents)):
+        next_actions[i] = action
+    system1_steps(batch_agents)
+    return next_actions
+
+
+# As choose_action for each agent
+def choose_actions(agents):
+    actions = [None] * len(agents)
+    reasoning = []  # agents for which system 2 is called
+    system1_actions = dict()
+    for i in range(len(agents)):
+        agent = agents[i]
+        if not batchable(agent, ['choose_action']):
+            actions[i] = agent.choose_action()
+            continue
+        system1_actions[i] = agent.system1_propose_actions()
+        if system1_actions[i] and agent.bypass_system2(system1_actions[i]):
+            actions[i] = system1_actions[i][0]
+        elif type(agent).system2_propose_action is not System2Agent.system2_propose_action:
+            actions[i] = agent.arbitrate_system1_system2(system1_actions[i], agent.system2_propose_action())
+        else:
+            reasoning.append(i)
+    for (i, action) in zip(reasoning, choose_actions_by_reasoning([agents[i] for i in reasoning])):
+        actions[i] = agents[i].arbitrate_system1_system2(system1_actions[i], action)
+    return actions
+
+
+# Each agent performs its action, updates its beliefs with the result and updates system 1
+def perform_actions(agents, actions):
+    for (agent, action) in zip(agents, actions):
+        if agent.traceAction:
+            print(agent.id, "next action is", action)
+        result = agent.perform_action(action)
+        agent.update_beliefs(result, action)
+    system1_updates(agents)
+
+
+# True if the agent's class uses the DASHAction versions of the methods
+def batchable(agent, methods):
+    return isinstance(agent, DASHAction) and \
+        all(getattr(type(agent), name) is getattr(DASHAction, name) for name in methods)
@@ -1,7 +1,7 @@
 SECONDS_IN_DAY = 24 * 3600
 
-import json
-import pickle
+from contextlib import contextmanager
+from Dash2.core.event_log import write_event, flush_event_log
 from Dash2.core.string_aux import convert_camel
 
 class DESAgent(object):
@@ -11,6 +11,8 @@ class DESAgent(object):
     - agent_loop(self, **kwargs)
     - agent_decision_cycle(self, **kwargs)
     - next_event_time(self, **kwargs)
+    - next_event_times(self, agents_data, curr_times, start_time, max_time)
+    - batch_decision_cycle(self, events, start_time, max_time, **kwargs)
     """
 
     def __init__(self, **kwargs):
@@ -23,6 +25,8 @@ class DESAgent(object):
                 self.log_file = self.hub.log_file
 
         self.event_counter = 0
+        self.log_paths = set()  # the log files given as paths, whose writers are flushed by flush_log_paths
+        self.log_buffering = 0  # depth of buffered_log blocks
 
     ####################################################################################################################
     # main agent's loop
@@ -31,10 +35,11 @@ class DESAgent(object):
         iteration = 0
         event_time = 0
         next_action = True
-        while next_action is not None and (max_iterations < 0 or iteration < max_iterations):
-            next_action = self.agent_decision_cycle(next_action=next_action, event_time=event_time, **kwargs)
-            event_time = self.next_event_time(agent_data={}, curr_time=event_time, start_time=0, max_time=SECONDS_IN_DAY*100)
-            iteration += 1
+        with self.buffered_log():
+            while next_action is not None and (max_iterations < 0 or iteration < max_iterations):
+                next_action = self.agent_decision_cycle(next_action=next_action, event_time=event_time, **kwargs)
+                event_time = self.next_event_time(agent_data={}, curr_time=event_time, start_time=0, max_time=SECONDS_IN_DAY*100)
+                iteration += 1
 
         return next_action
 
@@ -62,6 +67,19 @@ class DESAgent(object):
 
         return None
 
+    def batch_decision_cycle(self, events, start_time, max_time, **kwargs):
+        """
+        Called with the events the work processor runs together in its batched mode (see LocalWorkProcessor).
+        events is a list of (event_time, agent_data) pairs in time order. Returns the next event time of each, or None,
+        in the same order. By default calls agent_decision_cycle() for each event in turn, then next_event_times() for
+        the batch; sub-classes can override it to handle the whole batch at once.
+        """
+        with self.buffered_log():
+            for (event_time, agent_data) in events:
+                self.agent_decision_cycle(agent_data=agent_data, event_time=event_time, **kwargs)
+        return self.next_event_times([agent_data for (event_time, agent_data) in events],
+                                     [event_time for (event_time, agent_data) in events], start_time, max_time)
+
     # this is an example of an action. Descendants of DESAgent class must implement their own action methods.
     def do_nothing(self, **kwargs):
         print("DES agent empty action.")
@@ -91,25 +109,18 @@ class DESAgent(object):
         """
         Print log data.
         :param log_data:
-        :param log_file: if string opens file, otherwise interprets it as fp
+        :param log_file: if string opens file (once, in append mode), otherwise interprets it as fp
         :param format: 'json' or 'pickle'
         :param verbose:
         :return:
         """
-        def _dump_data(log_data, log_file):
-            if format == 'json':
-                json.dump(log_data, log_file)
-                log_file.write("\n")
-            elif format == 'pickle':
-                pickle.dump(log_data, log_file)
-                log_file.write("\n")
-
         def _dump_to_file(log_data, log_file):
+            # paths and registered files are buffered, other files are written to at once (see event_log.py)
+            write_event(log_file, log_data, format)
             if isinstance(log_file, str):
-                with open(log_file, "a+") as fp:
-                    _dump_data(log_data, fp)
-            else:
-                _dump_data(log_data, log_file)
+                self.log_paths.add(log_file)
+                if not self.log_buffering:
+                    flush_event_log(log_file)
 
         if verbose:
             print(log_data)
@@ -127,6 +138,23 @@ class DESAgent(object):
                 _dump_to_file(log_data, self.hub.log_file)
 
 
+    # Within this block, events logged to paths stay in their writers' buffers, and are written to the files at the
+    # end of the outermost block. Outside it, each event is written to its file when it is logged.
+    @contextmanager
+    def buffered_log(self):
+        self.log_buffering += 1
+        try:
+            yield
+        finally:
+            self.log_buffering -= 1
+            if not self.log_buffering:
+                self.flush_log_paths()
+
+    def flush_log_paths(self):
+        for path in self.log_paths:
+            flush_event_log(path)
+
+
     ####################################################################################################################
     # Needed for discrete event simulation
     ####################################################################################################################
@@ -154,3 +182,12 @@ class DESAgent(object):
             return int(next_event_time)
         else:
             return None
+
+    def next_event_times(self, agents_data, curr_times, start_time, max_time):
+        """
+        next_event_time() for many agents at once: returns the next event time, or None, for each agent data object
+        and current time. Sub-classes can override this with a vectorized version (see event_times.py).
+        """
+        return [self.next_event_time(agent_data=agent_data, curr_time=curr_time, start_time=start_time,
+                                     max_time=max_time)
+                for (agent_data, curr_time) in zip(agents_data, curr_times)]
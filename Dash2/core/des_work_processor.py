@@ -4,14 +4,19 @@ import json
 import time
 import os
 from datetime import  datetime
-from heapq import heappush, heappop
 from pathlib import Path
+from Dash2.core.agent_table import AgentTable, AgentPairs
+from Dash2.core.event_schedulers import event_scheduler
+from Dash2.core import event_log
 
 MAX_NUMBER_OF_ITERATIONS = 15000000
 
 
 # WorkProcessor class is responsible for running experiment trial on a node in cluster (distributed/parallel trial)
 class WorkProcessor:
+    batch_reasoning = False  # set to advance all the active agents in one pass (see run_one_iteration)
+    population_system1 = False  # set to put the agents' vector System 1 in one PopulationSystem1 (see process_task)
+
     def __init__(self, zk, host_id, task_full_id, data):
         self.agents = []
         self.zk = zk
@@ -36,6 +41,9 @@ class WorkProcessor:
 
     def process_task(self):
         self.initialize()
+        if self.population_system1:
+            from Dash2.core.system1_population import join_population
+            self.system1_population = join_population(self.agents)
         if self.zk is not None and self.task_full_id is not None:
             while not self.should_stop():
                 self.run_one_iteration()
@@ -69,6 +77,13 @@ class WorkProcessor:
 
     def run_one_iteration(self):
         # dummy implementation, override in subclass
+        if self.batch_reasoning:
+            # All the active agents take their decision cycle together (see dash_action.agent_decision_cycles)
+            from Dash2.core.dash_action import agent_decision_cycles
+            agents = [agent for agent in self.agents if not self.agent_should_stop(agent)]
+            for (agent, next_action) in zip(agents, agent_decision_cycles(agents)):
+                self.process_after_agent_action(agent, next_action)
+            return
         for agent in self.agents:
             if not self.agent_should_stop(agent):
                 next_action = agent.agent_decision_cycle(max_iterations=1, disconnect_at_end=False)  # don't disconnect since will run again
@@ -98,7 +113,10 @@ class LocalWorkProcessor(object):
 
     def __init__(self, output_file_name, start_time, end_time, agent, create_initial_state_fn, settings=None, **kwargs):
         self.agents_data = {} # decision data objects; each agent's state is kept in agent's data object
-        self.events_heap = [] # work queue for discrete event simulation
+        # work queue for discrete event simulation, a heap unless e.g. scheduler='calendar' (see event_schedulers.py)
+        self.event_queue = event_scheduler(kwargs.get('scheduler', 'heap'), kwargs.get('bucket_width', None))
+        # set to run events together: 0 for events at the same time, or a number of seconds (see run_event_batch)
+        self.batch_quantum = kwargs.get('batch_quantum', None)
         self.event_counter = 0 # counter of events logged into output file
         self.iteration = 0 # how many times agent loop was called
         self.max_iterations = kwargs.get('max_iterations', MAX_NUMBER_OF_ITERATIONS) # max number of times agent's loop can be called.
@@ -113,42 +131,53 @@ class LocalWorkProcessor(object):
         # output file:
         self.output_file_name = output_file_name
         self.json_log_file = open(self.output_file_name, 'w')
+        # the agents' events are buffered, log_flush_size characters at a time, and written in a thread with
+        # log_background (see event_log.py)
+        event_log.event_log_writer(self.json_log_file, flush_size=kwargs.get('log_flush_size', event_log.flush_size),
+                                   background=kwargs.get('log_background', False))
 
         # create initial state, load it from dataframe
         self.agents_data = create_initial_state_fn(kwargs["training_file"], kwargs["initial_state_file"], **kwargs)
-        self.agents_data_tuples = [(self.agent, d) for d in self.agents_data.values()]
-
-        # populate queue (initial state)
-        for agent_id in self.agents_data.keys():
-            if 'last_event_time' in self.agents_data[agent_id]:
-                let = self.agents_data[agent_id]['last_event_time']
-                last_event_time = int(let)#time.mktime(datetime.strptime(str(let), "%Y-%m-%d %H:%M:%S").timetuple())
-                next_event_time = self.agent.next_event_time(agent_data=self.agents_data[agent_id],
-                                                             curr_time=last_event_time,
-                                                             start_time=self.start_time,
-                                                             max_time= self.max_time)
-                if next_event_time is not None:
-                    heappush(self.events_heap, (next_event_time, agent_id))
+        if kwargs.get('agent_table', False):
+            # keep the agents' data in numpy columns rather than a dict per agent (see agent_table.py)
+            self.agents_data = AgentTable.from_dicts(self.agents_data, ragged=kwargs.get('ragged_fields', ['time_intervals']))
+        if isinstance(self.agents_data, AgentTable):
+            self.agents_data_tuples = AgentPairs(self.agent, self.agents_data)
+        else:
+            self.agents_data_tuples = [(self.agent, d) for d in self.agents_data.values()]
+
+        # populate queue (initial state), with the first event times of all the agents found together
+        agent_ids = [agent_id for agent_id in self.agents_data.keys() if 'last_event_time' in self.agents_data[agent_id]]
+        last_event_times = [int(self.agents_data[agent_id]['last_event_time']) for agent_id in agent_ids] #time.mktime(datetime.strptime(str(let), "%Y-%m-%d %H:%M:%S").timetuple())
+        next_event_times = self.agent.next_event_times([self.agents_data[agent_id] for agent_id in agent_ids],
+                                                       last_event_times, self.start_time, self.max_time)
+        self.event_queue.push_many([(next_event_time, agent_id) for (next_event_time, agent_id)
+                                    in zip(next_event_times, agent_ids) if next_event_time is not None])
 
         if verbose:
             print("INFO: Agents instantiated ", str(len(self.agents_data)))
 
     def run_experiment(self):
-        while not self.should_stop():
-            self.run_one_iteration()
-            self.iteration += 1
-            if self.iteration % 1000 == 0:
-                print("Iteration ", str(self.iteration), " ",
-                      str({"iteration": self.iteration,
-                           "update time": time.strftime("%H:%M:%S", time.gmtime(time.time())),
-                           "experiment time": str(datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S")) }))
+        with self.agent.buffered_log():  # events the agent logs to paths are written out at the end of the run
+            while not self.should_stop():
+                previous_iteration = self.iteration
+                if self.batch_quantum is None:
+                    self.run_one_iteration()
+                    self.iteration += 1
+                else:
+                    self.iteration += self.run_event_batch()
+                if self.iteration // 1000 != previous_iteration // 1000:
+                    print("Iteration ", str(self.iteration), " ",
+                          str({"iteration": self.iteration,
+                               "update time": time.strftime("%H:%M:%S", time.gmtime(time.time())),
+                               "experiment time": str(datetime.fromtimestamp(self.time).strftime("%Y-%m-%d %H:%M:%S")) }))
         self.process_after_run()
 
     def run_one_iteration(self):
         if self.agent is None:
             raise ValueError('WorkProcessor.agent is None.')
 
-        event_time, agent_id = heappop(self.events_heap)
+        event_time, agent_id = self.event_queue.pop()
         self.set_curr_time(event_time)
         self.agent.agent_decision_cycle(agent_data=self.agents_data[agent_id], event_time=event_time, agents=self.agents_data_tuples)
         next_event_time = self.agent.next_event_time(agent_data=self.agents_data[agent_id],
@@ -156,14 +185,34 @@ class LocalWorkProcessor(object):
                                                      start_time=self.start_time,
                                                      max_time=self.max_time)
         if next_event_time is not None:
-            heappush(self.events_heap, (next_event_time, agent_id))
+            self.event_queue.push(next_event_time, agent_id)
         self.event_counter += 1
 
+    # Runs the earliest events that have the same time, or are in the same batch_quantum seconds, with one call to
+    # the agent's batch_decision_cycle, and puts the agents' next events back together. Returns the number of events.
+    # With a quantum, an agent's next event in the same quantum waits for the next batch.
+    def run_event_batch(self):
+        if self.agent is None:
+            raise ValueError('WorkProcessor.agent is None.')
+
+        limit = self.max_iterations - self.iteration if self.max_iterations > 0 else None
+        batch = self.event_queue.pop_batch(self.batch_quantum, limit)
+        self.set_curr_time(batch[0][0])
+        next_event_times = self.agent.batch_decision_cycle([(event_time, self.agents_data[agent_id])
+                                                            for (event_time, agent_id) in batch],
+                                                           start_time=self.start_time, max_time=self.max_time,
+                                                           agents=self.agents_data_tuples)
+        self.event_queue.push_many([(next_event_time, agent_id)
+                                    for (next_event_time, (event_time, agent_id)) in zip(next_event_times, batch)
+                                    if next_event_time is not None])
+        self.event_counter += len(batch)
+        return len(batch)
+
     def should_stop(self):
         if self.max_iterations > 0 and self.iteration >= self.max_iterations:
             print('reached end of iterations for trial')
             return True
-        if len(self.events_heap) == 0:
+        if len(self.event_queue) == 0:
             print('reached end of event queue, no more events')
             return True
         return False
@@ -172,6 +221,7 @@ class LocalWorkProcessor(object):
         self.time = curr_time
 
     def process_after_run(self):  # do any post processing before closing the output file
+        event_log.close_event_log(self.json_log_file)
         self.json_log_file.close() # close log
 
 
@@ -0,0 +1,170 @@
+# Buffered writers for the event logs of DES agents and hubs (DESAgent.log_event, NaiveAgent.log_event,
+# SocsimHub.print_to_csv_log). Events are encoded into an in-memory buffer, which is written to the file in one
+# write when it holds flush_size characters, or when the writer is flushed or closed. With background set, the
+# writes happen in a thread, with at most max_pending buffers waiting for it.
+#
+# Only two kinds of log are buffered: paths, which the writer opens (once, in append mode) and closes, and file
+# objects whose owner registers them with event_log_writer and calls close_event_log(file) before closing the file,
+# as LocalWorkProcessor and SocsimHub do. write_event writes an event to a path or file through its writer, or
+# straight to any other file object, so a caller that closes its own file doesn't lose events. The writer for a
+# path is written out to the file with flush_event_log(path), which DESAgent calls after each event it logs outside
+# a run, and at the end of a run (see DESAgent.buffered_log). Writers that are still open when the program exits
+# are closed then, with a warning for any whose file was closed under them.
+#
+import atexit
+import json
+import pickle
+import queue
+import threading
+import warnings
+
+json_encoder = json.JSONEncoder()
+flush_size = 1 << 16  # default number of characters (or bytes) to buffer
+max_pending = 8
+
+
+class EventLogWriter(object):
+
+    def __init__(self, file, format='json', flush_size=flush_size, background=False):
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'ab' if format == 'pickle' else 'a') if self.owns_file else file
+        self.format = format
+        self.encode = encoders[format]
+        self.empty = b'' if format == 'pickle' else ''
+        self.flush_size = flush_size
+        self.buffer = []
+        self.size = 0
+        self.closed = False
+        self.error = None
+        self.pending = None
+        self.thread = None
+        if background:
+            self.pending = queue.Queue(max_pending)
+            self.thread = threading.Thread(target=self.write_pending, daemon=True)
+            self.thread.start()
+
+    # Adds an event: a dict for json and pickle, or a sequence of strings for csv
+    def write(self, event):
+        line = self.encode(event)
+        self.buffer.append(line)
+        self.size += len(line)
+        if self.size >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.buffer:
+            chunk = self.empty.join(self.buffer)
+            self.buffer = []
+            self.size = 0
+            if self.pending is not None:
+                self.pending.put(chunk)
+            else:
+                self.file.write(chunk)
+
+    def write_pending(self):
+        while True:
+            chunk = self.pending.get()
+            try:
+                if chunk is None:
+                    return
+                self.file.write(chunk)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+    # Writes out everything buffered and waits until it has reached the file
+    def sync(self):
+        self.flush()
+        if self.pending is not None:
+            self.pending.join()
+            if self.error is not None:
+                raise self.error
+        self.file.flush()
+
+    # Writes everything that is buffered, and closes the file if the writer opened it
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+        if self.owns_file:
+            self.file.close()
+        elif not self.file.closed:
+            self.file.flush()
+
+
+def encode_json(event):
+    return json_encoder.encode(event) + "\n"
+
+
+def encode_csv(fields):
+    return ",".join(fields) + "\n"
+
+
+def encode_pickle(event):
+    return pickle.dumps(event) + b"\n"
+
+
+encoders = {'json': encode_json, 'csv': encode_csv, 'pickle': encode_pickle}
+
+writers = dict()  # (path or id of the file, format) -> EventLogWriter
+
+
+# The writer for a file object or path, which is made with the given settings the first time. For a file object,
+# this registers the file for buffering, and the caller must call close_event_log(file) before closing it.
+def event_log_writer(file, format='json', flush_size=flush_size, background=False):
+    key = (file if isinstance(file, str) else id(file), format)
+    writer = writers.get(key)
+    if writer is None or writer.closed or not (writer.owns_file or writer.file is file):
+        writer = writers[key] = EventLogWriter(file, format, flush_size, background)
+    return writer
+
+
+# Writes an event to a path, or to a file object, buffered if the file has been registered with event_log_writer
+def write_event(file, event, format='json'):
+    if isinstance(file, str):
+        event_log_writer(file, format).write(event)
+        return
+    writer = writers.get((id(file), format))
+    if writer is not None and not writer.closed and writer.file is file:
+        writer.write(event)
+    else:
+        file.write(encoders[format](event))
+
+
+# Writes out what the writers for a file object or path have buffered, leaving them open
+def flush_event_log(file):
+    name = file if isinstance(file, str) else id(file)
+    for (key, writer) in list(writers.items()):
+        if key[0] == name and not writer.closed and (writer.owns_file or writer.file is file):
+            writer.sync()
+
+
+# Closes the writers for a file object or path, writing out what they have buffered
+def close_event_log(file):
+    name = file if isinstance(file, str) else id(file)
+    for key in [key for key in writers if key[0] == name]:
+        writer = writers.pop(key)
+        if writer.owns_file or writer.file is file:
+            writer.close()
+
+
+@atexit.register
+def close_event_logs():
+    for writer in list(writers.values()):
+        if writer.closed:
+            continue
+        if writer.owns_file or not writer.file.closed:
+            writer.close()
+        elif writer.buffer or writer.error is not None or (writer.pending is not None and not writer.pending.empty()):
+            warnings.warn('the ' + writer.format + ' event log file ' + str(getattr(writer.file, 'name', writer.file))
+                          + ' was closed before close_event_log, so its buffered events were not written')
+    writers.clear()
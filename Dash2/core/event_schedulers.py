@@ -0,0 +1,144 @@
+# Event queues for the discrete event simulation work processors (LocalWorkProcessor, SocsimWorkProcessor).
+# Each holds (time, agent_id) events and pops them in the order of those tuples, so every scheduler runs the
+# same simulation. Choose one by name with event_scheduler.
+#   heap      a heapq of all the events: O(log n) for each push and pop. The default.
+#   calendar  a calendar queue of buckets of bucket_width seconds, for the near-uniform gaps between events of
+#             next_event_time models like flat_rate and fixed. An event for a later bucket is appended to it in
+#             O(1), and a bucket is sorted once, when the simulation reaches it.
+# The work processor's batched mode takes events out together with pop_batch and puts the agents' next events
+# back with push_many.
+from heapq import heappush, heappop, heapify
+
+SECONDS_IN_DAY = 24 * 3600
+
+
+class EventScheduler(object):
+
+    # Removes and returns the earliest events that have the same time, or if quantum is given, the events in
+    # the same interval of quantum seconds (counted from time 0) as the earliest, up to limit events.
+    def pop_batch(self, quantum=0, limit=None):
+        batch = [self.pop()]
+        if quantum:
+            end = (batch[0][0] // quantum + 1) * quantum
+        while len(self) > 0 and (limit is None or len(batch) < limit):
+            time = self.peek_time()
+            if (time >= end) if quantum else (time != batch[0][0]):
+                break
+            batch.append(self.pop())
+        return batch
+
+    # Adds a list of (time, agent_id) events
+    def push_many(self, events):
+        for (time, agent_id) in events:
+            self.push(time, agent_id)
+
+
+class HeapScheduler(EventScheduler):
+
+    def __init__(self):
+        self.heap = []
+
+    def push(self, time, agent_id):
+        heappush(self.heap, (time, agent_id))
+
+    # Merges with heapify when there are at least as many new events as queued ones, when it is cheaper
+    # than pushing them one at a time
+    def push_many(self, events):
+        if len(events) >= len(self.heap):
+            self.heap.extend(events)
+            heapify(self.heap)
+        else:
+            for event in events:
+                heappush(self.heap, event)
+
+    # Removes and returns the earliest (time, agent_id) event. Raises IndexError if there are none.
+    def pop(self):
+        return heappop(self.heap)
+
+    def peek_time(self):
+        return self.heap[0][0]
+
+    def pop_batch(self, quantum=0, limit=None):
+        heap = self.heap
+        batch = [heappop(heap)]
+        limit = len(heap) + 1 if limit is None else limit
+        if quantum:
+            end = (batch[0][0] // quantum + 1) * quantum
+            while heap and heap[0][0] < end and len(batch) < limit:
+                batch.append(heappop(heap))
+        else:
+            while heap and heap[0][0] == batch[0][0] and len(batch) < limit:
+                batch.append(heappop(heap))
+        return batch
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class CalendarQueue(EventScheduler):
+
+    def __init__(self, bucket_width=SECONDS_IN_DAY):
+        self.width = bucket_width
+        self.buckets = dict()  # bucket number -> unsorted list of events, for buckets after the current one
+        self.keys = []  # heap of the bucket numbers in buckets
+        self.current_key = float('-inf')
+        self.current = []  # the sorted events of the current bucket, up to position have been popped
+        self.position = 0
+        self.early = []  # heap of events pushed for the current bucket or before it once it was sorted
+        self.size = 0
+
+    def push(self, time, agent_id):
+        key = time // self.width
+        if key > self.current_key:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                self.buckets[key] = [(time, agent_id)]
+                heappush(self.keys, key)
+            else:
+                bucket.append((time, agent_id))
+        else:
+            heappush(self.early, (time, agent_id))
+        self.size += 1
+
+    def pop(self):
+        if self.position == len(self.current) and not self.early:
+            self.next_bucket()
+        self.size -= 1
+        if self.position < len(self.current):
+            event = self.current[self.position]
+            if self.early and self.early[0] < event:
+                return heappop(self.early)
+            self.position += 1
+            return event
+        return heappop(self.early)
+
+    def peek_time(self):
+        if self.position == len(self.current) and not self.early:
+            self.next_bucket()
+        if self.position < len(self.current) and not (self.early and self.early[0] < self.current[self.position]):
+            return self.current[self.position][0]
+        return self.early[0][0]
+
+    # Move on to the next bucket that has events. Only called when the current one is used up.
+    def next_bucket(self):
+        if not self.keys:
+            raise IndexError('pop from an empty event queue')
+        self.current_key = heappop(self.keys)
+        self.current = self.buckets.pop(self.current_key)
+        self.current.sort()
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+
+schedulers = {'heap': HeapScheduler, 'calendar': CalendarQueue}
+
+
+# A new, empty event queue of the named kind. bucket_width is only used by the calendar queue.
+def event_scheduler(name='heap', bucket_width=None):
+    if name not in schedulers:
+        raise ValueError("Unsupported event scheduler " + str(name) + ", expected one of " + str(sorted(schedulers)))
+    if name == 'calendar' and bucket_width is not None:
+        return CalendarQueue(bucket_width)
+    return schedulers[name]()
@@ -0,0 +1,189 @@
+# Next event times for many DES agents at once, with numpy, for the next_event_time models of NaiveAgent and
+# GithubProbabilisticAgent (replay, flat_rate and fixed) and of SocsimMixin. The functions take arrays with one entry
+# per agent and return an array of next times, with NaN where the agent has no event between start_time and
+# max_time. Agents that are behind start_time skip the intervals before it in closed form, rather than one
+# interval at a time. With intervals that aren't whole seconds, a time reached this way can differ from the
+# one-at-a-time sum in the last bits, and so by a second once it is truncated to an int. Whole-second intervals
+# give the same times as next_event_time.
+import numpy as np
+from Dash2.core.agent_table import AgentView, RaggedList
+
+SECONDS_IN_DAY = 24 * 3600
+small_batch = 16
+
+
+# The first time curr_time + k * delta, k >= 1, that isn't before start_time, for each agent
+def periodic_next_times(curr_times, deltas, start_time, max_time):
+    curr_times = np.asarray(curr_times, dtype=float)
+    deltas = np.asarray(deltas, dtype=float)
+    next_times = curr_times + deltas
+    behind = np.flatnonzero(next_times < start_time)
+    if len(behind) > 0:
+        next_times[behind] += np.ceil((start_time - next_times[behind]) / deltas[behind]) * deltas[behind]
+        short = behind[next_times[behind] < start_time]  # rounding can leave a time just before start_time
+        next_times[short] += deltas[short]
+    return in_interval(next_times, start_time, max_time)
+
+
+# The flat_rate model, with rates in events per day. Agents with a rate of 0 or NaN have no events.
+def flat_rate_next_times(curr_times, rates, start_time, max_time):
+    with np.errstate(divide='ignore'):
+        deltas = float(SECONDS_IN_DAY) / np.asarray(rates, dtype=float)
+    return periodic_next_times(curr_times, deltas, start_time, max_time)
+
+
+# The fixed model: once a day
+def fixed_next_times(curr_times, start_time, max_time):
+    return periodic_next_times(curr_times, np.full(len(curr_times), float(SECONDS_IN_DAY)), start_time, max_time)
+
+
+def in_interval(next_times, start_time, max_time):
+    next_times[(next_times < start_time) | (next_times > max_time)] = np.nan
+    return next_times
+
+
+# The time intervals of the replay model for a population of agents, one list of intervals per agent, in one
+# array: agent a's intervals are at offsets[a] to offsets[a] + lengths[a] in intervals, and its cumulative sums
+# 0, i0, i0 + i1, ... at offsets[a] to offsets[a] + lengths[a] in sums. The times are computed from an agent's own
+# sums, so they are exact for whole-second intervals. Only the searchsorted that finds the interval an agent that
+# is behind reaches uses the sums shifted up by bases[a], so that every agent's are above the previous agent's,
+# and its result is checked against the unshifted sums.
+class ReplayIntervals(object):
+
+    def __init__(self, interval_lists):
+        self.lengths = np.array([len(intervals) for intervals in interval_lists], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths + 1)[:-1]]).astype(np.int64)
+        sums = [np.concatenate([[0], np.cumsum(intervals)]) for intervals in interval_lists]
+        self.intervals = np.concatenate([np.concatenate([intervals, [0]]) for intervals in interval_lists]) \
+            if sums else np.zeros(0)
+        self.sums = np.concatenate(sums) if sums else np.zeros(0)
+        self.totals = np.array([s[-1] for s in sums])
+        self.bases = np.concatenate([[0], np.cumsum(self.totals + 1)[:-1]])
+        self.shifted = np.concatenate([s + base for (s, base) in zip(sums, self.bases)]) if sums else np.zeros(0)
+
+    # Replays the intervals of the agents in rows from their burst indices, from curr_times, until a time that
+    # isn't before start_time. Returns the next times and the new burst indices. Raises IndexError for a burst
+    # index past the agent's intervals, as next_event_time does.
+    def next_times(self, rows, curr_times, burst_indices, start_time, max_time):
+        rows = np.asarray(rows, dtype=np.int64)
+        curr_times = np.asarray(curr_times, dtype=float)
+        burst_indices = np.asarray(burst_indices, dtype=np.int64)
+        lengths = self.lengths[rows]
+        if np.any((burst_indices < 0) | (burst_indices >= lengths)):
+            raise IndexError('list index out of range')
+        totals = self.totals[rows]
+        offsets = self.offsets[rows]
+        # the first interval, added as next_event_time adds it
+        next_times = curr_times + self.intervals[offsets + burst_indices]
+        positions = burst_indices + 1
+        behind = np.flatnonzero((next_times < start_time) & (totals > 0))
+        if len(behind) > 0:
+            # x counts the intervals from the agent's first, so the time after x intervals is
+            # curr_time + (x // length) * total + sums[x % length] - sums[burst_index]
+            (lengths, totals, offsets) = (lengths[behind], totals[behind], offsets[behind])
+            start_sums = self.sums[offsets + burst_indices[behind]]
+            needed = start_time - curr_times[behind] + start_sums
+            # whole cycles before the one it is reached in, so that 0 < remainder <= total, and the first sum that
+            # reaches the remainder, even if the last intervals are 0
+            cycles = np.ceil(needed / totals) - 1
+            remainder = needed - cycles * totals
+            position = np.searchsorted(self.shifted, self.bases[rows[behind]] + remainder) - offsets
+            position = np.clip(position, 1, lengths)
+            while True:  # the shifted sums can round across a sum, so step to the first one that reaches it
+                back = (position > 1) & (self.sums[offsets + position - 1] >= remainder)
+                forward = (position < lengths) & (self.sums[offsets + position] < remainder)
+                if not (back.any() or forward.any()):
+                    break
+                position = position - back + forward
+            x = np.maximum(burst_indices[behind] + 1, cycles.astype(np.int64) * lengths + position)
+            full_cycles = x // lengths
+            positions[behind] = x - full_cycles * lengths
+            next_times[behind] = curr_times[behind] + full_cycles * totals \
+                + self.sums[offsets + positions[behind]] - start_sums
+        positions %= self.lengths[rows]
+        # when all intervals are 0, it never catches up
+        next_times[(self.totals[rows] <= 0) & (next_times < start_time)] = np.nan
+        return in_interval(next_times, start_time, max_time), positions
+
+
+# next_event_times for agents whose agent_data have the event_rate, time_intervals and burst_index of NaiveAgent and
+# GithubProbabilisticAgent, with the agent's next_event_time_model. Returns int times or None, as next_event_time
+# does for each agent. The replay intervals are read into the agent's ReplayIntervals the first time an agent is seen,
+# and again when its time_intervals are replaced.
+# Batches smaller than small_batch are cheaper with the agent's next_event_time.
+def model_next_event_times(agent, agents_data, curr_times, start_time, max_time):
+    if len(agents_data) < small_batch:
+        return [agent.next_event_time(agent_data, curr_time, start_time, max_time)
+                for (agent_data, curr_time) in zip(agents_data, curr_times)]
+    for data_obj in agents_data:
+        if 'burst_index' not in data_obj:
+            data_obj['burst_index'] = 0
+    model = agent.next_event_time_model
+    if model == "replay":
+        next_times = replay_next_times(agent, agents_data, curr_times, start_time, max_time)
+    elif model == "flat_rate":
+        rates = [data_obj['event_rate'] if data_obj['event_rate'] is not None else 0 for data_obj in agents_data]
+        next_times = flat_rate_next_times(curr_times, rates, start_time, max_time)
+    elif model == "fixed":
+        next_times = fixed_next_times(curr_times, start_time, max_time)
+    else:
+        raise ValueError("Unsupported value of next_event_time_model " + str(model))
+    return [None if next_time != next_time else int(next_time) for next_time in next_times.tolist()]
+
+
+def replay_next_times(agent, agents_data, curr_times, start_time, max_time):
+    if getattr(agent, 'replay_rows', None) is None:
+        agent.replay_rows = dict()  # data key -> (data owner, intervals key, row in agent.replay_interval_lists)
+        agent.replay_interval_lists = []
+        agent.replay_intervals = ReplayIntervals([])
+    indices = [i for i in range(len(agents_data)) if replays(agents_data[i])]
+    rows = []
+    changed = False
+    for i in indices:
+        (key, owner) = data_key(agents_data[i])
+        intervals = agents_data[i]['time_intervals']
+        entry = agent.replay_rows.get(key)
+        if entry is None or not same_intervals(entry[1], intervals_key(intervals)):
+            row = len(agent.replay_interval_lists) if entry is None else entry[2]
+            if entry is None:
+                agent.replay_interval_lists.append(intervals)
+            else:
+                agent.replay_interval_lists[row] = intervals
+            entry = agent.replay_rows[key] = (owner, intervals_key(intervals), row)
+            changed = True
+        rows.append(entry[2])
+    if changed:
+        agent.replay_intervals = ReplayIntervals(agent.replay_interval_lists)
+    next_times = np.full(len(agents_data), np.nan)
+    if indices:
+        (times, burst_indices) = agent.replay_intervals.next_times(
+            rows, [curr_times[i] for i in indices], [agents_data[i]['burst_index'] for i in indices],
+            start_time, max_time)
+        next_times[indices] = times
+        for (i, burst_index) in zip(indices, burst_indices.tolist()):
+            agents_data[i]['burst_index'] = burst_index
+    return next_times
+
+
+# The key of an agent's data in agent.replay_rows, and the object it is the id of, which the entry keeps so that
+# the id isn't reused. An AgentView is made on each lookup, so its key is its table and row.
+def data_key(data_obj):
+    if isinstance(data_obj, AgentView):
+        return (id(data_obj.table), data_obj.row), data_obj.table
+    return id(data_obj), data_obj
+
+
+# What tells whether an agent's time_intervals are still the ones its row was made from: the list itself, or for
+# an AgentTable's RaggedList, the column array and the place in it, which change whenever the list is set
+def intervals_key(intervals):
+    if isinstance(intervals, RaggedList):
+        return (intervals.column.data, intervals.column.starts.item(intervals.row), len(intervals))
+    return (intervals, len(intervals))
+
+
+def same_intervals(key, other):
+    return key[0] is other[0] and key[1:] == other[1:]
+
+
+def replays(data_obj):
+    return data_obj['time_intervals'] is not None and data_obj['time_intervals'] != 0 and len(data_obj['time_intervals']) > 0
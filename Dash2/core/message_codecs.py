@@ -0,0 +1,199 @@
+# Codecs for the payloads of messages between clients and the world hub (see communication_aux.py).
+#
+# Pickle is the default and can send any object, but it is slow for the many small lists of strings and numbers
+# that make up most messages, and unpickling data from a client or hub that isn't trusted can run arbitrary code.
+# The other codecs only send plain data: None, booleans, numbers, strings, bytes, lists, tuples and dicts.
+#   struct   tagged values packed with the struct module, keeping tuples and lists apart. send_action and
+#            get_updates requests and [result, aux] responses whose data are strings have fixed shapes
+#            that are packed as one string
+#   msgpack  the msgpack format, if the msgpack package is installed. Tuples are decoded as lists.
+#
+# A client that sets its codecs attribute offers those codecs, in order of preference, when it registers. The
+# hub picks the first one it also supports (WorldHub.codecs) and names it in the register response, and from
+# then on both ends use it on that connection. Clients that don't offer any codecs, and hubs that don't know
+# about codecs, use pickle as before.
+import pickle
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class PickleCodec(object):
+    name = 'pickle'
+
+    def encode(self, message):
+        return pickle.dumps(message)
+
+    # data can be bytes or any buffer, such as a memoryview
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class MsgpackCodec(object):
+    name = 'msgpack'
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# One byte tags, followed by the value: q for ints, d for floats, an unsigned int length and the bytes for
+# strings and bytes, an unsigned int length and the elements for lists, tuples and dicts
+NONE, TRUE, FALSE, INT, BIG_INT, FLOAT, STR, BYTES, LIST, TUPLE, DICT = [bytes([c]) for c in b'NTFiIfsblte']
+int_struct = struct.Struct('!q')
+float_struct = struct.Struct('!d')
+length_struct = struct.Struct('!I')
+
+
+# Tags for the fixed shapes of the most common messages, whose strings are joined with NUL separators
+ACTION = b'A'[0]  # send_action request [id, action, [strings], time string]
+UPDATES = b'G'[0]  # get_updates request [id, []]
+RESULT_LIST = b'R'[0]  # response [result string, [strings]]
+RESULT_TUPLE = b'r'[0]  # response (result string, [strings])
+SEPARATOR = '\0'
+
+
+class StructCodec(object):
+    name = 'struct'
+
+    def encode(self, message):
+        encoded = encode_shape(message)
+        if encoded is not None:
+            return encoded
+        parts = []
+        encode_value(message, parts)
+        return b''.join(parts)
+
+    def decode(self, data):
+        tag = data[0]
+        if tag == ACTION:
+            strings = str(data[9:], 'utf-8').split(SEPARATOR)
+            return [int_struct.unpack_from(data, 1)[0], strings[0], strings[2:], strings[1]]
+        elif tag == UPDATES:
+            return [int_struct.unpack_from(data, 1)[0], []]
+        elif tag == RESULT_LIST or tag == RESULT_TUPLE:
+            strings = str(data[1:], 'utf-8').split(SEPARATOR)
+            return [strings[0], strings[1:]] if tag == RESULT_LIST else (strings[0], strings[1:])
+        (value, end) = decode_value(memoryview(data), 0)
+        return value
+
+
+# The message in one of the fixed shapes, or None if it doesn't have one
+def encode_shape(message):
+    kind = type(message)
+    if kind is list and len(message) == 4 and type(message[0]) is int and type(message[1]) is str \
+            and type(message[2]) is list and type(message[3]) is str and -2**63 <= message[0] < 2**63:
+        strings = [message[1], message[3]] + message[2]
+        tag = b'A' + int_struct.pack(message[0])
+    elif kind is list and len(message) == 2 and type(message[0]) is int and message[1] == [] \
+            and type(message[1]) is list and -2**63 <= message[0] < 2**63:
+        return b'G' + int_struct.pack(message[0])
+    elif (kind is list or kind is tuple) and len(message) == 2 and type(message[0]) is str \
+            and type(message[1]) is list:
+        strings = [message[0]] + message[1]
+        tag = b'R' if kind is list else b'r'
+    else:
+        return None
+    for string in strings:
+        if type(string) is not str:
+            return None
+    joined = SEPARATOR.join(strings)
+    if joined.count(SEPARATOR) != len(strings) - 1:  # a string contains the separator
+        return None
+    return tag + joined.encode()
+
+
+def encode_value(value, parts):
+    kind = type(value)
+    if kind is str:
+        encoded = value.encode()
+        parts.append(STR + length_struct.pack(len(encoded)))
+        parts.append(encoded)
+    elif kind is int:
+        if -2**63 <= value < 2**63:
+            parts.append(INT + int_struct.pack(value))
+        else:
+            encoded = str(value).encode()
+            parts.append(BIG_INT + length_struct.pack(len(encoded)))
+            parts.append(encoded)
+    elif kind is list or kind is tuple:
+        parts.append((LIST if kind is list else TUPLE) + length_struct.pack(len(value)))
+        for element in value:
+            encode_value(element, parts)
+    elif value is None:
+        parts.append(NONE)
+    elif kind is bool:
+        parts.append(TRUE if value else FALSE)
+    elif kind is float:
+        parts.append(FLOAT + float_struct.pack(value))
+    elif kind is dict:
+        parts.append(DICT + length_struct.pack(len(value)))
+        for (key, element) in value.items():
+            encode_value(key, parts)
+            encode_value(element, parts)
+    elif kind is bytes or kind is bytearray:
+        parts.append(BYTES + length_struct.pack(len(value)))
+        parts.append(bytes(value))
+    else:
+        raise TypeError("the struct codec can't encode " + repr(value))
+
+
+# Returns the value starting at position start in the memoryview, and the position after it
+def decode_value(data, start):
+    tag = data[start]
+    position = start + 1
+    if tag == 115:  # STR
+        (length,) = length_struct.unpack_from(data, position)
+        position += 4
+        return str(data[position:position + length], 'utf-8'), position + length
+    elif tag == 105:  # INT
+        return int_struct.unpack_from(data, position)[0], position + 8
+    elif tag == 108 or tag == 116:  # LIST or TUPLE
+        (length,) = length_struct.unpack_from(data, position)
+        position += 4
+        elements = []
+        for i in range(length):
+            (element, position) = decode_value(data, position)
+            elements.append(element)
+        return (elements if tag == 108 else tuple(elements)), position
+    elif tag == 78:  # NONE
+        return None, position
+    elif tag == 84:  # TRUE
+        return True, position
+    elif tag == 70:  # FALSE
+        return False, position
+    elif tag == 102:  # FLOAT
+        return float_struct.unpack_from(data, position)[0], position + 8
+    elif tag == 101:  # DICT
+        (length,) = length_struct.unpack_from(data, position)
+        position += 4
+        result = dict()
+        for i in range(length):
+            (key, position) = decode_value(data, position)
+            (result[key], position) = decode_value(data, position)
+        return result, position
+    elif tag == 98 or tag == 73:  # BYTES or BIG_INT
+        (length,) = length_struct.unpack_from(data, position)
+        position += 4
+        encoded = bytes(data[position:position + length])
+        return (encoded if tag == 98 else int(encoded)), position + length
+    raise ValueError('unknown tag %d in struct codec data' % tag)
+
+
+pickle_codec = PickleCodec()
+codecs = {'pickle': pickle_codec, 'struct': StructCodec()}
+if msgpack is not None:
+    codecs['msgpack'] = MsgpackCodec()
+
+
+# The name of the first of the offered codecs that is also supported, or pickle
+def choose_codec(offered, supported):
+    for name in offered:
+        if name in supported and name in codecs:
+            return name
+    return 'pickle'
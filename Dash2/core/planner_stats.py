@@ -0,0 +1,87 @@
+# Counters for System2 goal decomposition, collected when an agent's instrumentPlanner flag is set
+# (on the agent or on its class). For each goal predicate they record how often the planner looked for an action
+# for the goal, the unifications and fact store lookups made while decomposing it, the goal requirement
+# clauses considered, the clauses abandoned for the next one (backtracks) and the wall time spent.
+# Counts are charged to the innermost goal being decomposed (or to "(choosing goals)" outside any goal),
+# while time includes subgoals.
+#
+# planner_report gathers the counters of a list of agents, and write_planner_report saves them as JSON or CSV,
+# e.g. at the end of a Trial (see Trial.planner_report).
+import csv
+import json
+import time
+
+fields = ['calls', 'unify', 'isIn', 'candidates', 'backtracks', 'time']
+# Positions in the counts
+CALLS = 0
+UNIFY = 1
+IS_IN = 2
+CANDIDATES = 3
+BACKTRACKS = 4
+TIME = 5
+
+
+class PlannerStats(object):
+
+    def __init__(self):
+        self.goals = dict()  # goal predicate -> list of counts, in the order of fields
+        self.stack = []  # predicates of the goals being decomposed
+        self.started = dict()  # predicate -> (depth, start time) for the outermost goal with the predicate
+
+    def begin(self, goal):
+        predicate = goal[0] if isinstance(goal, (tuple, list)) else goal
+        self.stack.append(predicate)
+        self.counts(predicate)[CALLS] += 1
+        if predicate not in self.started:
+            self.started[predicate] = (len(self.stack), time.time())
+
+    def end(self):
+        predicate = self.stack[-1]
+        if self.started[predicate][0] == len(self.stack):
+            self.counts(predicate)[TIME] += time.time() - self.started.pop(predicate)[1]
+        self.stack.pop()
+
+    # Add n to the count at position field in fields for the current goal
+    def count(self, field, n=1):
+        self.counts(self.stack[-1] if self.stack else None)[field] += n
+
+    def counts(self, predicate):
+        if predicate not in self.goals:
+            self.goals[predicate] = [0, 0, 0, 0, 0, 0.0]
+        return self.goals[predicate]
+
+    def reset(self):
+        self.goals = dict()
+
+
+# One row per agent class and goal predicate, summing the counts of the instrumented agents of that class
+def planner_report(agents):
+    totals = dict()
+    for agent in agents:
+        stats = getattr(agent, '_plannerStats', None)
+        if stats is None:
+            continue
+        for (predicate, counts) in stats.goals.items():
+            key = (type(agent).__name__, '(choosing goals)' if predicate is None else str(predicate))
+            if key not in totals:
+                totals[key] = [0, 0, 0, 0, 0, 0.0]
+            totals[key] = [a + b for (a, b) in zip(totals[key], counts)]
+    rows = []
+    for ((agent_class, predicate), counts) in sorted(totals.items(), key=lambda item: -item[1][TIME]):
+        row = {'agent_class': agent_class, 'goal': predicate}
+        row.update(zip(fields, counts))
+        rows.append(row)
+    return rows
+
+
+# Write the report for the agents to path, as CSV if the path ends in .csv and otherwise as JSON
+def write_planner_report(agents, path):
+    rows = planner_report(agents)
+    with open(path, 'w') as report_file:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(report_file, fieldnames=['agent_class', 'goal'] + fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, report_file, indent=2)
+    return rows
@@ -9,6 +9,7 @@
 
 class Node:
     default_decay = 0.1  # activation goes down by this much each cycle in the absence of spreading activation
+    thresholds = None  # the ThresholdIndex of the agent that tracks which of its nodes are over thresholds
 
     def __init__(self, node_id, fact, activation=0, valence=0, decay=default_decay, neighbors=None):
         self.node_id = node_id
@@ -29,10 +30,14 @@ class Node:
         return self.__str__()
 
     def update(self, activation_increment):
+        before = self.activation
         self.activation += activation_increment
         if self.activation < 0:
             self.activation = 0
         self.change_since_update += activation_increment
+        thresholds = self.thresholds
+        if thresholds is not None and (before >= thresholds.lowest or self.activation >= thresholds.lowest):
+            thresholds.moved(self, before)
 
     def spread(self):
         if self.change_since_update != 0:
@@ -43,6 +48,14 @@ class Node:
     def apply_decay(self):
         self.update(0 - self.decay)
 
+    # Decay without changing change_since_update, so that the decay doesn't spread to the neighbors
+    def apply_local_decay(self):
+        before = self.activation
+        self.activation = max(before - self.decay, 0)
+        thresholds = self.thresholds
+        if thresholds is not None and before >= thresholds.lowest:
+            thresholds.moved(self, before)
+
     # link_strength says how the neighbor is affected by changes to this node. Currently using just +/- 1
     # to designate a positive or negative connection, but the link magnitude is also used in spreading.
     def add_neighbor(self, node, link_strength=1):
@@ -55,15 +68,74 @@ class Node:
             return 0
 
 
+# A node whose activation decays lazily. It stores its activation at the step it was last updated, and the
+# activation at the current step of its clock is found in closed form: since each step takes decay off and
+# stops at 0, after k steps it is max(0, activation - k * decay). Nodes with a change to spread are put in the
+# clock's pending nodes.
+class LazyNode(Node):
+
+    def __init__(self, node_id, fact, clock, **kwargs):
+        self.clock = clock
+        Node.__init__(self, node_id, fact, **kwargs)
+
+    @property
+    def activation(self):
+        steps = self.clock.step - self.last_step
+        if steps == 0:
+            return self.stored_activation
+        return max(0, self.stored_activation - steps * self.decay)
+
+    @activation.setter
+    def activation(self, value):
+        self.stored_activation = value
+        self.last_step = self.clock.step
+
+    @property
+    def decay(self):
+        return self.node_decay
+
+    @decay.setter
+    def decay(self, value):
+        if hasattr(self, 'last_step'):
+            self.activation = self.activation  # the steps so far are at the old decay
+        self.node_decay = value
+
+    def update(self, activation_increment):
+        Node.update(self, activation_increment)
+        self.clock.pending[self] = None
+
+
+# The step count for the LazyNodes of an agent, and the nodes with a change to spread
+class DecayClock(object):
+
+    def __init__(self):
+        self.step = 0
+        self.pending = dict()  # used as an ordered set
+
+
 class System1Agent:
+    # How system1_decay works. When lazy_decay is set, nodes decay lazily (see LazyNode), so a step costs
+    # O(1) and spreading only visits the nodes that have changed. When local_decay is set, every node decays
+    # each step but, as with lazy decay, the decay is not passed on to the node's neighbors. Otherwise each
+    # node's decay is a change that spreads like any other, so neighbors of decaying nodes lose activation
+    # too, and nodes at 0 keep spreading their decay. Lazy decay gives the same activations as local_decay
+    # (up to rounding, since k steps are subtracted at once), and as the default when nodes have no neighbors.
+    # Set these before the agent creates nodes.
+    lazy_decay = False
+    local_decay = False
 
     def __init__(self):
         self.system1Fact = set()
         self.nodes = set()
         self.action_nodes = set()  # subset of nodes that suggest an action, for efficiency
-        self.fact_node_dict = dict()  # maps node facts to nodes
+        self.fact_node_dict = dict()  # maps the ids of node facts in fact_table to nodes
         self.neighbor_rules = dict()  # maps node fact predicates to lambdas
+        self.argument_index = dict()  # position -> argument value -> nodes with that value there, for LinkSpecs
         self.trace_add_activation = False
+        # The nodes over the thresholds that have been asked for, kept up to date as activations change
+        self.action_thresholds = ThresholdIndex()
+        self.node_thresholds = ThresholdIndex()  # nodes that are not action nodes
+        self.decay_clock = DecayClock()  # for lazy_decay
         # Activation threshold at which actions suggested by system 1 will be considered over deliberation
         # A low threshold will produce more 'impulsive' actions
         self.system1_threshold = 0.1
@@ -94,21 +166,35 @@ class System1Agent:
         n.update(activation_increment)
 
     def spreading_activation(self):
+        if self.lazy_decay:
+            pending = self.decay_clock.pending
+            self.decay_clock.pending = dict()
+            for node in pending:
+                node.spread()
+            return
         for node in self.nodes:
             node.spread()
 
     def system1_decay(self):
-        for node in self.nodes:
-            node.apply_decay()
+        if self.lazy_decay:
+            self.decay_clock.step += 1
+        elif self.local_decay:
+            for node in self.nodes:
+                node.apply_local_decay()
+        else:
+            for node in self.nodes:
+                node.apply_decay()
 
     def nodes_over_threshold(self, threshold=0.5):
-        return [n for n in self.nodes if n.activation >= threshold]
+        return self.action_thresholds.over(threshold, self.action_nodes) + \
+            self.node_thresholds.over(threshold, (n for n in self.nodes if n.thresholds is self.node_thresholds))
 
     def actions_over_threshold(self, threshold=0.5):
-        return [n for n in self.action_nodes if n.activation >= threshold]
+        return self.action_thresholds.over(threshold, self.action_nodes)
 
     # Turn a fact into a unique key by writing brackets and elements into a string
-    # so ('hi', ('there', 'you')) becomes "[hi[there,you]]"
+    # so ('hi', ('there', 'you')) becomes "[hi[there,you]]". Nodes are found by fact_table ids instead, but
+    # this is kept for printing and sorting facts.
     def fact_to_key(self, fact):
         if isinstance(fact, (list, tuple)):
             result = "["
@@ -120,11 +206,16 @@ class System1Agent:
 
     # Given a fact, return its node, creating a new one if needed.
     def fact_to_node(self, fact):
-        key = self.fact_to_key(fact)
+        key = fact_table.fact_id(fact)
         if key not in self.fact_node_dict:
-            node = Node(len(self.nodes) + 1, fact)
+            if self.lazy_decay:
+                node = LazyNode(len(self.nodes) + 1, fact, self.decay_clock)
+            else:
+                node = Node(len(self.nodes) + 1, fact)
             self.fact_node_dict[key] = node
             self.nodes.add(node)
+            node.thresholds = self.action_thresholds if fact[0] == 'action' else self.node_thresholds
+            node.thresholds.add(node)
             self.create_and_link_neighbors(node)
             if fact[0] == 'action':
                 self.action_nodes.add(node)
@@ -132,13 +223,175 @@ class System1Agent:
 
     # Apply neighbor creation rules to create or link nodes
     def create_and_link_neighbors(self, node):
+        if self.argument_index:
+            self.index_node(node)
         if node.fact[0] in self.neighbor_rules:
             for rule in self.neighbor_rules[node.fact[0]]:
                 rule(node)
 
     # Create a spreading activation rule, that sets up neighbors for nodes that match the rule
-    # and reinforcement strengths.
+    # and reinforcement strengths. The action is either a function called with each new node whose predicate
+    # is node_pattern, or a list of LinkSpecs, which link the new node to the existing nodes that share an
+    # argument with it, found through an index of the nodes by argument rather than by scanning them all.
     def create_neighbor_rule(self, node_pattern, action):
+        if isinstance(action, LinkSpec):
+            action = [action]
+        if isinstance(action, list):
+            for spec in action:
+                if spec.position not in self.argument_index:
+                    self.argument_index[spec.position] = dict()
+                    for node in self.nodes:
+                        self.index_node(node, [spec.position])
+            action = LinkRule(self, action)
         if node_pattern not in self.neighbor_rules:
             self.neighbor_rules[node_pattern] = []
         self.neighbor_rules[node_pattern].append(action)
+
+    # Add the node to the argument index at the positions (by default all the indexed positions)
+    def index_node(self, node, positions=None):
+        fact = node.fact
+        if not isinstance(fact, (tuple, list)):
+            return
+        for position in self.argument_index if positions is None else positions:
+            if position < len(fact):
+                values = self.argument_index[position]
+                key = index_key(fact[position])
+                if key not in values:
+                    values[key] = []
+                values[key].append(node)
+
+
+# A declarative neighbor rule: link the new node in both directions, with the weight as link strength, to each
+# node whose fact has the same argument at the position. For example the rule
+#     [LinkSpec(1, -1), LinkSpec(2, 1)]
+# links a node negatively to nodes sharing argument 1, and positively to the other nodes sharing argument 2.
+class LinkSpec(object):
+
+    def __init__(self, position, weight=1):
+        self.position = position
+        self.weight = weight
+
+    def __repr__(self):
+        return 'LinkSpec(' + str(self.position) + ', ' + str(self.weight) + ')'
+
+
+# The neighbor rule made from a list of LinkSpecs. Only facts with all the positions the specs compare are
+# linked, and a node is linked by the first spec it matches, like a chain of if/elif tests over the nodes.
+class LinkRule(object):
+
+    def __init__(self, agent, specs):
+        self.agent = agent
+        self.specs = specs
+        self.length = max(spec.position for spec in specs) + 1  # facts need at least this many elements
+
+    def __call__(self, node):
+        fact = node.fact
+        if not isinstance(fact, (tuple, list)) or len(fact) < self.length:
+            return
+        linked = set()
+        for spec in self.specs:
+            for other in self.agent.argument_index[spec.position].get(index_key(fact[spec.position]), []):
+                if other is node or id(other) in linked or len(other.fact) < self.length:
+                    continue
+                linked.add(id(other))
+                node.add_neighbor(other, spec.weight)
+                other.add_neighbor(node, spec.weight)
+
+    def __repr__(self):
+        return 'LinkRule(' + str(self.specs) + ')'
+
+
+# The argument as a key for the argument index
+def index_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return freeze(value)
+
+
+# The nodes whose activation is at or over each of a few thresholds, so that finding them takes time
+# proportional to their number rather than to the number of nodes. The nodes for a threshold are found by
+# scanning the first time it is asked for, and after that each node reports changes to its activation
+# with moved. Only the most recent max_levels thresholds are kept.
+class ThresholdIndex(object):
+    max_levels = 4
+
+    def __init__(self):
+        self.levels = dict()  # threshold -> dict with the nodes over it as keys, used as an ordered set
+        self.lowest = float('inf')  # nodes that stay below this don't need to report changes
+
+    # The nodes over the threshold, given all the nodes the index covers. LazyNodes drop below thresholds without
+    # reporting it, so the nodes are checked and the ones below are removed.
+    def over(self, threshold, nodes):
+        if threshold not in self.levels:
+            if len(self.levels) >= self.max_levels:
+                del self.levels[next(iter(self.levels))]
+            self.levels[threshold] = dict.fromkeys(n for n in nodes if n.activation >= threshold)
+            self.lowest = min(self.levels)
+        over = self.levels[threshold]
+        for node in [n for n in over if n.activation < threshold]:
+            del over[node]
+        return list(over)
+
+    # A new node
+    def add(self, node):
+        for (threshold, over) in self.levels.items():
+            if node.activation >= threshold:
+                over[node] = None
+
+    # The node's activation has changed from before
+    def moved(self, node, before):
+        activation = node.activation
+        for (threshold, over) in self.levels.items():
+            if before >= threshold:
+                if activation < threshold:
+                    over.pop(node, None)
+            elif activation >= threshold:
+                over[node] = None
+
+
+# Facts are interned in one table shared by all agents, which gives each distinct fact a small integer id, so
+# finding a fact's node is a dictionary lookup on the fact itself rather than on a string built from it.
+# Lists, dicts and sets in facts are frozen into tuples, frozensets and tuples, so a fact and its list version
+# have the same id.
+class FactTable(object):
+
+    def __init__(self):
+        self.ids = dict()  # fact -> id
+        self.facts = []  # id -> fact, frozen
+
+    def fact_id(self, fact):
+        try:
+            return self.ids[fact]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable
+            fact = freeze(fact)
+            if fact in self.ids:
+                return self.ids[fact]
+        fact_id = len(self.facts)
+        self.ids[fact] = fact_id
+        self.facts.append(fact)
+        return fact_id
+
+    def __len__(self):
+        return len(self.facts)
+
+
+# A hashable version of the value
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    elif isinstance(value, dict):
+        return frozenset((k, freeze(v)) for (k, v) in value.items())
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return str(value)
+
+
+fact_table = FactTable()
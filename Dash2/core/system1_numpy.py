@@ -0,0 +1,229 @@
+# A System 1 backend that keeps spreading activation state in NumPy arrays rather than in Node objects.
+#
+# Activations, the change since the last spread and the decay of each node are vectors indexed by node,
+# and the links between nodes are a sparse matrix in compressed sparse row (CSR) form, with a row for each
+# node that receives activation. spreading_activation is then one sparse matrix-vector product,
+# system1_decay one vector operation and actions_over_threshold a masked comparison.
+#
+# The API is the same as System1Agent: add_activation, create_neighbor_rule, fact_to_node, nodes and
+# action_nodes work as before, and neighbor rules are passed node objects that support add_neighbor, fact and
+# activation. To use it, put VectorSystem1Agent before the DASH agent class in the bases, e.g.
+#     class MyAgent(VectorSystem1Agent, DASHAgent):
+#
+# Agents can also keep their vectors in a PopulationSystem1 shared by many agents, which then spreads and decays
+# activation for all of them at once (see system1_population.py).
+#
+# One difference: in System1Agent a node spreads its change to its neighbors while looping over the set of
+# nodes, so a change can travel several links in one call, depending on the order of the set. Here every node
+# spreads the change it had at the start of the call, so each call moves activation exactly one link.
+import numpy
+from Dash2.core.system1 import System1Agent, Node, fact_table
+
+
+class VectorSystem1Agent(System1Agent):
+
+    def __init__(self):
+        System1Agent.__init__(self)
+        self.nodes = []  # VectorNodes in the order they were created, so node i has index i
+        self.action_nodes = []
+        self.activations = numpy.zeros(16)
+        self.changes = numpy.zeros(16)  # change in each activation since it last spread
+        self.decays = numpy.zeros(16)
+        self.is_action = numpy.zeros(16, dtype=bool)
+        # Links as (source, target, strength) lists, turned into the CSR matrix when they change
+        self.link_sources = []
+        self.link_targets = []
+        self.link_strengths = []
+        self.links = None
+        # Set when the agent joins a PopulationSystem1 (see system1_population.py), which then holds the vectors
+        self.population = None
+        self.positions = []  # position of each node in the population's vectors
+        self.version = 0  # counts node updates, as a population counts changes to its vectors
+
+    def add_activation(self, fact, activation_increment=0.3):
+        n = self.fact_to_node(fact)
+        if self.trace_add_activation:
+            print('adding activation to', n)
+        n.update(activation_increment)
+
+    def spreading_activation(self):
+        if self.population is not None:
+            self.population.spread([self])
+            return
+        size = len(self.nodes)
+        spreading = self.changes[:size].copy()
+        self.changes[:size] = 0
+        if not self.link_sources or not spreading.any():
+            return
+        increments = self.csr_links().multiply(spreading / 3)
+        self.activations[:size] = numpy.maximum(self.activations[:size] + increments, 0)
+        self.changes[:size] = increments
+
+    def system1_decay(self):
+        if self.population is not None:
+            self.population.decay([self])
+            return
+        size = len(self.nodes)
+        self.activations[:size] = numpy.maximum(self.activations[:size] - self.decays[:size], 0)
+        self.changes[:size] -= self.decays[:size]
+
+    def nodes_over_threshold(self, threshold=0.5):
+        return [self.nodes[i] for i in numpy.flatnonzero(self.vector('activations') >= threshold)]
+
+    def actions_over_threshold(self, threshold=0.5):
+        if self.population is not None:
+            return self.population.actions_over_threshold(self, threshold)
+        size = len(self.nodes)
+        over = self.is_action[:size] & (self.activations[:size] >= threshold)
+        return [self.nodes[i] for i in numpy.flatnonzero(over)]
+
+    # The values of the agent's nodes in the named vector, in node order
+    def vector(self, name):
+        if self.population is not None:
+            return getattr(self.population, name)[self.positions]
+        return getattr(self, name)[:len(self.nodes)]
+
+    # Given a fact, return its node, creating a new one if needed.
+    def fact_to_node(self, fact):
+        key = fact_table.fact_id(fact)
+        if key not in self.fact_node_dict:
+            index = len(self.nodes)
+            is_action = fact[0] == 'action'
+            if self.population is not None:
+                node = VectorNode(self.population, self.population.add_node(self, index, is_action), index, fact)
+                self.positions.append(node.position)
+            else:
+                if index == len(self.activations):
+                    self.grow(2 * index)
+                node = VectorNode(self, index, index, fact)
+                self.decays[index] = Node.default_decay
+                self.is_action[index] = is_action
+            self.fact_node_dict[key] = node
+            self.nodes.append(node)
+            self.create_and_link_neighbors(node)
+            if is_action:
+                self.action_nodes.append(node)
+        return self.fact_node_dict[key]
+
+    def grow(self, capacity):
+        for name in ['activations', 'changes', 'decays', 'is_action']:
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_link(self, source, target, strength=1):
+        self.link_sources.append(source)
+        self.link_targets.append(target)
+        self.link_strengths.append(strength)
+        self.links = None
+        if self.population is not None:
+            self.population.add_link(self.positions[source], self.positions[target], strength)
+
+    # The agent whose node is at the position in the vectors, as for a PopulationSystem1
+    def node_agent(self, position):
+        return self
+
+    # The links as a CSR matrix over the current nodes, rebuilt if links were added
+    def csr_links(self):
+        if self.links is None or self.links.shape != len(self.nodes):
+            self.links = CSRMatrix(len(self.nodes), self.link_targets, self.link_sources, self.link_strengths)
+        return self.links
+
+
+# A node in a VectorSystem1Agent. It only holds the fact and where the node's values are: the activation and
+# other values are read from and written to the vectors of its store, which is the agent or the population the
+# agent belongs to, at its position there, so it can be used as a Node.
+class VectorNode(object):
+    __slots__ = ['store', 'position', 'index', 'node_id', 'fact', 'valence']
+
+    def __init__(self, store, position, index, fact, valence=0):
+        self.store = store
+        self.position = position
+        self.index = index  # the node's index in its agent's nodes
+        self.node_id = index + 1
+        self.fact = fact
+        self.valence = valence
+
+    @property
+    def agent(self):
+        return self.store.node_agent(self.position)
+
+    @property
+    def activation(self):
+        return float(self.store.activations[self.position])
+
+    @activation.setter
+    def activation(self, value):
+        self.store.activations[self.position] = value
+        self.store.version += 1
+
+    @property
+    def decay(self):
+        return float(self.store.decays[self.position])
+
+    @decay.setter
+    def decay(self, value):
+        self.store.decays[self.position] = value
+
+    @property
+    def change_since_update(self):
+        return float(self.store.changes[self.position])
+
+    # pairs (node, link_strength), as in Node
+    @property
+    def neighbors(self):
+        agent = self.agent
+        return [(agent.nodes[target], strength)
+                for (source, target, strength) in zip(agent.link_sources, agent.link_targets, agent.link_strengths)
+                if source == self.index]
+
+    def __str__(self):
+        return "N" + str(self.node_id) + ": " + str(self.fact) + ", " + str(self.activation)\
+               + ", " + str([link[0].node_id for link in self.neighbors])
+
+    def __repr__(self):
+        return self.__str__()
+
+    def update(self, activation_increment):
+        store = self.store
+        store.activations[self.position] = max(store.activations[self.position] + activation_increment, 0)
+        store.changes[self.position] += activation_increment
+        store.version += 1
+
+    def apply_decay(self):
+        self.update(0 - self.decay)
+
+    def add_neighbor(self, node, link_strength=1):
+        self.agent.add_link(self.index, node.index, link_strength)
+
+    def node_to_action(self):
+        if self.fact[0] == 'action':
+            return self.fact[1:]
+        else:
+            return 0
+
+
+# A sparse square matrix in compressed sparse row form, built from (row, column, value) triples.
+# Repeated entries are kept and summed by multiply, as repeated neighbors add up in Node.spread.
+class CSRMatrix(object):
+
+    def __init__(self, shape, rows, columns, values):
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        order = numpy.argsort(rows, kind='stable')
+        self.shape = shape
+        self.indices = numpy.asarray(columns, dtype=numpy.int64)[order]  # column of each entry, by row
+        self.data = numpy.asarray(values, dtype=float)[order]
+        self.indptr = numpy.zeros(shape + 1, dtype=numpy.int64)  # entries for row i are indptr[i]:indptr[i+1]
+        numpy.cumsum(numpy.bincount(rows, minlength=shape), out=self.indptr[1:])
+        starts = self.indptr[:-1]
+        self.nonempty = numpy.flatnonzero(starts < self.indptr[1:])  # rows with at least one entry
+        self.nonempty_starts = starts[self.nonempty]
+
+    # The product of the matrix with the vector
+    def multiply(self, vector):
+        result = numpy.zeros(self.shape)
+        if len(self.data):
+            products = self.data * vector[self.indices]
+            result[self.nonempty] = numpy.add.reduceat(products, self.nonempty_starts)
+        return result
@@ -0,0 +1,219 @@
+# A System 1 engine for a whole population of VectorSystem1Agents (see system1_numpy.py), e.g. all the agents
+# of a Trial or WorkProcessor with population_system1 set.
+#
+# The agents that join a PopulationSystem1 keep their activations, changes and decays in its vectors, and
+# their links in one sparse matrix. Since links only join nodes of the same agent, the matrix is block diagonal,
+# with a block for each agent, so one matrix-vector product spreads activation for every agent at once, and
+# one vector operation decays it. The vectors grow in chunks as the agents' fact_to_node creates nodes, and new
+# links are kept in a list that is merged into the matrix when it gets long enough.
+#
+# The batched decision cycle in dash_action calls system1_updates and system1_steps to advance all the agents
+# in a population with one operation, and each agent's system1_propose_actions reads its action nodes over
+# threshold from one comparison over the whole population. An agent can still spread, decay and propose on its
+# own, touching just its own nodes, so the results are the same as for agents with their own vectors.
+import numpy
+from Dash2.core.system1 import Node
+from Dash2.core.system1_numpy import VectorSystem1Agent, CSRMatrix
+
+
+class PopulationSystem1(object):
+    chunk = 4096  # the vectors grow by a multiple of this many nodes
+    merge_links = 1024  # new links are merged into the matrix when there are more than this or 1/8 of the total
+
+    def __init__(self):
+        self.members = []  # agents, in the order they joined
+        self.size = 0  # number of nodes
+        self.activations = numpy.zeros(self.chunk)
+        self.changes = numpy.zeros(self.chunk)  # change in each activation since it last spread
+        self.decays = numpy.zeros(self.chunk)
+        self.is_action = numpy.zeros(self.chunk, dtype=bool)
+        self.owner = numpy.zeros(self.chunk, dtype=numpy.int64)  # index in members of the node's agent
+        self.local = numpy.zeros(self.chunk, dtype=numpy.int64)  # index of the node in its agent's nodes
+        # Links between positions. The first merged of them are in the links matrix.
+        self.link_sources = []
+        self.link_targets = []
+        self.link_strengths = []
+        self.links = None
+        self.merged = 0
+        self.version = 0  # incremented whenever the vectors change
+        self.proposals = None  # ((version, threshold), member index -> positions of action nodes over threshold)
+        self.requested = None  # (version, threshold) of the last request that wasn't answered from proposals
+
+    # Move the agent's nodes and links into the population
+    def join(self, agent):
+        agent.population_slot = len(self.members)
+        self.members.append(agent)
+        agent.positions = []
+        for node in agent.nodes:
+            position = self.add_node(agent, node.index, agent.is_action[node.index])
+            self.activations[position] = agent.activations[node.index]
+            self.changes[position] = agent.changes[node.index]
+            self.decays[position] = agent.decays[node.index]
+            (node.store, node.position) = (self, position)
+            agent.positions.append(position)
+        for (source, target, strength) in zip(agent.link_sources, agent.link_targets, agent.link_strengths):
+            self.add_link(agent.positions[source], agent.positions[target], strength)
+        agent.population = self
+        agent.activations = agent.changes = agent.decays = agent.is_action = None
+
+    # Add a node for the agent and return its position
+    def add_node(self, agent, index, is_action):
+        position = self.size
+        if position == len(self.activations):
+            self.grow(-(-3 * position // (2 * self.chunk)) * self.chunk)
+        self.decays[position] = Node.default_decay
+        self.is_action[position] = is_action
+        self.owner[position] = agent.population_slot
+        self.local[position] = index
+        self.size += 1
+        self.version += 1
+        return position
+
+    def grow(self, capacity):
+        for name in ['activations', 'changes', 'decays', 'is_action', 'owner', 'local']:
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def add_link(self, source, target, strength=1):
+        self.link_sources.append(source)
+        self.link_targets.append(target)
+        self.link_strengths.append(strength)
+
+    def node_agent(self, position):
+        return self.members[self.owner[position]]
+
+    # Spread activation for the agents, which must be members. When they are a small part of the population
+    # each agent spreads over its own links, and otherwise they spread together over the whole matrix.
+    def spread(self, agents):
+        self.version += 1
+        if 4 * len(agents) < len(self.members):
+            for agent in agents:
+                positions = agent.positions
+                spreading = self.changes[positions]
+                self.changes[positions] = 0
+                if not agent.link_sources or not spreading.any():
+                    continue
+                increments = agent.csr_links().multiply(spreading / 3)
+                self.activations[positions] = numpy.maximum(self.activations[positions] + increments, 0)
+                self.changes[positions] = increments
+            return
+        size = self.size
+        if len(agents) == len(self.members):
+            spreading = self.changes[:size].copy()
+            self.changes[:size] = 0
+        else:
+            selected = self.selection(agents)
+            spreading = numpy.where(selected, self.changes[:size], 0)
+            self.changes[:size][selected] = 0
+        if not self.link_sources or not spreading.any():
+            return
+        increments = self.multiply(spreading / 3)  # zero outside the agents' blocks
+        self.activations[:size] = numpy.maximum(self.activations[:size] + increments, 0)
+        self.changes[:size] += increments
+
+    # Decay activation for the agents, which must be members
+    def decay(self, agents):
+        self.version += 1
+        if 4 * len(agents) < len(self.members):
+            for agent in agents:
+                positions = agent.positions
+                self.activations[positions] = numpy.maximum(self.activations[positions] - self.decays[positions], 0)
+                self.changes[positions] -= self.decays[positions]
+            return
+        size = self.size
+        decays = self.decays[:size]
+        if len(agents) != len(self.members):
+            decays = numpy.where(self.selection(agents), decays, 0)
+        self.activations[:size] = numpy.maximum(self.activations[:size] - decays, 0)
+        self.changes[:size] -= decays
+
+    # True for each node that belongs to one of the agents
+    def selection(self, agents):
+        selected = numpy.zeros(len(self.members), dtype=bool)
+        selected[[agent.population_slot for agent in agents]] = True
+        return selected[self.owner[:self.size]]
+
+    # The product of the links matrix with the vector
+    def multiply(self, vector):
+        if len(self.link_sources) - self.merged > max(self.merge_links, self.merged // 8):
+            self.links = CSRMatrix(self.size, self.link_targets, self.link_sources, self.link_strengths)
+            self.merged = len(self.link_sources)
+        result = numpy.zeros(self.size)
+        if self.links is not None:
+            result[:self.links.shape] = self.links.multiply(vector[:self.links.shape])
+        if self.merged < len(self.link_sources):
+            sources = numpy.asarray(self.link_sources[self.merged:], dtype=numpy.int64)
+            strengths = numpy.asarray(self.link_strengths[self.merged:], dtype=float)
+            result += numpy.bincount(self.link_targets[self.merged:], weights=strengths * vector[sources],
+                                     minlength=self.size)
+        return result
+
+    # The agent's action nodes with activation at least threshold. The first request after the vectors change
+    # only looks at the agent's nodes; if another agent asks before they change again, the action nodes over
+    # threshold are found for the whole population and the rest of the requests are answered from that.
+    def actions_over_threshold(self, agent, threshold):
+        key = (self.version, threshold)
+        if self.proposals is not None and self.proposals[0] == key:
+            positions = self.proposals[1].get(agent.population_slot, [])
+        elif self.requested == key:
+            size = self.size
+            over = numpy.flatnonzero(self.is_action[:size] & (self.activations[:size] >= threshold))
+            owners = self.owner[over]
+            order = numpy.argsort(owners, kind='stable')
+            (over, owners) = (over[order], owners[order])
+            (slots, starts) = numpy.unique(owners, return_index=True)
+            self.proposals = (key, dict(zip(slots.tolist(), numpy.split(over, starts[1:]))))
+            positions = self.proposals[1].get(agent.population_slot, [])
+        else:
+            self.requested = key
+            positions = agent.positions
+            over = self.is_action[positions] & (self.activations[positions] >= threshold)
+            return [agent.nodes[i] for i in numpy.flatnonzero(over)]
+        return [agent.nodes[i] for i in self.local[positions]]
+
+
+# Put the VectorSystem1Agents among the agents into a new PopulationSystem1 and return it
+def join_population(agents):
+    population = PopulationSystem1()
+    for agent in agents:
+        if isinstance(agent, VectorSystem1Agent) and agent.population is None:
+            population.join(agent)
+    return population
+
+
+# As system1_update for each agent, advancing the agents in each population together
+def system1_updates(agents):
+    for (population, members) in population_groups(agents, 'system1_update', 'spreading_activation'):
+        if population is None:
+            for agent in members:
+                agent.system1_update()
+        else:
+            population.spread(members)
+
+
+# As system1_step for each agent, advancing the agents in each population together
+def system1_steps(agents):
+    for (population, members) in population_groups(agents, 'system1_step', 'system1_decay'):
+        if population is None:
+            for agent in members:
+                agent.system1_step()
+        else:
+            population.decay(members)
+
+
+# Pairs (population, agents) where the agents use the VectorSystem1Agent method through the System1Agent
+# step, and (None, agents) for the rest
+def population_groups(agents, step, method):
+    groups = dict()
+    others = []
+    for agent in agents:
+        cls = type(agent)
+        population = getattr(agent, 'population', None)
+        if population is not None and getattr(cls, step) is getattr(VectorSystem1Agent, step) \
+                and getattr(cls, method) is getattr(VectorSystem1Agent, method):
+            groups.setdefault(id(population), (population, []))[1].append(agent)
+        else:
+            others.append(agent)
+    return list(groups.values()) + [(None, others)]
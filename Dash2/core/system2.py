@@ -1,37 +1,62 @@
 # Contains code relating to goal decomposition and mental model projection
 from Dash2.core.string_aux import convert_camel
+from Dash2.core.term import Term, compile_term, isConstant, isVar, substitute, substitute_argument, unify
+from Dash2.core.planner_stats import PlannerStats, UNIFY, IS_IN, CANDIDATES, BACKTRACKS
 import ast
+import hashlib
+import os
+import pickle
 import time
-import collections
+import heapq
 import abc
+import random
+from types import MappingProxyType
 
 
 class System2Agent:
     __metaclass__ = abc.ABCMeta
 
+    # Trace flags are class defaults, set on an agent to turn them on, so they don't take space in every agent
+    traceLoad = False
+    traceParse = False
+    traceKnown = False
+    traceGoals = False
+    traceClauses = False  # prints out information about clauses being tested for a goal
+    traceForget = False
+    traceProject = False
+
+    _knownWorld = None  # (knownDict, version, World) cached by knownWorld
+
+    # How chooseGoal picks between unachieved goals with the same weight: 'first' or 'last' given that weight
+    # in goalWeightDict, or 'random', which draws again from the tied goals on each call
+    goalTieBreak = 'first'
+    _goalAgenda = None
+
+    # Set on an agent or a class to count the work done for each goal in plannerStats (see planner_stats.py)
+    instrumentPlanner = False
+    _plannerStats = None
+
+    # Memoized goal decomposition. The action chosen for each goal is cached along with the
+    # (fact store, predicate) pairs it depended on, and dropped when facts with those predicates
+    # are added or forgotten.
+    memoizePlans = True
+
     def __init__(self):
-        self.goalWeightDict = dict()
+        self.goalWeightDict = GoalWeights()
         self.goalRequirementsDict = dict()
         self.primitiveActionDict = dict()
-        self.knownDict = dict()
-        self.knownFalseDict = dict()
-        self.transientDict = dict()
-        self.transientDict['forget'] = [('forget', 'x')]  # Forget should be transient so you can keep forgetting things
+        self.knownDict = FactIndex()
+        self.knownFalseDict = FactIndex()
+        self.transientDict = FactIndex()
+        self.transientDict.add(('forget', 'x'))  # Forget should be transient so you can keep forgetting things
         # Commenting out the line above will break something, but I need to be able to get past a 'forget'
         # clause in the middle of some goal requirements, which will never happen if forget is transient.
         # I think the best answer right now might be to add some judicious forget([forget(x)]) statements
         self.projectionRuleDict = dict()
         self.triggerRules = []
         self.utilityRules = []
-
-        # Read the agent definition in a simpler syntax and create the appropriate definitions
-        self.traceLoad = False
-        self.traceParse = False
-        self.traceKnown = False
-        self.traceGoals = False
-        self.traceClauses = False  # prints out information about clauses being tested for a goal
-        self.traceForget = False
-        self.traceProject = False
+        self.sharedRules = False  # True when the rules above point to a System2Program or another agent's rules
+        self.clearPlanCache()
 
     def system2_propose_action(self):
         return self.choose_action_by_reasoning()
@@ -61,8 +86,12 @@ class System2Agent:
             return True
         return False
 
-    # Point to the internal structures of the other agent, typically to save space
+    # Point to the internal structures of the other agent, typically to save space. The goals are read-only
+    # from then on for both agents, until one of them copies its rules with ownRules.
     def use_system2(self, agent):
+        agent.goalWeightDict = read_only(agent.goalWeightDict)
+        agent.goalRequirementsDict = read_only(agent.goalRequirementsDict)
+        agent.sharedRules = True
         self.goalWeightDict = agent.goalWeightDict
         self.goalRequirementsDict = agent.goalRequirementsDict
         self.primitiveActionDict = agent.primitiveActionDict
@@ -72,213 +101,76 @@ class System2Agent:
         self.projectionRuleDict = agent.projectionRuleDict
         self.triggerRules = agent.triggerRules
         self.utilityRules = agent.utilityRules
+        self.sharedRules = True
+        self.clearPlanCache()
 
-
+    # Read the agent definition. Definitions are parsed into a System2Program once per process (see
+    # load_program), and the program's rules are shared by every agent that reads the same definition.
     def readAgent(self, string):
-        # state is used for multi-line statements like goalRequirements
-        # and projection rules
-        state = 0
-        goalRequirements = 1
-        project = 2
-        utility = 3
-        trigger = 4
-        lines = []
-        for line in string.split('\n'):
-            if "#" in line:
-                line = line[0:line.find("#")]
-            line = line.strip()
-            if state in [goalRequirements, project, utility, trigger]:
-                if line == "":
-                    if state == goalRequirements:
-                        self.readGoalRequirements(lines)
-                    elif state == project:
-                        self.readProject(lines)
-                    elif state == trigger:
-                        self.readTrigger(lines)
-                    elif state == utility:
-                        self.readUtility(lines)
-                    state = 0
-                else:
-                    lines.append(line)
-            elif line.startswith("goalWeight"):
-                self.readGoalWeight(line)
-            elif line.startswith("goalRequirements"):
-                state = goalRequirements
-                lines = [line]
-            elif line.startswith("known"):
-                self.readKnown(line)
-            elif line.startswith("primitive"):
-                self.readPrimitive(line)
-            elif line.startswith("project"):
-                state = project
-                lines = [line]
-            elif line.startswith("trigger"):
-                state = trigger
-                lines = [line]
-            elif line.startswith("utility"):
-                state = utility
-                lines = [line]
-            elif line.startswith("transient"):
-                self.readTransient(line)
-            elif line != "":
-                print("unrecognized line in readAgent:", line)
-
-    def readGoalWeight(self, line):
-        # line has form 'goalWeight predicate(arg1, arg2, ..) integer'
-        goal = self.readGoalTuple(line[line.find(" "):line.rfind(" ")].strip())
-        weight = int(line[line.rfind(" "):].strip())
-        if self.traceLoad:
-            print("Goal is ", goal)
-        self.goalWeight(goal, weight)
-
-    def readGoalRequirements(self, lines):
-        goal = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
-        requirements = [self.readGoalTuple(line) for line in lines[1:]]
-        if self.traceLoad:
-            print("Adding goal requirements for", goal, ":", requirements)
-        self.goalRequirements(goal, requirements)
-
-    def readKnown(self, line):
-        goal = self.readGoalTuple(line[line.find(" "):].strip())
-        self.knownTuple(goal)
+        self.use_program(load_program(string, self.traceLoad, self.traceParse, self.traceProject))
+
+    # Use the rules of a program. An agent with no rules of its own points to the program's structures,
+    # otherwise the program's rules are added to a private copy of the agent's rules.
+    def use_program(self, program):
+        if self.hasRules():
+            self.ownRules()
+            program.addRulesTo(self)
+        else:
+            (self.goalWeightDict, self.goalRequirementsDict) = program.sharedViews()
+            self.transientDict = program.transientDict
+            self.projectionRuleDict = program.projectionRuleDict
+            self.triggerRules = program.triggerRules
+            self.utilityRules = program.utilityRules
+            self.sharedRules = True
+        for fact in program.known:
+            self.knownTuple(fact)
+        if program.primitives:
+            self.primitiveActions(program.primitives)
+        self.clearPlanCache()
+
+    def hasRules(self):
+        return bool(self.goalWeightDict or self.goalRequirementsDict or self.projectionRuleDict or self.triggerRules
+                    or self.utilityRules or any(key != 'forget' for key in self.transientDict))
+
+    # Copy rules that are shared with a program or another agent before changing them
+    def ownRules(self):
+        if not self.sharedRules:
+            return
+        self.goalWeightDict = GoalWeights(self.goalWeightDict)
+        self.goalRequirementsDict = dict((key, list(rules)) for (key, rules) in self.goalRequirementsDict.items())
+        self.transientDict = self.transientDict.copy()
+        self.projectionRuleDict = dict((key, list(rules)) for (key, rules) in self.projectionRuleDict.items())
+        self.triggerRules = list(self.triggerRules)
+        self.utilityRules = list(self.utilityRules)
+        self.sharedRules = False
+        self.clearPlanCache()
 
     # Read a goal as a tuple from the line, which should start with the goal
     # description, e.g. goal(arg1, arg2, ..). Each arg may be a subgoal.
-    # Uses the python compile's parser
     def readGoalTuple(self, line):
-        # It's a compile module, with a statement node with one Discard object
-        return self.parseToTuple(ast.parse(line).body[0].value)
+        return read_goal_tuple(line)
 
-    # It's tempting to leave the parse tree with the classes from the compile
-    # module but I'd like to make it modular with abstraction
     def parseToTuple(self, parse):
-        if isinstance(parse, ast.Name):
-            return parse.id
-        elif isinstance(parse, ast.Call):
-            return tuple([self.parseToTuple(x) for x in [parse.func] + parse.args])
-        elif isinstance(parse, ast.List):
-            return [self.parseToTuple(x) for x in parse.elts]
-        elif isinstance(parse, ast.BoolOp) and isinstance(parse.op, ast.And):
-            return tuple(['and'] + [self.parseToTuple(x) for x in parse.values])
-        elif isinstance(parse, ast.BoolOp) and isinstance(parse.op, ast.Or):
-            return tuple(['or'] + [self.parseToTuple(x) for x in parse.values])
-        elif isinstance(parse, ast.Constant):   # a string constant used
-            if isinstance(parse.value, str):
-                return "_" + parse.value
-            else:
-                return parse.value # old 2delete
-        elif isinstance(parse, ast.Num):   # a number constant used
-            return parse.n
-        elif isinstance(parse, ast.Str):   # a number constant used
-            return "_" + parse.s
-        elif isinstance(parse, ast.UnaryOp) and isinstance(parse.op, ast.Not):
-            return 'not', self.parseToTuple(parse.operand)
-        else:
-            print("Unhandled node type:", parse)
-            raise BaseException
+        return parse_to_tuple(parse)
 
     @abc.abstractmethod
     def primitiveActions(self, line):
         """Implemented in DashAction"""
         return
 
-    def readPrimitive(self, line):
-        # 'primitive a, b, c' means that a, b and c and primitive actions with their own names as the defining functions
-        self.primitiveActions(line[10:].split(", "))
-
-    def readProject(self, lines):
-        if self.traceParse:
-            print("Reading projection rule from", lines)
-        goal = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
-        # Store a list of projection rules indexed by the goal
-        head = goal
-        if isinstance(goal, (list, tuple)):
-            head = goal[0]
-        if head not in self.projectionRuleDict:
-            self.projectionRuleDict[head] = []
-        effects = self.read_effect_lines(lines[1:])
-        self.projectionRuleDict[head].append((goal, effects))
-
-    def readTrigger(self, lines):
-        if self.traceParse:
-            print("Reading trigger rule from", lines)
-        trigger = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
-        effects = self.read_effect_lines(lines[1:])  # trigger effects are just like project rule effects
-        self.triggerRules.append((trigger, effects))
-
-    def read_effect_lines(self, lines):
-        effects = []
-        # To handle multi-line preconditions, group lines into a longLine that
-        # contains a " + " or " - "
-        longLine = ""
-        for line in lines:
-            longLine += line
-            effectLine = longLine
-            condition = True
-            if "+ " in line or "- " in line:
-                if "->" in longLine:
-                    [precondLine, effectLine] = longLine.split("->")
-                    condition = self.readGoalTuple(precondLine)
-                effects.append(self.readEffectLine(effectLine, condition))
-                longLine = ""
-        return effects
-
-    def readEffectLine(self, line, condition=True):
-        line = line.lstrip(' ')
-        p = ast.parse(line).body[0].value # old: ast.parse(line.strip()).node.nodes[0].expr
-        if self.traceParse:
-            print('Parse for effect line', line, 'is', p)
-        # With no probabilities the results are UnaryAdd or UnaryDel, otherwise Add and Del,
-        # Note the condition isn't included here
-        if isinstance(p, ast.UnaryOp) and isinstance(p.op, ast.UAdd): #isinstance(p, ast.UAdd):
-            return Effect(Effect.add, self.parseToTuple(p.operand), condition, 1)
-        elif isinstance(p, ast.UnaryOp) and isinstance(p.op, ast.USub): #isinstance(p, ast.USub):
-            return Effect(Effect.delete, self.parseToTuple(p.operand), condition, 1)
-        elif isinstance(p, ast.BinOp) and isinstance(p.op, ast.Add): #isinstance(p, ast.Add):
-            if isinstance(p.left, ast.Name):
-                return Effect(Effect.add, self.parseToTuple(p.right), condition, p.left.id)
-            if isinstance(p.left, ast.Num):
-                return Effect(Effect.add, self.parseToTuple(p.right), condition, p.left.n)
-        elif isinstance(p, ast.BinOp) and isinstance(p.op, ast.Sub): #isinstance(p, ast.Sub):
-            if isinstance(p.left, ast.Name):
-                return Effect(Effect.delete, self.parseToTuple(p.right), condition, p.left.id)
-            if isinstance(p.left, ast.Num):
-                return Effect(Effect.add, self.parseToTuple(p.right), condition, p.left.n)
-        else:
-            print("No effects found", line)
-            return None
-
-    # Lines are of the form condition -> incr, and each match to condition increments
-    # utility by that amount.
-    def readUtility(self, lines):
-        for line in lines[1:]:
-            if self.traceProject:
-                print("reading utility from", line)
-            [precond, incr] = line.split("->")
-            self.utilityRules.append([self.readGoalTuple(precond.strip()), float(incr)])
-        if self.traceProject:
-            print("Utility rules are", self.utilityRules)
-
-    def readTransient(self, line):
-        goal = self.readGoalTuple(line[line.find(" "):].strip())
-        predicate = goal
-        if isinstance(goal, (list,tuple)):
-            predicate = goal[0]
-        if predicate not in self.transientDict:
-            self.transientDict[predicate] = []
-        self.transientDict[predicate].append(goal)
-        if self.traceLoad:
-            print("Transient:", self.transientDict)
-
     def goalWeight(self, goal, weight):
-        self.goalWeightDict[goal] = weight
+        self.ownRules()
+        self.goalWeightDict[compile_term(goal)] = weight
+        self._goalAgenda = None
 
     def goalRequirements(self, goal, requirements):
+        self.ownRules()
         # Treat as append, index by goal name (head)
-        # and collate the goal itself with the body
+        # and collate the goal itself with the body. Both are compiled for unification.
         if goal[0] not in self.goalRequirementsDict:
             self.goalRequirementsDict[goal[0]] = []
-        self.goalRequirementsDict[goal[0]].append((goal, requirements))
+        self.goalRequirementsDict[goal[0]].append((compile_term(goal), [compile_term(r) for r in requirements]))
+        self.clearPlanCache()
 
     def printGoals(self):
         for goal in self.goalWeightDict:
@@ -286,11 +178,13 @@ class System2Agent:
 
     def clearGoalsAndPlans(self):
         # Remove goals and plans, allowing new behaviors while leaving primitive actions
-        self.goalWeightDict = {}
+        self.goalWeightDict = GoalWeights()
         self.goalRequirementsDict = {}
         self.projectionRuleDict = {}
         self.triggerRules = []
         self.utilityRules = []
+        self.sharedRules = False
+        self.clearPlanCache()
 
     # Adds 'goal' as a known fact or completed goal
     def knownTuple(self, t):
@@ -300,6 +194,12 @@ class System2Agent:
         self.addTuple(t, self.knownFalseDict)
 
     def addTuple(self, t, adict):
+        if isinstance(adict, FactIndex):
+            if adict.add(t):
+                if self.traceKnown:
+                    print("recording as known", t)
+                self.invalidatePlans(adict, t[0])
+            return
         if t[0] not in adict:
             adict[t[0]] = []
         if t not in adict[t[0]]:
@@ -321,16 +221,91 @@ class System2Agent:
         if self.goalWeightDict == {}:
             print('empty weight dict')
             return None
-        # Return a goal with highest weight that is not already achieved (always returns the same one)
-        validGoals = [item for item in self.goalWeightDict.items() if self.isKnown(item[0]) is False]
-        if validGoals:
-            return max(validGoals, key=lambda pair: pair[1])[0]
-        else:
-            return None
+        # Return a goal with highest weight that is not already achieved. Ties are broken by goalTieBreak,
+        # by default returning the first such goal given a weight.
+        return self.goalAgenda().top(self)
+
+    # The agenda for the goals in goalWeightDict, rebuilt if the goals, their weights or knownDict have changed
+    def goalAgenda(self):
+        agenda = self._goalAgenda
+        if agenda is None or not agenda.current(self):
+            agenda = self._goalAgenda = GoalAgenda(self.goalWeightDict, self.knownDict, self.goalTieBreak)
+        return agenda
 
     def chooseActionForGoals(self, goals, indent=0):
         if goals is None:
             return None
+        if self.instrumentPlanner:
+            stats = self.plannerStats()
+            stats.begin(goals[0])
+            try:
+                return self.memoizedActionForGoals(goals, indent)
+            finally:
+                stats.end()
+        return self.memoizedActionForGoals(goals, indent)
+
+    def memoizedActionForGoals(self, goals, indent=0):
+        if not self.memoizePlans:
+            return self.decomposeGoals(goals, indent)
+        goal = goals[0]
+        try:
+            cached = self._planCache.get(goal)
+        except TypeError:  # goals containing unhashable data aren't cached
+            return self.decomposeGoals(goals, indent)
+        if cached is not None and not all(self.planDependencyHolds(key, store, version)
+                                          for (key, (store, version)) in cached[1].items()):
+            del self._planCache[goal]  # e.g. knownDict was replaced since the decomposition was made
+            cached = None
+        if cached is not None:
+            (action, dependencies) = cached
+            if self._planDependencies:
+                self._planDependencies[-1].update(dependencies)
+            return copy_action(action)
+        self._planDependencies.append(dict())
+        try:
+            action = self.decomposeGoals(goals, indent)
+        finally:
+            dependencies = self._planDependencies.pop()
+        if self._planDependencies:
+            self._planDependencies[-1].update(dependencies)
+        # Don't cache a decomposition whose inputs changed while it was being made, e.g. because it
+        # marked one of its subgoals as achieved
+        if all(self.planDependencyHolds(key, store, version) for (key, (store, version)) in dependencies.items()):
+            self._planCache[goal] = (copy_action(action), dependencies)
+            for key in dependencies:
+                self._planDependents.setdefault(key, set()).add(goal)
+        return action
+
+    # Drop the cached decompositions that depend on facts with this predicate in adict
+    def invalidatePlans(self, adict, predicate):
+        for goal in self._planDependents.pop((id(adict), predicate), ()):
+            self._planCache.pop(goal, None)
+
+    # Record that the goal being decomposed depends on the facts under key in adict, with the version read.
+    # A plain dict has no versions, so a decomposition that reads one is not cached.
+    def recordPlanDependency(self, adict, key):
+        if self._planDependencies:
+            version = adict.versions.get(key, 0) if isinstance(adict, FactIndex) else None
+            self._planDependencies[-1].setdefault((id(adict), key), (adict, version))
+
+    # Whether the facts a cached decomposition read are unchanged: they came from one of the agent's current fact
+    # stores, and the version under the key is the one read
+    def planDependencyHolds(self, key, store, version):
+        return (store is self.knownDict or store is self.knownFalseDict or store is self.transientDict) \
+            and version is not None and store.versions.get(key[1], 0) == version
+
+    def plannerStats(self):
+        if self._plannerStats is None:
+            self._plannerStats = PlannerStats()
+        return self._plannerStats
+
+    def clearPlanCache(self):
+        self._planCache = dict()
+        self._planDependents = dict()
+        self._planDependencies = []  # stack of dependencies for the goals being decomposed
+
+    # Find the next action for the goals by decomposing the first one through its goal requirements
+    def decomposeGoals(self, goals, indent=0):
         if self.traceGoals:
             print('  '*indent, "Seeking action for goals", goals)
         gpb = self.findGoalRequirements(goals[0])
@@ -347,6 +322,8 @@ class System2Agent:
             # but try the next requirements (if any) if there is a knownFalse subgoal in the requirements
             # 7/21/16 - wasn't substituting bindings so trying that (then moved back since didn't solve specific problem)
             na = self.nextAction(goal, requirements, bindings, indent)
+            if self.instrumentPlanner and (na is False or na is None):
+                self.plannerStats().count(BACKTRACKS)
             if na is not False and na is not None:
                 # If the 'action' is the symbol 'known', then the main goal was achieved through
                 # this goalRequirements clause. We need to compose the bindings so bindings for the 'local variables'
@@ -405,6 +382,7 @@ class System2Agent:
         # If we got here, then we went through all the subactions without needing to do anything,
         # So the goal should be marked as achieved
         subbedGoal = substitute(goal,bindings)
+        self.recordPlanDependency(self.knownDict, subbedGoal[0])
         if not self.isTransient(subbedGoal):
             self.knownTuple(subbedGoal)
             if self.traceGoals:
@@ -434,9 +412,23 @@ class System2Agent:
     # Create a list of all the known facts, used for projection
     # (Simple def used for functional abstraction)
     def knownList(self):
-        return [fact if type(fact) is not tuple or len(fact) != 1 else fact[0] for goal in self.knownDict for fact in self.knownDict[goal]]
+        return [fact if not isinstance(fact, tuple) or len(fact) != 1 else fact[0] for goal in self.knownDict for fact in self.knownDict[goal]]
+
+    # The known facts as a World, for projection. Projection never changes the world it starts from,
+    # so the same World is used until the known facts change.
+    def knownWorld(self):
+        version = sum(self.knownDict.versions.values())
+        if self._knownWorld is None or self._knownWorld[0] is not self.knownDict or self._knownWorld[1] != version:
+            self._knownWorld = (self.knownDict, version, World(self.knownList()))
+        return self._knownWorld[2]
 
     def isIn(self, goal, adict):
+        if isinstance(adict, FactIndex):
+            self.recordPlanDependency(adict, goal[0])
+            if self.instrumentPlanner:
+                self.plannerStats().count(IS_IN)
+                return adict.match(goal, self.plannerStats())
+            return adict.match(goal)
         if goal[0] in adict:
             for term in adict[goal[0]]:
                 bindings = unify(goal, term)
@@ -453,7 +445,15 @@ class System2Agent:
                 continue
             predicate = pattern[0]
             for d in [self.knownDict, self.knownFalseDict]:
-                if predicate in d:
+                if predicate in d and isinstance(d, FactIndex):
+                    # The index only hands back the facts that could unify with the pattern
+                    for fact in d.matches(pattern):
+                        if self.traceForget:
+                            print("Forgetting", fact)
+                        d.remove(fact)
+                        forgotten.append(fact)
+                    self.invalidatePlans(d, predicate)
+                elif predicate in d:
                     # not sure if I can modify the list I'm iterating across
                     to_remove = []
                     for fact in d[predicate]:
@@ -464,6 +464,7 @@ class System2Agent:
                     for fact in to_remove:
                         d[predicate].remove(fact)
                         forgotten.append(fact)
+                    self.invalidatePlans(d, predicate)
         return [{}]  # succeed as a primitive action, with no bindings
 
     def findGoalRequirements(self, goal):
@@ -471,6 +472,9 @@ class System2Agent:
             # Return all possible bindings since we may be backtracking on them.
             # Later want to use an incrementally-built structure rather than a list.
             result = []
+            if self.instrumentPlanner:
+                self.plannerStats().count(CANDIDATES, len(self.goalRequirementsDict[goal[0]]))
+                self.plannerStats().count(UNIFY, len(self.goalRequirementsDict[goal[0]]))
             for pair in self.goalRequirementsDict[goal[0]]:
                 bindings = unify(goal, pair[0])
                 if bindings != False:      # to include empty bindings
@@ -485,7 +489,7 @@ class System2Agent:
 
     def prefer_plan(self, plan_a, plan_b, initialWorld=None):
         if initialWorld == None:  # by default, start from what's known in the world
-            initialWorld=self.knownList()
+            initialWorld = self.knownWorld()
         if self.traceProject:
             print('initial world for a:')
             for fact in initialWorld:
@@ -505,7 +509,7 @@ class System2Agent:
 
     # recursively count the elements in an s-expression
     def my_size(self, x):
-        if type(x) in [list, tuple]:
+        if isinstance(x, (list, tuple)):
             return sum([self.my_size(element) for element in x])
         else:
             return 1
@@ -525,11 +529,11 @@ class System2Agent:
             return False
 
     def project(self, plan, state=[]):
-        worlds = [state]
+        worlds = [state if isinstance(state, World) else World(state)]
         for step in plan:
             new_worlds = []
             for world in worlds:
-                new_worlds = new_worlds + self.project_step(step, world)
+                new_worlds.extend(self.project_step(step, world))
             worlds = new_worlds
         if self.traceProject:
             # Temporary
@@ -561,11 +565,11 @@ class System2Agent:
         # Default effect if no rule matched
         if not matched:
             if self.traceProject:
-                print('returning', [world + [('performed', step)]])
+                print('returning', [list(world) + [('performed', step)]])
             if not copied:
-                world = list(world)
+                world = world.copy()
                 copied = True
-            world = world + [('performed', step)]
+            world.append(('performed', step))
         # Next run any triggers that match (will match them every step henceforth, but could add an effect to stop that)
         for trigger in self.triggerRules:
             all_bindings = allMatches(trigger[0], world, [bindings])
@@ -578,7 +582,7 @@ class System2Agent:
             if effect.precondition is True or match_precond(substitute(effect.precondition, bindings), world):
                 # As soon as we know there will be a change make sure this is a copy
                 if not copied:
-                    world = list(world)
+                    world = world.copy()
                     copied = True  # but only need to copy once
                 world = effect.update_world(world, bindings)
         return world, copied
@@ -601,6 +605,420 @@ class System2Agent:
         return [{}]
 
 
+class System2Program(object):
+    """
+    The rules read from an agent definition: goal weights and requirements, projection, trigger and
+    utility rules, transient goals, and the facts and primitive actions it declares. A program is parsed
+    once and shared read-only by all the agents that use it (see load_program), so the rule
+    lists are stored as tuples. Agents copy the rules before changing them.
+    """
+
+    def __init__(self, traceLoad=False, traceParse=False, traceProject=False):
+        self.goalWeightDict = dict()
+        self.goalRequirementsDict = dict()
+        self.transientDict = FactIndex()
+        self.transientDict.add(('forget', 'x'))  # see System2Agent.__init__
+        self.projectionRuleDict = dict()
+        self.triggerRules = ()
+        self.utilityRules = ()
+        self.known = []  # facts declared with 'known'
+        self.primitives = []  # names declared with 'primitive'
+        self.traceLoad = traceLoad
+        self.traceParse = traceParse
+        self.traceProject = traceProject
+        self._views = None
+
+    # Read-only views of goalWeightDict and goalRequirementsDict, the same ones for every agent that uses the
+    # program, so that an agent can't change the goals of the others by writing to its dicts
+    def sharedViews(self):
+        if self._views is None:
+            self._views = (MappingProxyType(self.goalWeightDict), MappingProxyType(self.goalRequirementsDict))
+        return self._views
+
+    # The views can't be pickled, and are made again when they are needed
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_views'] = None
+        return state
+
+    def read(self, string):
+        # state is used for multi-line statements like goalRequirements
+        # and projection rules
+        state = 0
+        goalRequirements = 1
+        project = 2
+        utility = 3
+        trigger = 4
+        lines = []
+        for line in string.split('\n'):
+            if "#" in line:
+                line = line[0:line.find("#")]
+            line = line.strip()
+            if state in [goalRequirements, project, utility, trigger]:
+                if line == "":
+                    if state == goalRequirements:
+                        self.readGoalRequirements(lines)
+                    elif state == project:
+                        self.readProject(lines)
+                    elif state == trigger:
+                        self.readTrigger(lines)
+                    elif state == utility:
+                        self.readUtility(lines)
+                    state = 0
+                else:
+                    lines.append(line)
+            elif line.startswith("goalWeight"):
+                self.readGoalWeight(line)
+            elif line.startswith("goalRequirements"):
+                state = goalRequirements
+                lines = [line]
+            elif line.startswith("known"):
+                self.readKnown(line)
+            elif line.startswith("primitive"):
+                self.readPrimitive(line)
+            elif line.startswith("project"):
+                state = project
+                lines = [line]
+            elif line.startswith("trigger"):
+                state = trigger
+                lines = [line]
+            elif line.startswith("utility"):
+                state = utility
+                lines = [line]
+            elif line.startswith("transient"):
+                self.readTransient(line)
+            elif line != "":
+                print("unrecognized line in readAgent:", line)
+        return self
+
+    def readGoalWeight(self, line):
+        # line has form 'goalWeight predicate(arg1, arg2, ..) integer'
+        goal = self.readGoalTuple(line[line.find(" "):line.rfind(" ")].strip())
+        weight = int(line[line.rfind(" "):].strip())
+        if self.traceLoad:
+            print("Goal is ", goal)
+        self.goalWeight(goal, weight)
+
+    def readGoalRequirements(self, lines):
+        goal = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
+        requirements = [self.readGoalTuple(line) for line in lines[1:]]
+        if self.traceLoad:
+            print("Adding goal requirements for", goal, ":", requirements)
+        self.goalRequirements(goal, requirements)
+
+    def readKnown(self, line):
+        goal = self.readGoalTuple(line[line.find(" "):].strip())
+        self.known.append(goal)
+
+    def readGoalTuple(self, line):
+        return read_goal_tuple(line)
+
+    def parseToTuple(self, parse):
+        return parse_to_tuple(parse)
+
+    def readPrimitive(self, line):
+        # 'primitive a, b, c' means that a, b and c and primitive actions with their own names as the defining functions
+        self.primitives.extend(line[10:].split(", "))
+
+    def readProject(self, lines):
+        if self.traceParse:
+            print("Reading projection rule from", lines)
+        goal = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
+        # Store a list of projection rules indexed by the goal
+        head = goal
+        if isinstance(goal, (list, tuple)):
+            head = goal[0]
+        effects = self.read_effect_lines(lines[1:])
+        self.projectionRuleDict[head] = self.projectionRuleDict.get(head, ()) + ((compile_term(goal), effects),)
+
+    def readTrigger(self, lines):
+        if self.traceParse:
+            print("Reading trigger rule from", lines)
+        trigger = self.readGoalTuple(lines[0][lines[0].find(" "):].strip())
+        effects = self.read_effect_lines(lines[1:])  # trigger effects are just like project rule effects
+        self.triggerRules += ((compile_term(trigger), effects),)
+
+    def read_effect_lines(self, lines):
+        effects = []
+        # To handle multi-line preconditions, group lines into a longLine that
+        # contains a " + " or " - "
+        longLine = ""
+        for line in lines:
+            longLine += line
+            effectLine = longLine
+            condition = True
+            if "+ " in line or "- " in line:
+                if "->" in longLine:
+                    [precondLine, effectLine] = longLine.split("->")
+                    condition = self.readGoalTuple(precondLine)
+                effects.append(self.readEffectLine(effectLine, condition))
+                longLine = ""
+        return effects
+
+    def readEffectLine(self, line, condition=True):
+        line = line.lstrip(' ')
+        p = ast.parse(line).body[0].value # old: ast.parse(line.strip()).node.nodes[0].expr
+        if self.traceParse:
+            print('Parse for effect line', line, 'is', p)
+        # With no probabilities the results are UnaryAdd or UnaryDel, otherwise Add and Del,
+        # Note the condition isn't included here
+        if isinstance(p, ast.UnaryOp) and isinstance(p.op, ast.UAdd): #isinstance(p, ast.UAdd):
+            return Effect(Effect.add, parse_to_tuple(p.operand), condition, 1)
+        elif isinstance(p, ast.UnaryOp) and isinstance(p.op, ast.USub): #isinstance(p, ast.USub):
+            return Effect(Effect.delete, parse_to_tuple(p.operand), condition, 1)
+        elif isinstance(p, ast.BinOp) and isinstance(p.op, ast.Add): #isinstance(p, ast.Add):
+            if isinstance(p.left, ast.Name):
+                return Effect(Effect.add, parse_to_tuple(p.right), condition, p.left.id)
+            if isinstance(p.left, ast.Num):
+                return Effect(Effect.add, parse_to_tuple(p.right), condition, p.left.n)
+        elif isinstance(p, ast.BinOp) and isinstance(p.op, ast.Sub): #isinstance(p, ast.Sub):
+            if isinstance(p.left, ast.Name):
+                return Effect(Effect.delete, parse_to_tuple(p.right), condition, p.left.id)
+            if isinstance(p.left, ast.Num):
+                return Effect(Effect.add, parse_to_tuple(p.right), condition, p.left.n)
+        else:
+            print("No effects found", line)
+            return None
+
+    # Lines are of the form condition -> incr, and each match to condition increments
+    # utility by that amount.
+    def readUtility(self, lines):
+        for line in lines[1:]:
+            if self.traceProject:
+                print("reading utility from", line)
+            [precond, incr] = line.split("->")
+            self.utilityRules += ([compile_term(self.readGoalTuple(precond.strip())), float(incr)],)
+        if self.traceProject:
+            print("Utility rules are", self.utilityRules)
+
+    def readTransient(self, line):
+        goal = self.readGoalTuple(line[line.find(" "):].strip())
+        predicate = goal
+        if isinstance(goal, (list,tuple)):
+            predicate = goal[0]
+        self.transientDict.add(goal, predicate)
+        if self.traceLoad:
+            print("Transient:", self.transientDict)
+
+    def goalWeight(self, goal, weight):
+        self.goalWeightDict[compile_term(goal)] = weight
+
+    def goalRequirements(self, goal, requirements):
+        rule = (compile_term(goal), [compile_term(r) for r in requirements])
+        self.goalRequirementsDict[goal[0]] = self.goalRequirementsDict.get(goal[0], ()) + (rule,)
+
+    # Add the program's rules to the agent's own (unshared) rules
+    def addRulesTo(self, agent):
+        agent.goalWeightDict.update(self.goalWeightDict)
+        for (key, rules) in self.goalRequirementsDict.items():
+            agent.goalRequirementsDict.setdefault(key, []).extend(rules)
+        for (key, facts) in self.transientDict.items():
+            for fact in facts:
+                agent.transientDict.add(fact, key)
+        for (key, rules) in self.projectionRuleDict.items():
+            agent.projectionRuleDict.setdefault(key, []).extend(rules)
+        agent.triggerRules.extend(self.triggerRules)
+        agent.utilityRules.extend(self.utilityRules)
+
+
+# Parsed programs are cached by a hash of their source, in this process and optionally in
+# program_cache_dir, where each program is pickled to a file named by the hash, so that other
+# processes reading the same definitions can skip the parser.
+program_cache_dir = None
+program_cache_version = 2  # change when the parser or System2Program changes, to ignore old files
+_program_cache = dict()
+
+
+def load_program(string, traceLoad=False, traceParse=False, traceProject=False):
+    key = hashlib.sha1((str(program_cache_version) + "\n" + string).encode('utf-8')).hexdigest()
+    if key in _program_cache:
+        return _program_cache[key]
+    program = None
+    path = None
+    if program_cache_dir is not None:
+        path = os.path.join(program_cache_dir, key + ".pickle")
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    program = pickle.load(f)
+            except Exception as e:
+                print("Could not read cached program", path, e)
+    if program is None:
+        program = System2Program(traceLoad=traceLoad, traceParse=traceParse, traceProject=traceProject).read(string)
+        if path is not None:
+            try:
+                if not os.path.isdir(program_cache_dir):
+                    os.makedirs(program_cache_dir)
+                # Write to a temporary file first so a concurrent reader never sees part of a program
+                temp_path = path + "." + str(os.getpid())
+                with open(temp_path, 'wb') as f:
+                    pickle.dump(program, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            except (OSError, pickle.PicklingError) as e:
+                print("Could not cache program in", program_cache_dir, e)
+    _program_cache[key] = program
+    return program
+
+
+def read_only(mapping):
+    return mapping if isinstance(mapping, MappingProxyType) else MappingProxyType(mapping)
+
+
+def clear_program_cache():
+    _program_cache.clear()
+
+
+# Read a goal as a tuple from the line, which should start with the goal
+# description, e.g. goal(arg1, arg2, ..). Each arg may be a subgoal.
+# Uses the python compile's parser
+def read_goal_tuple(line):
+    # It's a compile module, with a statement node with one Discard object
+    return parse_to_tuple(ast.parse(line).body[0].value)
+
+
+# It's tempting to leave the parse tree with the classes from the compile
+# module but I'd like to make it modular with abstraction
+def parse_to_tuple(parse):
+    if isinstance(parse, ast.Name):
+        return parse.id
+    elif isinstance(parse, ast.Call):
+        return tuple([parse_to_tuple(x) for x in [parse.func] + parse.args])
+    elif isinstance(parse, ast.List):
+        return [parse_to_tuple(x) for x in parse.elts]
+    elif isinstance(parse, ast.BoolOp) and isinstance(parse.op, ast.And):
+        return tuple(['and'] + [parse_to_tuple(x) for x in parse.values])
+    elif isinstance(parse, ast.BoolOp) and isinstance(parse.op, ast.Or):
+        return tuple(['or'] + [parse_to_tuple(x) for x in parse.values])
+    elif isinstance(parse, ast.Constant):   # a string constant used
+        if isinstance(parse.value, str):
+            return "_" + parse.value
+        else:
+            return parse.value # old 2delete
+    elif isinstance(parse, ast.Num):   # a number constant used
+        return parse.n
+    elif isinstance(parse, ast.Str):   # a number constant used
+        return "_" + parse.s
+    elif isinstance(parse, ast.UnaryOp) and isinstance(parse.op, ast.Not):
+        return 'not', parse_to_tuple(parse.operand)
+    else:
+        print("Unhandled node type:", parse)
+        raise BaseException
+
+
+# The goals in goalWeightDict as a heap ordered by weight and then tie-break key. Goals at the top that are
+# found to be known when chooseGoal looks are parked under their predicate (lazy deletion), with the version of
+# the predicate in knownDict, and put back on the heap once that version changes, since forgetting facts may
+# make the goal unknown again. A knownDict that isn't a FactIndex has no versions, so then nothing is parked
+# and the goals are checked in order each time.
+# With tieBreak 'random', a goal is drawn at random on each call from the unknown goals with the top weight.
+class GoalAgenda(object):
+    __slots__ = ['weights', 'size', 'version', 'copy', 'known', 'tieBreak', 'heap', 'parked']
+
+    def __init__(self, weights, known, tieBreak='first'):
+        if tieBreak not in ('first', 'last', 'random'):
+            raise ValueError("goalTieBreak should be 'first', 'last' or 'random', not " + str(tieBreak))
+        self.weights = weights
+        self.size = len(weights)
+        # An agent's own GoalWeights counts its changes. Any other writable dict is compared with a copy.
+        self.version = weights.version if isinstance(weights, GoalWeights) else None
+        self.copy = dict(weights) if type(weights) is dict else None
+        self.known = known
+        self.tieBreak = tieBreak
+        self.heap = []
+        for (position, (goal, weight)) in enumerate(weights.items()):
+            self.heap.append((-weight, -position if tieBreak == 'last' else position, goal))
+        heapq.heapify(self.heap)
+        self.parked = dict()  # predicate -> (version of the predicate in known, heap entries for known goals)
+
+    # Whether the agenda still matches the agent's goals, facts and tie-break
+    def current(self, agent):
+        weights = agent.goalWeightDict
+        return weights is self.weights and len(weights) == self.size and agent.knownDict is self.known \
+            and agent.goalTieBreak == self.tieBreak \
+            and (self.version is None or weights.version == self.version) \
+            and (self.copy is None or weights == self.copy)
+
+    # The goal with the highest weight that the agent doesn't know, or None
+    def top(self, agent):
+        if not isinstance(self.known, FactIndex):
+            for entry in sorted(self.heap):
+                if agent.isKnown(entry[2]) is False:
+                    return entry[2] if self.tieBreak != 'random' else self.drawTied(agent, entry)
+            return None
+        self.wakeChanged()
+        while self.heap:
+            goal = self.heap[0][2]
+            if agent.isKnown(goal) is False:
+                return goal if self.tieBreak != 'random' else self.drawTied(agent, self.heap[0])
+            self.park(heapq.heappop(self.heap))
+        return None
+
+    def park(self, entry):
+        predicate = entry[2][0]
+        if predicate not in self.parked:
+            self.parked[predicate] = (self.known.versions.get(predicate, 0), [])
+        self.parked[predicate][1].append(entry)
+
+    def wakeChanged(self):
+        versions = self.known.versions
+        for predicate in [p for (p, (version, entries)) in self.parked.items() if versions.get(p, 0) != version]:
+            for entry in self.parked.pop(predicate)[1]:
+                heapq.heappush(self.heap, entry)
+
+    # A random choice among the unknown goals with the same weight as the entry, which is the top unknown one
+    def drawTied(self, agent, top):
+        tied = [entry[2] for entry in self.heap if entry[0] == top[0] and agent.isKnown(entry[2]) is False]
+        return random.choice(tied)
+
+
+# goalWeightDict for an agent's own goals: a dict that counts the changes made to it, so the goal agenda
+# is rebuilt after a write like agent.goalWeightDict[goal] = weight
+class GoalWeights(dict):
+    __slots__ = ['version']
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        self.version += 1
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.version += 1
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        self.version += 1
+        dict.update(self, *args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self.version += 1
+        return dict.setdefault(self, key, default)
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def clear(self):
+        self.version += 1
+        dict.clear(self)
+
+    def __reduce__(self):
+        return GoalWeights, (dict(self),)
+
+
+# Copy an action returned by chooseActionForGoals, since the ['known', bindings] form is updated by callers
+def copy_action(action):
+    if isinstance(action, list):
+        return [action[0], dict(action[1])]
+    return action
+
+
 def match_precond(precond, world):
     if precond is True:
         return True
@@ -620,20 +1038,218 @@ def match_precond(precond, world):
         else:
             return True
     elif isinstance(precond, (tuple, str)):    # match a single goal
-        return precond in world                       # trying to avoid python2-specific match
+        return precond in world                       # a hash lookup when world is a World
     else:
         return False
 
 
+# The facts in a projected world. Facts are kept in the order they were added, as in the list of facts
+# that was used before, but they are also indexed by predicate and arity, so allMatches only tries the facts
+# that could unify with a pattern, and counted, so membership is a hash lookup.
+# Like the list, a world may hold the same fact more than once (e.g. performing a step twice).
+# Worlds share structure: copy() shares the bucket of facts for each (predicate, arity) with the original,
+# and a world that then changes a bucket adds a child bucket holding just its changes (see _WorldBucket),
+# so projecting a step costs about the size of its changes rather than the size of the world.
+class World(object):
+    __slots__ = ['_index', '_owned', '_serial']
+
+    def __init__(self, facts=()):
+        self._index = dict()  # (predicate, arity) -> _WorldBucket
+        self._owned = set()  # keys of the buckets that no other world shares
+        self._serial = 0
+        for fact in facts:
+            self.append(fact)
+
+    def copy(self):
+        world = World()
+        world._index = dict(self._index)
+        world._serial = self._serial
+        self._owned = set()  # the buckets are shared from now on
+        return world
+
+    # The bucket for key, which is first extended with a child if it is shared
+    def _bucket(self, key):
+        if key not in self._owned:
+            self._index[key] = self._index[key].child() if key in self._index else _WorldBucket()
+            self._owned.add(key)
+        return self._index[key]
+
+    def append(self, fact):
+        self._bucket(_world_key(fact)).add(self._serial, fact)
+        self._serial += 1
+
+    # Remove the first occurrence of fact, as list.remove does
+    def remove(self, fact):
+        key = _world_key(fact)
+        if key not in self._index or not self._index[key].contains(fact):
+            raise ValueError("World.remove(x): x not in world")
+        bucket = self._bucket(key)
+        bucket.remove(fact)
+        if not bucket.items():
+            del self._index[key]
+            self._owned.discard(key)
+
+    def __contains__(self, fact):
+        key = _world_key(fact)
+        return key in self._index and self._index[key].contains(fact)
+
+    # The facts that might unify with pattern, in order: those with the same predicate and arity,
+    # and facts that are variables
+    def candidates(self, pattern):
+        if not isinstance(pattern, (list, tuple)) or not pattern:
+            return list(self)
+        same = self._index.get(_world_key(pattern))
+        wild = self._index.get(None)
+        if wild is None:
+            return [fact for (serial, fact) in same.items()] if same else []
+        elif same is None:
+            return [fact for (serial, fact) in wild.items()]
+        return [fact for (serial, fact) in heapq.merge(same.items(), wild.items())]
+
+    # The number of times the ground term fact is in the world, or None if facts that are not equal
+    # to it might also unify with it
+    def count(self, fact):
+        if None in self._index:
+            return None
+        key = _world_key(fact)
+        if key not in self._index:
+            return 0
+        return self._index[key].count(fact)
+
+    def __iter__(self):
+        return (fact for (serial, fact) in heapq.merge(*[bucket.items() for bucket in self._index.values()]))
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._index.values())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+# The facts in a World with one index key. A bucket that is shared is never changed: a world that
+# changes it makes a child bucket that records only the facts added and removed since, and refers to
+# the shared bucket for the rest. Facts in a child always come after those of its ancestors. Once a chain
+# is longer than max_depth, a new bucket holding all the facts is made instead, so lookups stay short.
+class _WorldBucket(object):
+    __slots__ = ['parent', 'depth', 'facts', 'removed', 'counts', 'nonground']
+    max_depth = 8
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.facts = dict()  # serial -> fact for the facts added in this bucket, in order
+        self.removed = set()  # serials of facts in the ancestors that were removed in this bucket
+        self.counts = dict()  # hashable fact -> change in the number of times it is in the world
+        self.nonground = 0  # change in the number of facts that are not ground tuples
+
+    def child(self):
+        if self.depth < self.max_depth:
+            return _WorldBucket(self)
+        bucket = _WorldBucket()
+        for (serial, fact) in self.items():
+            bucket.add(serial, fact)
+        return bucket
+
+    # (serial, fact) pairs for all the facts in the bucket, in order
+    def items(self):
+        if self.parent is None:
+            return list(self.facts.items())
+        chain = []
+        bucket = self
+        while bucket is not None:
+            chain.append(bucket)
+            bucket = bucket.parent
+        removed = set()
+        result = []
+        for bucket in chain:  # from this bucket up, so removals seen so far apply to the facts above
+            result.append([(serial, fact) for (serial, fact) in bucket.facts.items() if serial not in removed])
+            removed.update(bucket.removed)
+        return [item for items in reversed(result) for item in items]
+
+    def add(self, serial, fact):
+        self.facts[serial] = fact
+        try:
+            self.counts[fact] = self.counts.get(fact, 0) + 1
+        except TypeError:  # unhashable facts are found by scanning
+            self.nonground += 1
+            return
+        if not isinstance(fact, tuple) or not _is_ground(fact):
+            self.nonground += 1
+
+    # Remove the first occurrence of fact, which must be in the bucket
+    def remove(self, fact):
+        for (serial, f) in self.items():
+            if f == fact:
+                break
+        if serial in self.facts:
+            del self.facts[serial]
+        else:
+            self.removed.add(serial)
+        if _is_hashable(fact):
+            self.counts[fact] = self.counts.get(fact, 0) - 1
+        if not _is_ground_tuple(fact):
+            self.nonground -= 1
+
+    def contains(self, fact):
+        if _is_hashable(fact):
+            return self.occurrences(fact) > 0
+        return any(f == fact for (serial, f) in self.items())
+
+    # The number of times the hashable fact is in the bucket
+    def occurrences(self, fact):
+        count = 0
+        bucket = self
+        while bucket is not None:
+            count += bucket.counts.get(fact, 0)
+            bucket = bucket.parent
+        return count
+
+    # As World.count
+    def count(self, fact):
+        nonground = 0
+        bucket = self
+        while bucket is not None:
+            nonground += bucket.nonground
+            bucket = bucket.parent
+        return None if nonground else self.occurrences(fact)
+
+    def __len__(self):
+        return len(self.items())
+
+
+# The index key for a fact in a World: predicate and arity for a term, the fact itself for a constant,
+# and None for anything that may unify with a term of any predicate (variables and terms whose
+# predicate can't be hashed).
+def _world_key(fact):
+    if isinstance(fact, (list, tuple)):
+        if fact and _is_hashable(fact[0]):
+            return fact[0], len(fact)
+        elif not fact:
+            return ()
+        return None
+    elif isVar(fact) or not _is_hashable(fact):
+        return None
+    return fact,
+
+
 # Return a list of bindings list for all the ways a pattern can be matched
-# in a world (list of facts). Not doing any fancy matching, so it's exponential.
-# currentBindings defaults to one, empty, bindings list.
+# in a world (a World or list of facts). In a World, a term is only tried against the facts
+# with the same predicate and arity.
+# allBindings defaults to one, empty, bindings list. Each match extends a copy of the bindings.
 def allMatches(pattern, world, allBindings=[{}]):
     # Filter the world for the printout
     # Punting on 'and' and 'or' for now
     # For a term, extend each bindings list in every possible way
+    if isinstance(pattern, (tuple, list)) and isinstance(world, World) and _is_ground_tuple(pattern):
+        count = world.count(pattern)
+        if count is not None:  # only equal facts match, and they don't change the bindings
+            return [dict(bindings) for i in range(count) for bindings in allBindings]
     if isinstance(pattern, (tuple, list)):
-        matches = [b for b in [unify(fact, pattern, bindings) for fact in world for bindings in allBindings]
+        facts = world.candidates(pattern) if isinstance(world, World) else world
+        matches = [b for b in [unify(fact, pattern, dict(bindings)) for fact in facts for bindings in allBindings]
                    if b is not False]
         #print('all matches for', pattern, 'in', world, 'are', matches)
         return matches
@@ -655,14 +1271,14 @@ class Effect(object):
 
     def __init__(self, addOrDelete, term, precondition=True, probability=1):
         self.addOrDelete = addOrDelete  # 1 means add, 0 means delete
-        self.term = term  # thing being added or deleted
-        self.precondition = precondition
+        self.term = compile_term(term)  # thing being added or deleted
+        self.precondition = compile_term(precondition)
         self.probability = probability
 
     def __repr__(self):
         return "<effect: %s -> %s %s>" % (self.precondition, '+' if self.addOrDelete == self.add else '-', self.term)
 
-    # return a world after this effect happens in the input world (list of facts)
+    # return a world after this effect happens in the input world (World or list of facts)
     def update_world(self, world, bindings):
         if isinstance(self.term, (list, tuple)):
             fact = substitute(self.term, bindings)
@@ -676,88 +1292,245 @@ class Effect(object):
         return world
 
 
-# Just clarifies the code a little
-def isConstant(term):
-    return not isVar(term)
+# Known, known-false and transient facts are stored in a FactIndex. It behaves as the dict from
+# predicate to list of facts that System2Agent always used, so knownDict['performed'] is still the list
+# of performed facts in the order they were learned, but it also keeps a hash index on the ground
+# arguments of each fact, in the spirit of Prolog's first-argument indexing. A goal whose arguments are
+# all ground is looked up in O(1), and a goal with some bound arguments is only unified against the
+# facts that share one of those arguments (or have a variable in that position). The facts are tried
+# in the same order as the linear scan, so the bindings returned are identical.
+# Every agent has its own fact stores, so the index for a key is only built once it has more than
+# fact_index_threshold facts. Smaller lists are scanned, which is as fast and keeps an agent with a
+# few facts per predicate about as small as the plain dict of lists.
+# Facts must be added and removed through add() and remove() so the index stays in step with the lists.
+# versions counts the changes made under each key, so callers can tell whether what they read is still current.
+fact_index_threshold = 8
+
+
+class FactIndex(dict):
+    __slots__ = ['_buckets', 'versions']
+
+    def __init__(self, facts=None):
+        dict.__init__(self)
+        self._buckets = None  # key -> _FactBucket, for the keys with more than fact_index_threshold facts
+        self.versions = dict()
+        if facts is not None:
+            for fact in facts:
+                self.add(fact)
+
+    def __setitem__(self, key, facts):
+        if key in self:
+            del self[key]
+        dict.__setitem__(self, key, [])
+        for fact in facts:
+            self.add(fact, key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        if self._buckets is not None:
+            self._buckets.pop(key, None)
+        self.changed(key)
+
+    def clear(self):
+        for key in self:
+            self.changed(key)
+        dict.clear(self)
+        self._buckets = None
+
+    def changed(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def bucket(self, key):
+        return None if self._buckets is None else self._buckets.get(key)
+
+    # Add a fact under key (by default its predicate). Returns True if the fact was new.
+    def add(self, fact, key=None):
+        if key is None:
+            key = fact[0]
+        facts = dict.get(self, key)
+        if facts is None:
+            facts = []
+            dict.__setitem__(self, key, facts)
+        bucket = self.bucket(key)
+        if bucket is not None:
+            if bucket.contains(fact):
+                return False
+            bucket.add(fact)
+        elif fact in facts:
+            return False
+        facts.append(fact)
+        if bucket is None and len(facts) > fact_index_threshold:
+            if self._buckets is None:
+                self._buckets = dict()
+            bucket = self._buckets[key] = _FactBucket()
+            for f in facts:
+                bucket.add(f)
+        self.changed(key)
+        return True
 
+    # Remove a fact stored under key (by default its predicate)
+    def remove(self, fact, key=None):
+        if key is None:
+            key = fact[0]
+        dict.__getitem__(self, key).remove(fact)
+        bucket = self.bucket(key)
+        if bucket is not None:
+            bucket.remove(fact)
+        self.changed(key)
+
+    # Pickle the facts by key, since the index is rebuilt as they are added
+    def __reduce__(self):
+        return FactIndex, (), None, None, iter(list(self.items()))
+
+    # A separate index with the same facts under the same keys
+    def copy(self):
+        index = FactIndex()
+        for (key, facts) in self.items():
+            for fact in facts:
+                index.add(fact, key)
+        return index
+
+    # Return the bindings for the first fact that unifies with goal, or False, as a linear scan would.
+    # If stats is given, the unifications tried are counted in it.
+    def match(self, goal, stats=None):
+        facts = dict.get(self, goal[0])
+        if facts is None:
+            return False
+        bucket = self.bucket(goal[0])
+        if bucket is None:
+            candidates = facts
+        elif bucket.nonground == 0 and isinstance(goal, tuple) and _is_ground(goal) and _is_hashable(goal):
+            return {} if goal in bucket.members else False
+        else:
+            candidates = bucket.candidates(goal)
+        tried = 0
+        for fact in candidates:
+            tried += 1
+            bindings = unify(goal, fact)
+            if bindings is not False:  # Since {} means success with no new bindings
+                break
+        else:
+            bindings = False
+        if stats is not None:
+            stats.count(UNIFY, tried)
+        return bindings
 
-def isVar(term):
-    # Anything other than a string is assumed to be a constant
-    # This test assumes python 2.x
-    return isinstance(term, str) and not term.startswith("_")
+    # Return all the facts that unify with pattern, in the order they were added
+    def matches(self, pattern):
+        facts = dict.get(self, pattern[0])
+        if facts is None:
+            return []
+        bucket = self.bucket(pattern[0])
+        candidates = facts if bucket is None else bucket.candidates(pattern)
+        return [fact for fact in candidates if unify(pattern, fact) is not False]
 
 
-# Substitute bindings in tuple representation of a term,
-# where the first argument is the predicate.
-# Needs to support structure in the term arguments.
-def substitute(predicate, bindings):
-    if isinstance(predicate, (list, tuple)):
-        args = [substitute_argument(arg, bindings) for arg in predicate[1:]]
-        return tuple([predicate[0]] + args)
-    return substitute_argument(predicate, bindings)
+# The index for the facts stored under one key. Entries are (serial, fact) pairs, where the serial number
+# records the order facts were added so that candidates from different index lists can be merged back
+# into that order.
+class _FactBucket(object):
+    __slots__ = ['entries', 'serial', 'members', 'nonground', 'by_arg', 'wild', 'unindexed']
 
+    def __init__(self):
+        self.entries = []
+        self.serial = 0
+        self.members = dict()  # hashable fact -> serial
+        self.nonground = 0  # number of facts that are not ground tuples, which rules out the O(1) lookup
+        self.by_arg = dict()  # (position, ground argument) -> entries with that argument in that position
+        self.wild = dict()  # position -> entries with a variable or unhashable argument in that position
+        self.unindexed = []  # entries for facts that are not tuples or lists, which may unify with anything
+
+    def contains(self, fact):
+        if _is_hashable(fact):
+            return fact in self.members
+        return any(fact == f for (s, f) in self.entries)
+
+    def add(self, fact):
+        entry = (self.serial, fact)
+        self.serial += 1
+        self.entries.append(entry)
+        if _is_hashable(fact):
+            self.members[fact] = entry[0]
+        if not isinstance(fact, tuple) or not _is_ground(fact) or not _is_hashable(fact):
+            self.nonground += 1
+        if isinstance(fact, (tuple, list)):
+            for position in range(1, len(fact)):
+                arg = fact[position]
+                if _is_key(arg):
+                    self.by_arg.setdefault((position, arg), []).append(entry)
+                else:
+                    self.wild.setdefault(position, []).append(entry)
+        else:
+            self.unindexed.append(entry)
 
-def substitute_argument(arg, bindings):
-    if isinstance(arg, list):
-        return [substitute_argument(x, bindings) for x in arg]
-    elif isinstance(arg, tuple):
-        return tuple([substitute_argument(x, bindings) for x in arg])
-    elif not isinstance(arg, collections.Hashable) or arg not in bindings:
-        return arg
-    else:
-        return bindings[arg]
-
-traceUnify = False
-
-# Return bindings that would unify the pattern with the candidate, or False
-def unify(pattern, candidate, bindings=None):
-    if bindings is None:
-        bindings = {}   # Cannot create dict in the argslist, or it's shared between every call
-    if traceUnify:
-        print("Trying unify", pattern, candidate, bindings)
-
-    if isVar(pattern):
-        if traceUnify:
-            print("Pattern is variable:", pattern)
-        if pattern == candidate:
-            return bindings
-        elif pattern in bindings and isConstant(bindings[pattern]):  # treat this as if it were the constant it's bound to. Don't bind vars to vars to avoid loops
-            return unify(bindings[pattern], candidate, bindings)
-        elif not isVar(candidate):
-            if pattern in bindings: # bound to another variable. Bind them both to this constant
-                bindings[bindings[pattern]] = candidate
-            bindings[pattern] = candidate
-            return bindings
-        elif candidate in bindings:
-            bindings[pattern] = bindings[candidate]
-            return bindings
+    def remove(self, fact):
+        for entry in self.entries:
+            if entry[1] == fact:
+                break
         else:
-            bindings[pattern] = candidate
-            return bindings
-    elif isVar(candidate):   # candidate is a variable but pattern is not
-        if traceUnify:
-            print("Candidate", candidate, "is variable, not pattern", pattern)
-        return unify(candidate, pattern, bindings)  # Use the case above
-    elif isinstance(pattern, (list, tuple)):  # recursively match structures
-        # Assume the first argument is a predicate name which has to be equal
-        if isinstance(candidate, (list, tuple)) and len(pattern) == len(candidate) and (not pattern or pattern[0] == candidate[0]):
-            if traceUnify:
-                print("Pattern", pattern, "is a tuple, recursing")
-            # Match the arguments in the goal and the requirements head
-            for (goalarg, matcharg) in zip(pattern[1:], candidate[1:]):
-                bindings = unify(goalarg, matcharg, bindings)
-                if bindings is False:
-                    return False
-            return bindings
+            raise ValueError("fact not in index: " + str(fact))
+        self.entries.remove(entry)
+        if _is_hashable(fact):
+            del self.members[fact]
+        if not isinstance(fact, tuple) or not _is_ground(fact) or not _is_hashable(fact):
+            self.nonground -= 1
+        if isinstance(fact, (tuple, list)):
+            for position in range(1, len(fact)):
+                arg = fact[position]
+                if _is_key(arg):
+                    _remove_entry(self.by_arg, (position, arg), entry)
+                else:
+                    _remove_entry(self.wild, position, entry)
         else:
-            if traceUnify:
-                print("Pattern is a tuple but candidate is not, or has different predicate or length:", pattern, candidate)
-            return False
-    elif candidate != pattern:  # constants must match
-        if traceUnify:
-            print("Non-matching constants")
+            self.unindexed.remove(entry)
+
+    # Facts that might unify with goal, in the order they were added. Picks the bound argument
+    # of the goal with the fewest facts to try.
+    def candidates(self, goal):
+        best = None
+        if isinstance(goal, (tuple, list)):
+            for position in range(1, len(goal)):
+                if _is_key(goal[position]):
+                    lists = (self.by_arg.get((position, goal[position]), []), self.wild.get(position, []))
+                    size = len(lists[0]) + len(lists[1])
+                    if best is None or size < best[0]:
+                        best = (size, lists)
+        if best is None:
+            return [fact for (serial, fact) in self.entries]
+        return [fact for (serial, fact) in heapq.merge(best[1][0], best[1][1], self.unindexed)]
+
+
+def _remove_entry(index, key, entry):
+    index[key].remove(entry)
+    if not index[key]:
+        del index[key]
+
+
+def _is_hashable(term):
+    try:
+        hash(term)
+        return True
+    except TypeError:
         return False
-    elif candidate == pattern:
-        if traceUnify:
-            print("Same objects")
-        return bindings
+
+
+# A term is ground if it contains no variables. The first element of a tuple is its predicate,
+# which unify compares directly rather than binding, so it doesn't count as a variable.
+def _is_ground(term):
+    if isinstance(term, str):
+        return term.startswith("_")
+    elif isinstance(term, tuple):
+        return all(_is_ground(arg) for arg in term[1:])
+    elif isinstance(term, list):
+        return False
+    return True
+
+
+# An argument can be used as an index key if it is ground and hashable, in which case it only unifies
+# with equal arguments
+def _is_key(arg):
+    return _is_ground(arg) and _is_hashable(arg)
+
+
+def _is_ground_tuple(term):
+    return isinstance(term, tuple) and _is_ground(term) and _is_hashable(term)
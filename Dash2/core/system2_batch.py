@@ -0,0 +1,177 @@
+# Batched System2 reasoning for a population of agents that share their rules, e.g. because they read the
+# same definition (see System2Program) or point to one agent's rules with use_system2.
+#
+# choose_actions_by_reasoning(agents) returns the same actions as calling choose_action_by_reasoning on each
+# agent in turn, with the same changes to each agent's facts, but it walks the goal requirements once for each
+# group of agents that are in the same state rather than once per agent. Clause heads are unified, requirements
+# substituted and classified as primitive actions or subgoals once per group; only the lookups in each agent's
+# own fact stores are made per agent. A group splits into smaller groups where the agents' facts lead them down
+# different branches, so a population that mostly agrees costs little more than one agent.
+#
+# The walk doesn't fill the agents' plan caches, but uses an agent's cached action for a goal if it has one.
+from Dash2.core.system2 import System2Agent, substitute
+
+# Agents whose class overrides any of these are reasoned about one at a time
+batched_methods = ['choose_action_by_reasoning', 'chooseGoal', 'chooseActionForGoals', 'memoizedActionForGoals',
+                   'decomposeGoals', 'nextAction', 'findGoalRequirements', 'isKnown', 'isKnownFalse', 'isTransient',
+                   'isGoal', 'isPrimitive', 'isIn']
+
+
+# Returns the list of actions chosen for the agents, in the same order
+def choose_actions_by_reasoning(agents):
+    actions = [None] * len(agents)
+    cohorts = dict()
+    for i in range(len(agents)):
+        key = cohort_key(agents[i])
+        if key is None:
+            actions[i] = agents[i].choose_action_by_reasoning()
+        else:
+            cohorts.setdefault(key, []).append(i)
+    for indices in cohorts.values():
+        cohort_actions = CohortWalk([agents[i] for i in indices]).choose_actions()
+        for j in range(len(indices)):
+            actions[indices[j]] = cohort_actions[j]
+    return actions
+
+
+# Agents with the same key share the rules and primitive actions the walk depends on, or None if the agent
+# should reason on its own
+def cohort_key(agent):
+    cls = type(agent)
+    if not isinstance(agent, System2Agent) or agent.traceGoals or agent.traceClauses or agent.instrumentPlanner:
+        return None
+    for name in batched_methods:
+        if getattr(cls, name) is not getattr(System2Agent, name):
+            return None
+    return (cls, id(agent.goalWeightDict), id(agent.goalRequirementsDict), id(agent.transientDict),
+            tuple(agent.primitiveActionDict))
+
+
+# A key for agents that have reached the same bindings, so they can carry on as one group
+def bindings_key(bindings, i):
+    try:
+        return frozenset(bindings.items())
+    except TypeError:  # unhashable values, so this agent carries on alone
+        return 'agent', i
+
+
+# The walk for one cohort. Groups are lists of indices into agents, and each step returns a dict from
+# index to the result the corresponding System2Agent method would return for that agent.
+class CohortWalk(object):
+
+    def __init__(self, agents):
+        self.agents = agents
+        self.rep = agents[0]  # answers the questions that only depend on the shared rules
+
+    def choose_actions(self):
+        agents = self.agents
+        goal_groups = dict()
+        for i in range(len(agents)):
+            goal = agents[i].chooseGoal()  # each agent's goal agenda only checks the goals it needs to
+            if goal is not None:
+                goal_groups.setdefault(goal, []).append(i)
+        actions = [None] * len(agents)
+        for (goal, group) in goal_groups.items():
+            for (i, action) in self.chooseActionForGoal(group, goal, 0).items():
+                actions[i] = action
+        return actions
+
+    def chooseActionForGoal(self, group, goal, indent):
+        results = dict()
+        walk = []
+        for i in group:
+            agent = self.agents[i]
+            try:
+                cached = agent.memoizePlans and goal in agent._planCache
+            except TypeError:
+                cached = False
+            if cached:
+                results[i] = agent.chooseActionForGoals([goal], indent)
+            else:
+                walk.append(i)
+        if walk:
+            results.update(self.decomposeGoal(walk, goal, indent))
+        return results
+
+    def decomposeGoal(self, group, goal, indent):
+        results = dict()
+        for (goal, requirements, bindings) in self.rep.findGoalRequirements(goal):
+            untried = []
+            for (i, na) in self.nextAction(group, goal, requirements, bindings, indent, 0).items():
+                if na is not False and na is not None:
+                    if na[0] == 'known':  # compose the bindings as decomposeGoals does
+                        composed = [(x, na[1][bindings[x]] if isinstance(bindings[x], str) and bindings[x] in na[1] else bindings[x])
+                                    for x in bindings]
+                        uncomposed = [(x, na[1][x]) for x in na[1] if x not in bindings]
+                        na[1] = dict(composed + uncomposed)
+                    results[i] = na
+                else:
+                    untried.append(i)
+            group = untried
+            if not group:
+                return results
+        for i in group:
+            results[i] = None
+        return results
+
+    # As System2Agent.nextAction, starting from the requirement at position start
+    def nextAction(self, group, goal, requirements, bindings, indent, start):
+        agents = self.agents
+        results = dict()
+        candidates = requirements[1]
+        for position in range(start, len(candidates)):
+            candidate = candidates[position]
+            subbed = substitute(candidate, bindings)
+            # Agents that know the requirement carry on to the next one, grouped by the bindings it adds
+            known = dict()
+            unknown = []
+            for i in group:
+                known_bindings = agents[i].isKnown(subbed)
+                if known_bindings is False:
+                    unknown.append(i)
+                else:
+                    key = bindings_key(known_bindings, i)
+                    if key not in known:
+                        known[key] = (known_bindings, [])
+                    known[key][1].append(i)
+            for (known_bindings, members) in known.values():
+                results.update(self.nextAction(members, goal, requirements, {**bindings, **known_bindings},
+                                               indent, position + 1))
+            group = []
+            for i in unknown:
+                if agents[i].isKnownFalse(subbed) is not False:
+                    results[i] = None
+                else:
+                    group.append(i)
+            if not group:
+                return results
+            if self.rep.isPrimitive(subbed):
+                for i in group:
+                    results[i] = substitute(candidate, bindings)  # each agent gets its own copy
+            elif self.rep.isGoal(subbed):
+                achieved = dict()
+                for (i, action) in self.chooseActionForGoal(group, subbed, indent + 2).items():
+                    if action is not None and action[0] == 'known':
+                        key = bindings_key(action[1], i)
+                        if key not in achieved:
+                            achieved[key] = (action[1], [])
+                        achieved[key][1].append(i)
+                    else:
+                        results[i] = action
+                for (action_bindings, members) in achieved.values():
+                    results.update(self.nextAction(members, goal, requirements, {**bindings, **action_bindings},
+                                                   indent, position + 1))
+            else:
+                for i in group:
+                    print('  '*indent, subbed, "is not a goal or primitive or already known")
+                    results[i] = None
+            return results
+        # All the requirements are met, so the goal is achieved for every agent left in the group
+        subbedGoal = substitute(goal, bindings)
+        for i in group:
+            agent = agents[i]
+            agent.recordPlanDependency(agent.knownDict, subbedGoal[0])
+            if not agent.isTransient(subbedGoal):
+                agent.knownTuple(subbedGoal)
+            results[i] = ['known', dict(bindings)]
+        return results
@@ -0,0 +1,239 @@
+# Contains the term representation used in System2 reasoning: unification, substitution and
+# compiled terms.
+#
+# Terms are tuples whose first element is the predicate, e.g. ('sendMail', 'mail'). Strings that don't start
+# with an underscore are variables, anything else is a constant. readAgent compiles the goal heads,
+# requirement bodies and projection rules it reads into Term objects. A Term is still the same tuple (it
+# compares and hashes equal to it, so code that treats rules as tuples keeps working) but it also carries
+# a pre-analysed copy of its arguments, with each variable resolved to an integer slot, so unify and
+# substitute don't need to re-test every argument with isVar each time the rule is used.
+#
+# Unification records each binding it makes on a trail and undoes them if the match fails, so the bindings
+# passed in are left as they were rather than copied.
+
+traceUnify = False
+
+# Kinds of compiled argument
+_VAR = 0
+_CONST = 1
+_SEQ = 2
+
+_UNBOUND = object()  # marks a trail entry for a variable that had no binding before
+
+
+# Just clarifies the code a little
+def isConstant(term):
+    return not isVar(term)
+
+
+def isVar(term):
+    # Anything other than a string is assumed to be a constant
+    return isinstance(term, str) and not term.startswith("_")
+
+
+class Term(tuple):
+    """
+    A tuple term compiled for fast unification and substitution. Build one with compile_term.
+    variables is the tuple of variable names, in slot order, and code holds the compiled arguments.
+    ground is True if substitution can never change the term.
+    """
+
+    def __new__(cls, term):
+        self = tuple.__new__(cls, term)
+        variables = []
+        self.args = tuple(_compile_argument(arg, variables) for arg in term[1:])
+        self.variables = tuple(variables)
+        self.ground = not variables
+        return self
+
+    def unify(self, candidate, bindings=None):
+        return unify(self, candidate, bindings)
+
+    # Substitute the bindings, returning a plain tuple (or the term itself if it is ground)
+    def substitute(self, bindings):
+        if self.ground:
+            return self
+        values = [bindings[var] if var in bindings else var for var in self.variables]
+        return tuple([self[0]] + [_build(kind, value, values) for (kind, value) in self.args])
+
+    # Unify the arguments against other, a tuple or list of the same length and predicate.
+    # self_is_pattern gives the direction, which matters when a variable meets a variable.
+    def _unify(self, other, bindings, trail, self_is_pattern):
+        if not isinstance(other, (list, tuple)) or len(other) != len(self) or (self and self[0] != other[0]):
+            return False
+        return _unify_arguments(self.args, self.variables, other, bindings, trail, self_is_pattern)
+
+
+# A list or tuple nested inside a Term. Unlike a Term every element, including the first, is compiled,
+# because substitute replaces all the elements of a nested structure.
+class _Sequence(object):
+    __slots__ = ['raw', 'elements', 'ground']
+
+    def __init__(self, raw, variables):
+        self.raw = raw
+        self.elements = tuple(_compile_argument(x, variables) for x in raw)
+        self.ground = all(kind == _CONST for (kind, value) in self.elements)
+
+    def build(self, values):
+        if isinstance(self.raw, list):
+            return [_build(kind, value, values) for (kind, value) in self.elements]
+        elif self.ground:
+            return self.raw
+        return tuple([_build(kind, value, values) for (kind, value) in self.elements])
+
+
+def _compile_argument(arg, variables):
+    if isVar(arg):
+        if arg not in variables:
+            variables.append(arg)
+        return _VAR, variables.index(arg)
+    elif isinstance(arg, (list, tuple)):
+        return _SEQ, _Sequence(arg, variables)
+    return _CONST, arg
+
+
+def _build(kind, value, values):
+    if kind == _VAR:
+        return values[value]
+    elif kind == _SEQ:
+        return value.build(values)
+    return value
+
+
+def compile_term(term):
+    if type(term) is tuple:
+        return Term(term)
+    return term
+
+
+# Unify compiled arguments (args, with variables giving the slot names) against the elements of other
+# from position 1 onwards. This mirrors unify() below, except that which side is a variable is already known
+# for the compiled side.
+def _unify_arguments(args, variables, other, bindings, trail, self_is_pattern):
+    for i in range(len(args)):
+        (kind, value) = args[i]
+        arg = other[i + 1]
+        if kind == _VAR:
+            if self_is_pattern or not isVar(arg):
+                matched = _bind(variables[value], arg, bindings, trail)
+            else:
+                matched = _bind(arg, variables[value], bindings, trail)
+        elif isVar(arg):
+            matched = _bind(arg, value.raw if kind == _SEQ else value, bindings, trail)
+        elif kind == _SEQ:
+            seq = value
+            matched = isinstance(arg, (list, tuple)) and len(arg) == len(seq.raw) \
+                and (not arg or seq.raw[0] == arg[0]) \
+                and _unify_arguments(seq.elements[1:], variables, arg, bindings, trail, self_is_pattern)
+        else:
+            matched = not (arg != value)
+        if not matched:
+            return False
+    return True
+
+
+# Substitute bindings in tuple representation of a term,
+# where the first argument is the predicate.
+# Needs to support structure in the term arguments.
+def substitute(predicate, bindings):
+    if type(predicate) is Term:
+        return predicate.substitute(bindings)
+    if isinstance(predicate, (list, tuple)):
+        args = [substitute_argument(arg, bindings) for arg in predicate[1:]]
+        return tuple([predicate[0]] + args)
+    return substitute_argument(predicate, bindings)
+
+
+def substitute_argument(arg, bindings):
+    if isinstance(arg, list):
+        return [substitute_argument(x, bindings) for x in arg]
+    elif isinstance(arg, tuple):
+        return tuple([substitute_argument(x, bindings) for x in arg])
+    try:
+        return bindings[arg] if arg in bindings else arg
+    except TypeError:  # unhashable arguments can't be bound
+        return arg
+
+
+# Return bindings that would unify the pattern with the candidate, or False.
+# If the match fails, any bindings passed in are left unchanged.
+def unify(pattern, candidate, bindings=None):
+    if bindings is None:
+        bindings = {}   # Cannot create dict in the argslist, or it's shared between every call
+    trail = []
+    if _unify(pattern, candidate, bindings, trail):
+        return bindings
+    _undo(bindings, trail)
+    return False
+
+
+def _unify(pattern, candidate, bindings, trail):
+    if traceUnify:
+        print("Trying unify", pattern, candidate, bindings)
+
+    if type(pattern) is Term:
+        if isVar(candidate):
+            return _bind(candidate, pattern, bindings, trail)
+        return pattern._unify(candidate, bindings, trail, True)
+    elif isVar(pattern):
+        if traceUnify:
+            print("Pattern is variable:", pattern)
+        return _bind(pattern, candidate, bindings, trail)
+    elif type(candidate) is Term:
+        return candidate._unify(pattern, bindings, trail, False)
+    elif isVar(candidate):   # candidate is a variable but pattern is not
+        if traceUnify:
+            print("Candidate", candidate, "is variable, not pattern", pattern)
+        return _bind(candidate, pattern, bindings, trail)  # Use the case above
+    elif isinstance(pattern, (list, tuple)):  # recursively match structures
+        # Assume the first argument is a predicate name which has to be equal
+        if isinstance(candidate, (list, tuple)) and len(pattern) == len(candidate) and (not pattern or pattern[0] == candidate[0]):
+            if traceUnify:
+                print("Pattern", pattern, "is a tuple, recursing")
+            # Match the arguments in the goal and the requirements head
+            for (goalarg, matcharg) in zip(pattern[1:], candidate[1:]):
+                if not _unify(goalarg, matcharg, bindings, trail):
+                    return False
+            return True
+        else:
+            if traceUnify:
+                print("Pattern is a tuple but candidate is not, or has different predicate or length:", pattern, candidate)
+            return False
+    elif candidate != pattern:  # constants must match
+        if traceUnify:
+            print("Non-matching constants")
+        return False
+    else:
+        if traceUnify:
+            print("Same objects")
+        return True
+
+
+# Bind the variable var to candidate
+def _bind(var, candidate, bindings, trail):
+    if var == candidate:
+        return True
+    elif var in bindings and isConstant(bindings[var]):  # treat this as if it were the constant it's bound to. Don't bind vars to vars to avoid loops
+        return _unify(bindings[var], candidate, bindings, trail)
+    elif not isVar(candidate):
+        if var in bindings:  # bound to another variable. Bind them both to this constant
+            _set(bindings, bindings[var], candidate, trail)
+        _set(bindings, var, candidate, trail)
+    elif candidate in bindings:
+        _set(bindings, var, bindings[candidate], trail)
+    else:
+        _set(bindings, var, candidate, trail)
+    return True
+
+
+def _set(bindings, var, value, trail):
+    trail.append((var, bindings.get(var, _UNBOUND)))
+    bindings[var] = value
+
+
+def _undo(bindings, trail):
+    for (var, old_value) in reversed(trail):
+        if old_value is _UNBOUND:
+            del bindings[var]
+        else:
+            bindings[var] = old_value
@@ -3,12 +3,24 @@
 # and an objective function that defines what gets saved from each trial and processed in the Experiment class.
 import json
 from Dash2.core.des_work_processor import WorkProcessor
+from Dash2.core.dash_action import agent_loops
+from Dash2.core.planner_stats import write_planner_report
+from Dash2.core.system1_population import join_population
 
 
 class Trial(object):
     # Class-level information about parameter ranges and distributions.
     parameters = []
     measures = []
+    # If true, each iteration advances all the active agents together, sharing System2 reasoning between
+    # agents with the same rules (see dash_action.agent_loops). Can be set in the trial data.
+    batch_reasoning = False
+    # A file name for a report of the System2 planner counters of the instrumented agents, written at the end
+    # of the trial as CSV if it ends in .csv and otherwise as JSON (see planner_stats.py)
+    planner_report = None
+    # If true, the VectorSystem1Agents among the agents share one PopulationSystem1, so that batched iterations
+    # spread and decay their activation with one operation (see system1_population.py)
+    population_system1 = False
 
     def __init__(self, data={}, max_iterations=-1, zk=None, number_of_hosts=1, exp_id=None, trial_id=None,
                  work_processor_class=WorkProcessor, print_initial_data=True):
@@ -85,6 +97,11 @@ class Trial(object):
 
     # Default method to run one iteration of the trial: run one iteration of every active agent
     def run_one_iteration(self):
+        if self.batch_reasoning:
+            agents = [agent for agent in self.agents if not self.agent_should_stop(agent)]
+            for (agent, next_action) in zip(agents, agent_loops(agents, max_iterations=1)):
+                self.process_after_agent_action(agent, next_action)
+            return
         for agent in self.agents:
             if not self.agent_should_stop(agent):
                 next_action = agent.agent_loop(max_iterations=1, disconnect_at_end=False)  # don't disconnect since will run again
@@ -92,6 +109,8 @@ class Trial(object):
 
     def run(self):
         self.initialize()
+        if self.population_system1:
+            self.system1_population = join_population(self.agents)
         if self.zk is not None: # distributed trial version (uses zookeeper)
             self.run_distributed_trial()
             # self.process_after_run() - this method is called asynchronously via ZK watcher
@@ -103,6 +122,8 @@ class Trial(object):
                 self.process_after_iteration()
                 self.iteration += 1
             self.process_after_run()
+            if self.planner_report is not None:
+                write_planner_report(self.agents, self.planner_report)
             for agent in self.agents:
                 agent.disconnect()
 
@@ -2,20 +2,27 @@
 # this is adapted from http://ilab.cs.byu.edu/python/threadingmodule.html
 import sys
 sys.path.extend(['../../']) # need to have 'webdash' directory in $PYTHONPATH, if we want to run script (as "__main__")
+import asyncio
 import select
 import socket
 import threading
 import struct
-import pickle
 import re
 import traceback
-from Dash2.core.communication_aux import message_types
+from Dash2.core.communication_aux import message_types, ReceiveBuffer
+from Dash2.core.message_codecs import codecs, pickle_codec, choose_codec
 
 
 class WorldHub:
 
     lowest_unassigned_id = 0
-    lock = threading.Lock()
+    lock = threading.RLock()  # reentrant, since the items of a batch are handled holding the lock
+    # If true, run serves all the clients from one asyncio event loop (see runAsyncio) instead of starting a
+    # thread for each client. The messages and the process... methods below are the same in both modes.
+    use_asyncio = False
+    # The codecs for message payloads the hub agrees to when a client offers them at register (see
+    # message_codecs.py). Hubs whose responses contain objects other than plain data should only allow pickle.
+    codecs = list(codecs)
 
     ############################################################
     # you should only need to modify a few world hub functions #
@@ -85,6 +92,8 @@ class WorldHub:
         self.request_history = True
 
     def run(self):
+        if self.use_asyncio:
+            return self.runAsyncio()
         # attempt to open a socket with initialized values.
         print("opening socket...")
         try:
@@ -132,19 +141,237 @@ class WorldHub:
     def createServeClientThread(self, client_address_tuple):
         return ServeClientThread(self, client_address_tuple)
 
+    # Serve clients from one asyncio event loop until q is entered or stopAsyncio is called. Each client
+    # connection is a coroutine rather than a thread, so tens of thousands of agents can stay connected.
+    # The process... methods are called from the event loop one request at a time, so they should not block.
+    def runAsyncio(self):
+        asyncio.run(self.serveAsyncio())
+        self.terminateWork()
+
+    async def serveAsyncio(self):
+        print("opening socket...")
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.connections = set()
+        try:
+            self.server = await asyncio.start_server(self.serveClientConnection, self.host, self.port,
+                                                     backlog=max(self.backlog, 4096))
+        except OSError as err:
+            print("could not open. socket. following error occurred: {}".format(err))
+            sys.exit(1)
+        print("successfully opened socket. listening for new connections...")
+        print("if you wish to quit the server program, enter q")
+        try:
+            self.loop.add_reader(sys.stdin, self.readStdin)
+        except (ValueError, OSError, NotImplementedError):  # stdin can't be watched, so only stopAsyncio stops
+            pass
+        await self.stopping.wait()
+        print("quitting program as requested by user...")
+        self.loop.remove_reader(sys.stdin)
+        self.server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+        await self.server.wait_closed()
+
+    def readStdin(self):
+        user_input = sys.stdin.readline()
+        if user_input == "q\n":
+            self.stopping.set()
+        elif user_input == "":  # end of file
+            self.loop.remove_reader(sys.stdin)
+        else:
+            print("if you wish to quit, enter q.")
+
+    # Stop runAsyncio, from any thread
+    def stopAsyncio(self):
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serveClientConnection(self, reader, writer):
+        connection = self.createServeClientConnection(reader, writer)
+        connection.trace_handler = self.trace_handler
+        self.connections.add(connection)
+        try:
+            await connection.run()
+        finally:
+            self.connections.discard(connection)
+
+    # The asyncio version of createServeClientThread, to be overridden to point to a ServeClientConnection subclass
+    def createServeClientConnection(self, reader, writer):
+        return ServeClientConnection(self, reader, writer)
+
 
     # This method is intended to operations need before termination of the hub. For example, releaseing OS resources,
     # handling persistance, dumping cansh into files, etc.
     def terminateWork(self):
         pass
 
-class ServeClientThread(threading.Thread):
+
+# The methods that turn a client request into a call on the hub, shared by ServeClientThread and
+# ServeClientConnection. Subclasses set self.hub and self.trace_handler.
+class ClientRequestHandler(object):
+    codec = pickle_codec  # for the payloads of the messages on this connection
+    next_codec = None  # the codec agreed at register, used once the register response is sent
+
+    # A client may offer codecs after the aux data, in which case the chosen one is added to the response
+    def handleRegisterRequest(self, message):
+        if self.trace_handler:
+            print('handling registration request...')
+        aux_data = message[0]
+        response = self.processRegisterRequestWrapper(aux_data)
+        if len(message) > 1:
+            codec_name = choose_codec(message[1], self.hub.codecs)
+            self.next_codec = codecs[codec_name]
+            response = list(response) + [codec_name]
+        return response
+
+    def encodeResponse(self, unserialized_message):
+        serialized_message = self.codec.encode(unserialized_message)
+        if self.next_codec is not None:
+            self.codec = self.next_codec
+            self.next_codec = None
+        return serialized_message
+
+    def handleSendActionRequest(self, message):
+        if self.trace_handler:
+            print('handling send action request for', self, '...')
+        id = message[0]
+        action = message[1]
+        aux_data = message[2]
+        return self.processSendActionRequest(id, action, aux_data)
+
+    def handleGetUpdatesRequest(self, message):
+        if self.trace_handler:
+            print('handling get updates request...')
+        id = message[0]
+        aux_data = message[1]
+        return self.processGetUpdatesRequest(id, aux_data)
+
+    # Handle the send_action and get_updates items of a batch while holding the hub's lock, so that no other
+    # request is handled between them, and reply with their responses under the batch's request id
+    def handleBatchRequest(self, message):
+        request_id = message[0]
+        items = message[1]
+        if self.trace_handler:
+            print('handling batch request', request_id, 'with', len(items), 'items...')
+        responses = []
+        with self.hub.lock:
+            for (message_type, contents) in items:
+                if message_types['send_action'] == message_type:
+                    responses.append(self.handleSendActionRequest(contents))
+                elif message_types['get_updates'] == message_type:
+                    responses.append(self.handleGetUpdatesRequest(contents))
+                else:
+                    print("message type %s can't be batched" % message_type)
+                    responses.append(None)
+        return [request_id, responses]
+
+    def handleDisconnectRequest(self, message):
+        if self.trace_handler:
+            print('handling disconnect request...')
+        id = message[0]
+        aux_data = message[1]
+        return self.processDisconnectRequest(id, aux_data)
+
+    def processRegisterRequestWrapper(self, aux_data):
+        with self.hub.lock:
+            assigned_id = self.hub.lowest_unassigned_id
+            self.hub.lowest_unassigned_id += 1
+        return self.processRegisterRequest(assigned_id, aux_data)
+
+    ######################################################################
+    # the following functions are wrappers that call world hub functions #
+    #                                                                    #
+    # you probably shouldn't need to modify them                         #
+    ######################################################################
+
+    def processRegisterRequest(self, id, aux_data):
+        return self.hub.processRegisterRequest(id, aux_data)
+
+    def processGetUpdatesRequest(self, id, aux_data):
+        return self.hub.processGetUpdatesRequest(id, aux_data)
+            
+    def processSendActionRequest(self, id, action, aux_data):
+        return self.hub.processSendActionRequest(id, action, aux_data)
+
+    def processDisconnectRequest(self, id, aux_data):
+        return self.hub.processDisconnectRequest(id, aux_data)
+
+    # I don't know why this was here...
+    # Are there instances where we'd want the client to simply change 
+    # world state without performing an action?
+    # And if so, why not just send action = None or something instead?
+#    def updateState(self, id, action, aux_data):
+#        return self.hub.updateState(id, action, aux_data)
+
+    def getUpdates(self, id, aux_data):
+        return self.hub.getUpdates(id, aux_data)
+
+
+# Serves one client connection in WorldHub.runAsyncio, reading requests from an asyncio stream
+class ServeClientConnection(ClientRequestHandler):
+
+    def __init__(self, hub, reader, writer):
+        self.hub = hub
+        self.reader = reader
+        self.writer = writer
+        self.trace_handler = True
+        self.running = False
+
+    async def run(self):
+        try:
+            self.running = True
+            while self.running:
+                [message_type, message] = await self.getClientRequest()
+                if self.trace_handler:
+                    print("received following information in client request:")
+                    print("message type: %s" % message_type)
+                    print("message: %s" % message)
+                self.handleClientRequest(message_type, message)
+                await self.writer.drain()
+            print('Client disconnected')
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError) as e:
+            print("closing connection...", e)
+        except BaseException as e:
+            print("closing connection...", e)
+            traceback.print_exc()
+        finally:
+            self.writer.close()
+
+    async def getClientRequest(self):
+        message_type, message_len = struct.unpack("!II", await self.reader.readexactly(8))
+        return [message_type, self.codec.decode(await self.reader.readexactly(message_len))]
+
+    def handleClientRequest(self, message_type, message_payload):
+        if message_types['register'] == message_type:
+            response = self.handleRegisterRequest(message_payload)
+        elif message_types['send_action'] == message_type:
+            response = self.handleSendActionRequest(message_payload)
+        elif message_types['get_updates'] == message_type:
+            response = self.handleGetUpdatesRequest(message_payload)
+        elif message_types['batch'] == message_type:
+            response = self.handleBatchRequest(message_payload)
+        elif message_types['disconnect'] == message_type:
+            self.handleDisconnectRequest(message_payload)
+            self.running = False
+            return
+        else:
+            print("uhoh!")
+            response = None
+        self.sendMessage(response)
+
+    def sendMessage(self, unserialized_message):
+        serialized_message = self.encodeResponse(unserialized_message)
+        self.writer.write(struct.pack("!I", len(serialized_message)) + serialized_message)
+
+
+class ServeClientThread(ClientRequestHandler, threading.Thread):
 
     def __init__(self, hub, client_address_tuple):
         threading.Thread.__init__(self)
         self.client = client_address_tuple[0]
         self.address = client_address_tuple[1]
         self.size = 1024
+        self.receive_buffer = ReceiveBuffer()
         self.hub = hub
         self.trace_handler = True
         self.running = False
@@ -181,37 +408,21 @@ class ServeClientThread(threading.Thread):
         # read first 4 bytes for message len
         if self.trace_handler:
             print("getting message type and message length...")
-        bytes_read = 0
-        bytes_expected = 8
-        message_header = b''
-        while bytes_read < bytes_expected:
-            data = self.client.recv(bytes_expected - bytes_read)
-            if data:
-                message_header += data
-                bytes_read += len(data)
-            else:
-                self.client.close()
-                running = 0
-        message_type, message_len = struct.unpack("!II", message_header)
+        try:
+            message_type, message_len = struct.unpack_from("!II", self.receive_buffer.receive(self.client, 8))
 
-        if self.trace_handler:
-            print("message type: %d" % message_type)
-            print("message len: %d" % message_len)
+            if self.trace_handler:
+                print("message type: %d" % message_type)
+                print("message len: %d" % message_len)
 
-        # read payload
-        if self.trace_handler:
-            print("getting payload...")
-        bytes_read = 0
-        bytes_expected = message_len
-        message = "".encode()
-        while bytes_read < bytes_expected:
-            data = self.client.recv(bytes_expected - bytes_read)
-            if data:
-                message += data
-                bytes_read += len(data)
-            else:
-                self.client.close()
-        message_payload = pickle.loads(message)
+            # read payload into the buffer, which is decoded without copying it
+            if self.trace_handler:
+                print("getting payload...")
+            message = self.receive_buffer.receive(self.client, message_len)
+        except ConnectionError:
+            self.client.close()
+            raise
+        message_payload = self.codec.decode(message)
 
         if self.trace_handler:
             print("successfully retrieved payload %s ... returning." % message_payload)
@@ -223,12 +434,15 @@ class ServeClientThread(threading.Thread):
         #    0: register id, update state
         #    1: handle action, update state, relay relevant observations to client
         #    2: relay recent observations to client
+        # and 4, a batch of 1 and 2 requests, answered together
         if message_types['register'] == message_type:
             response = self.handleRegisterRequest(message_payload)
         elif message_types['send_action'] == message_type:
             response = self.handleSendActionRequest(message_payload)
         elif message_types['get_updates'] == message_type:
             response = self.handleGetUpdatesRequest(message_payload)
+        elif message_types['batch'] == message_type:
+            response = self.handleBatchRequest(message_payload)
         elif message_types['disconnect'] == message_type:
             self.handleDisconnectRequest(message_payload)
             try:
@@ -247,76 +461,13 @@ class ServeClientThread(threading.Thread):
         return
 
     def sendMessage(self, unserialized_message):
-        serialized_message = pickle.dumps(unserialized_message)
+        serialized_message = self.encodeResponse(unserialized_message)
         message_len = len(serialized_message)
         message = struct.pack("!I", message_len) + serialized_message
         self.client.sendall(message)
         
         return
     
-    def handleRegisterRequest(self, message):
-        if self.trace_handler:
-            print('handling registration request...')
-        aux_data = message[0]
-        return self.processRegisterRequestWrapper(aux_data)
-
-    def handleSendActionRequest(self, message):
-        if self.trace_handler:
-            print('handling send action request for', self, '...')
-        id = message[0]
-        action = message[1]
-        aux_data = message[2]
-        return self.processSendActionRequest(id, action, aux_data)
-
-    def handleGetUpdatesRequest(self, message):
-        if self.trace_handler:
-            print('handling get updates request...')
-        id = message[0]
-        aux_data = message[1]
-        return self.processGetUpdatesRequest(id, aux_data)
-
-    def handleDisconnectRequest(self, message):
-        if self.trace_handler:
-            print('handling disconnect request...')
-        id = message[0]
-        aux_data = message[1]
-        return self.processDisconnectRequest(id, aux_data)
-
-    def processRegisterRequestWrapper(self, aux_data):
-        with self.hub.lock:
-            assigned_id = self.hub.lowest_unassigned_id
-            self.hub.lowest_unassigned_id += 1
-        return self.processRegisterRequest(assigned_id, aux_data)
-
-    ######################################################################
-    # the following functions are wrappers that call world hub functions #
-    #                                                                    #
-    # you probably shouldn't need to modify them                         #
-    ######################################################################
-
-    def processRegisterRequest(self, id, aux_data):
-        return self.hub.processRegisterRequest(id, aux_data)
-
-    def processGetUpdatesRequest(self, id, aux_data):
-        return self.hub.processGetUpdatesRequest(id, aux_data)
-            
-    def processSendActionRequest(self, id, action, aux_data):
-        return self.hub.processSendActionRequest(id, action, aux_data)
-
-    def processDisconnectRequest(self, id, aux_data):
-        return self.hub.processDisconnectRequest(id, aux_data)
-
-    # I don't know why this was here...
-    # Are there instances where we'd want the client to simply change 
-    # world state without performing an action?
-    # And if so, why not just send action = None or something instead?
-#    def updateState(self, id, action, aux_data):
-#        return self.hub.updateState(id, action, aux_data)
-
-    def getUpdates(self, id, aux_data):
-        return self.hub.getUpdates(id, aux_data)
-
-
 first_cap_re = re.compile('(.)([A-Z][a-z]+)')
 all_cap_re = re.compile('([a-z0-9])([A-Z])')
 
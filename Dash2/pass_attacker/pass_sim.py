@@ -30,6 +30,7 @@ Probably the uncanniness will depend on those numbers, which points to the value
 import sys; sys.path.extend(['../../'])
 from Dash2.core.dash_agent import DASHAgent
 from Dash2.core.parameter import Parameter
+from Dash2.core.system1 import LinkSpec
 from Dash2.core.system2 import isVar
 from Dash2.core.measure import Measure
 from Dash2.pass_attacker.utils import distPicker
@@ -136,7 +137,9 @@ transient doWork
         self.trace_action = True
 
         # Same passwords reinforce across services. Different passwords inhibit each other on one service.
-        self.create_neighbor_rule('password', self.link_password_nodes)
+        # Nodes ('password', service, password) are linked with weight -1 to nodes with the same service (argument 1)
+        # and otherwise with weight +1 to nodes with the same password (argument 2).
+        self.create_neighbor_rule('password', [LinkSpec(1, -1), LinkSpec(2, 1)])
 
 
 
@@ -483,21 +486,6 @@ transient doWork
     def password_complexity(self, password):
         return len(password)
 
-    # System 1 neighbor rule:
-    # Same passwords reinforce across services. Different passwords inhibit each other on one service.
-    def link_password_nodes(self, node):
-        (p, service, password) = node.fact
-        for other in self.nodes:
-            if other == node or not isinstance(other.fact, (tuple, list)) or not len(other.fact) > 2:
-                continue
-            elif other.fact[1] == service:
-                node.add_neighbor(other, -1)
-                other.add_neighbor(node, -1)
-            elif other.fact[2] == password:
-                node.add_neighbor(other, 1)
-                other.add_neighbor(node, 1)
-        #print 'linked', node
-
     # This is a measure that can be called on the agent at any time, returning the proportion of logins
     # where the agent also attempted to reset the password
     def proportion_of_resets(self):
@@ -1,4 +1,5 @@
 from Dash2.core.des_agent import DESAgent
+from Dash2.core.event_times import model_next_event_times
 from Dash2.posam.utils import *
 
 import random
@@ -109,3 +110,10 @@ class GithubProbabilisticAgent(DESAgent):
         else:
             return None
 
+    # overrides next_event_times() from DESAgent with numpy versions of the same models (see event_times.py)
+    def next_event_times(self, agents_data, curr_times, start_time, max_time):
+        if self.test_interval is None:
+            number_of_days_in_simulation = count_days(start_time, max_time)
+            self.test_interval = number_of_days_in_simulation * SECONDS_IN_DAY
+        return model_next_event_times(self, agents_data, curr_times, start_time, max_time)
+
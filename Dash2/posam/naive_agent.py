@@ -2,6 +2,8 @@ import sys; sys.path.extend(['../../'])
 import json
 import collections
 from Dash2.core.des_agent import DESAgent
+from Dash2.core.event_log import write_event
+from Dash2.core.event_times import model_next_event_times
 import random
 from Dash2.posam.utils import *
 
@@ -64,8 +66,7 @@ class NaiveAgent(DESAgent):
         return False
 
     def log_event(self, log_data, log_file=None, format='json', verbose=False):
-        json.dump(log_data, self.hub.json_log_file)
-        self.hub.json_log_file.write("\n")
+        write_event(self.hub.json_log_file, log_data)
 
     ####################################################################################################################
     # overrides next_event_time(**kwargs) from DESAgent
@@ -122,6 +123,13 @@ class NaiveAgent(DESAgent):
         else:
             return None
 
+    # overrides next_event_times() from DESAgent with numpy versions of the same models (see event_times.py)
+    def next_event_times(self, agents_data, curr_times, start_time, max_time):
+        if self.test_interval is None:
+            number_of_days_in_simulation = count_days(start_time, max_time)
+            self.test_interval = number_of_days_in_simulation * SECONDS_IN_DAY
+        return model_next_event_times(self, agents_data, curr_times, start_time, max_time)
+
     def _generate_node_id(self):
         self.res_id_counter += 1
         return "r" + str(self.res_id_counter)
@@ -1,6 +1,8 @@
 import sys; sys.path.extend(['../../'])
+import numpy as np
 from Dash2.socsim_core.output_event_log_utils import sort_data_and_prob_to_cumulative_array, random_pick_sorted
 from Dash2.core.dash_agent import DASHAgent
+from Dash2.core.event_times import periodic_next_times, in_interval
 
 AVG_MONTH_LENTH_SEC = (365.0/12.0)*24.0*3600.0
 
@@ -163,6 +165,29 @@ class SocsimMixin(object):
         else:
             return None
 
+    def event_deltas(self, agent_ids):
+        return AVG_MONTH_LENTH_SEC / np.array([float(self.hub.graph.nodes[agent_id]["r"]) for agent_id in agent_ids])
+
+    def first_event_times(self, agent_ids, start_time, max_time):
+        """
+        first_event_time() for the agents with the given ids at once, catching up to start_time in closed form
+        (see event_times.py). Returns a time or None for each agent.
+        """
+        last_times = [self.hub.graph.nodes[agent_id]["let"] for agent_id in agent_ids]
+        known = np.array([let is not None and let != -1 for let in last_times], dtype=bool)
+        next_times = periodic_next_times([let if ok else start_time for (let, ok) in zip(last_times, known)],
+                                         self.event_deltas(agent_ids), start_time, max_time)
+        next_times[~known] = start_time if max_time >= start_time else np.nan
+        return [None if next_time != next_time else next_time for next_time in next_times.tolist()]
+
+    def next_event_times(self, agent_ids, curr_times, start_time, max_time):
+        """
+        next_event_time() for the agents with the given ids at once. Returns a time or None for each agent.
+        """
+        next_times = in_interval(np.asarray(curr_times, dtype=float) + self.event_deltas(agent_ids), start_time,
+                                 max_time)
+        return [None if next_time != next_time else next_time for next_time in next_times.tolist()]
+
 class SocsimAgent(SocsimMixin, DASHAgent):
     def __init__(self, **kwargs):
         DASHAgent.__init__(self)
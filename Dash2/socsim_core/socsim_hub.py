@@ -1,5 +1,6 @@
 import sys; sys.path.extend(['../../'])
 from Dash2.core.world_hub import WorldHub
+from Dash2.core.event_log import event_log_writer, close_event_log
 #from Dash2.github_baseline.zk_repo import ZkRepo
 from Dash2.socsim_core.output_event_log_utils import random_pick_sorted
 import datetime
@@ -24,6 +25,7 @@ class SocsimHub(WorldHub):
 
         self.csv_log_file = open(output_file_name + self.task_full_id + '_event_log_file.csv', 'w')
         self.json_log_file = open(output_file_name + self.task_full_id + '_event_log_file.json', 'w')
+        self.csv_log = event_log_writer(self.csv_log_file, 'csv')
 
         # global event clock
         self.time = start_time
@@ -51,6 +53,7 @@ class SocsimHub(WorldHub):
         pass
 
     def close_event_log(self):
+        close_event_log(self.csv_log_file)
         self.csv_log_file.close()
         self.json_log_file.close()
 
@@ -59,14 +62,7 @@ class SocsimHub(WorldHub):
         self.print_to_json_log(user_id, resource_id, event_type, int(time), additional_attributes)
 
     def print_to_csv_log(self, user_id, resource_id, event_type, time, additional_attributes):
-        self.csv_log_file.write(time)
-        self.csv_log_file.write(",")
-        self.csv_log_file.write(event_type)
-        self.csv_log_file.write(",")
-        self.csv_log_file.write(str(user_id))
-        self.csv_log_file.write(",")
-        self.csv_log_file.write(str(resource_id))
-        self.csv_log_file.write("\n")
+        self.csv_log.write((time, event_type, str(user_id), str(resource_id)))
 
     def print_to_json_log(self, user_id, resource_id, event_type, time, additional_attributes):
         json_object = {"nodeID": str(self._try_to_convert_resource_id_to_original_id(resource_id)),
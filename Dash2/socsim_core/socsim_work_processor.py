@@ -5,8 +5,8 @@ import psutil
 import time
 import _pickle as pickle
 import json
-from heapq import heappush, heappop
 from Dash2.core.des_work_processor import WorkProcessor
+from Dash2.core.event_schedulers import event_scheduler
 from Dash2.socsim_core.network_utils import RESOURCE_INT_ID_OFFSET
 
 
@@ -16,9 +16,13 @@ class SocsimWorkProcessor(WorkProcessor):
     # this is path to current package. Trial class needs it
     module_name = "Dash2.socsim.socsim_work_processor"
 
+    # the kind of event queue, which can be set in the experiment parameters (see event_schedulers.py)
+    scheduler = 'heap'
+    bucket_width = None
+
     def initialize(self):
         self.agents_decision_data = {}
-        self.events_heap = []
+        self.event_queue = event_scheduler(self.scheduler, self.bucket_width)
         self.event_counter = 0
         self.task_start_time = time.time()
 
@@ -46,15 +50,15 @@ class SocsimWorkProcessor(WorkProcessor):
         self.hub.reverse_model_repo_ids_file = self.reverse_model_repo_ids if hasattr(self, 'reverse_model_repo_ids') else None
         self.hub.reverse_model_event_probabilities_file = self.reverse_model_event_probabilities if hasattr(self, 'reverse_model_event_probabilities') else None
 
-        for node_id in self.hub.graph:
-            if self.hub.graph.nodes[node_id]["isU"] == 1:
-                if self.hub.graph.degree(node_id) > 0:
-                    decision_data = self.agent.create_new_decision_object(node_id)
-                    self.agent.decision_data = decision_data
-                    first_event_time = self.agent.first_event_time(self.start_time, self.max_time)
-                    if first_event_time is not None: # agents that are not active in the give time interval will be skipped.
-                        heappush(self.events_heap, (first_event_time, decision_data.id))
-                        self.agents_decision_data[decision_data.id] = decision_data # node_id == decision_data
+        user_ids = [node_id for node_id in self.hub.graph
+                    if self.hub.graph.nodes[node_id]["isU"] == 1 and self.hub.graph.degree(node_id) > 0]
+        first_event_times = self.agent.first_event_times(user_ids, self.start_time, self.max_time)
+        for (node_id, first_event_time) in zip(user_ids, first_event_times):
+            decision_data = self.agent.create_new_decision_object(node_id)
+            self.agent.decision_data = decision_data
+            if first_event_time is not None: # agents that are not active in the give time interval will be skipped.
+                self.event_queue.push(first_event_time, decision_data.id)
+                self.agents_decision_data[decision_data.id] = decision_data # node_id == decision_data
 
         self.hub.agents_decision_data = self.agents_decision_data # will not work for distributed version
         self.hub.finalize_statistics()
@@ -86,14 +90,14 @@ class SocsimWorkProcessor(WorkProcessor):
             self.hub.root_node_ids = self.root_node_ids
 
     def run_one_iteration(self):
-        event_time, agent_id = heappop(self.events_heap)
+        event_time, agent_id = self.event_queue.pop()
         decision_data = self.agents_decision_data[int(agent_id)]
         self.hub.set_curr_time(event_time)
         self.agent.decision_data = decision_data
         self.agent.agent_loop(max_iterations=1, disconnect_at_end=False)
         next_event_time = self.agent.next_event_time(event_time,self.start_time, self.max_time)
         if next_event_time is not None:
-            heappush(self.events_heap, (next_event_time, agent_id))
+            self.event_queue.push(next_event_time, agent_id)
         self.event_counter += 1
 
     def should_stop(self):
@@ -101,7 +105,7 @@ class SocsimWorkProcessor(WorkProcessor):
             print('reached end of iterations for trial')
             self.hub.memory_usage = self._get_current_memory_usage()
             return True
-        if len(self.events_heap) == 0:
+        if len(self.event_queue) == 0:
             print('reached end of event queue, no more events')
             self.hub.memory_usage = self._get_current_memory_usage()
             return True